@@ -1,72 +1,92 @@
+import time
+# 启动计时的起点, 在其余导入之前取得
+startup_started = time.perf_counter()
 import numpy as np
-import random
 import math
 import sys
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import QTimer, Qt
 from PyQt5.QtGui import QFont, QIcon
-import pyqtgraph.opengl as gl
 import json
 import os
+import queue
 from datetime import datetime
-
-cosmology_data = {
-    "DARK_MATTER": ("DM", 1.0, 0, 1e30, 0, (0.2, 0.2, 0.6, 1)),
-    "DARK_ENERGY": ("DE", 0.0, 0, 1e30, 0, (0.6, 0.2, 0.6, 1)),
-    "HYDROGEN": ("H", 0.938, 1, 1e30, 0.5, (0.1, 0.5, 0.9, 1)),
-    "HELIUM": ("He", 3.727, 2, 1e30, 0, (0.3, 0.7, 0.9, 1)),
-    "NEUTRON": ("n", 0.940, 0, 880, 0.5, (0.7, 0.7, 0.7, 1)),
-    "PHOTON": ("γ", 0, 0, 1e30, 1, (1, 1, 0.8, 1)),
-    "NEUTRINO": ("ν", 1e-9, 0, 1e30, 0.5, (0.8, 0.8, 1, 1)),
-    "ELECTRON": ("e-", 0.000511, -1, 1e30, 0.5, (1, 0.3, 0.3, 1)),
-    "PROTON": ("p+", 0.938, 1, 1e30, 0.5, (1, 0.5, 0.5, 1)),
-    "QUARK_UP": ("u", 0.003, 0.667, 1e30, 0.5, (0.9, 0.2, 0.2, 1)),
-    "QUARK_DOWN": ("d", 0.006, -0.333, 1e30, 0.5, (0.2, 0.2, 0.9, 1)),
-    "GRAVITON": ("G", 0, 0, 1e30, 2, (0.5, 0.8, 0.5, 1)),
-    "STAR": ("★", 1000, 0, 1e20, 0, (1, 1, 0.3, 1)),
-    "GALAXY": ("🌀", 10000, 0, 1e25, 0, (0.8, 0.4, 0.8, 1)),
-    "BLACK_HOLE": ("●", 100000, 0, 1e30, 0, (0.1, 0.1, 0.1, 1))
-}
-
-def initialize_simulator_state():
-    return {
-        'particles': [],
-        'interaction_events': [],
-        'gravitational_pairs': [],
-        'time': 0.0,
-        'scale_factor': 1.0,
-        'event_counter': 0,
-        'particle_counter': 0,
-        'interaction_distance': 0.5,
-        'fusion_probability': 0.1,
-        'structure_formation_probability': 0.05,
-        'initial_energy': 3.0,
-        'num_particles': 20,
-        'universe_age': 13.8,
-        'dark_matter_ratio': 0.27,
-        'dark_energy_ratio': 0.68,
-        'baryonic_ratio': 0.05,
-        'expansion_rate': 0.00002,
-        'gravitational_constant': 1e-15,
-        'cosmic_inflation': False,
-        'quantum_fluctuations': True,
-        'max_position': 10.0
-    }
+from cosmic_engine import (initialize_simulator_state, initialize_particles, build_cosmos_config,
+                           save_cosmos_config, load_cosmos_config, CosmosConfigError, COSMOS_VERSION,
+                           PARTICLE_TYPES, TYPE_COLOR, cosmology_data)
+from checkpoint import CHECKPOINT_SUFFIX, CheckpointError, load_checkpoint
+from profiling import PhaseProfiler, StartupTimer, export_profiles
+from simulation_worker import SimulationWorker
+from recording import (RECORDING_SUFFIX, REPLAY_FRAMES_PER_SECOND, RecordingError, RecordingReader,
+                       ReplayPlayer, RunRecorder)
+from gl_scene import SceneLayer, add_backdrop
+from lod import DEFAULT_POINT_BUDGET
+from backends import DEFAULT_BACKEND, available_backends
+from parallel import DEFAULT_THREADS
+from integrators import DEFAULT_INTEGRATOR, DEFAULT_TIMESTEP_ACCURACY
+from particle_mesh import DEFAULT_MESH_SIZE
+
+startup = StartupTimer(startup_started)
+startup.mark('imports')
 
 simulator_state = initialize_simulator_state()
 
 particles = []
 interaction_events = []
 gravitational_pairs = []
-particle_items = []
-trajectory_items = []
-interaction_items = []
-info_items = []
+scene = None
 is_running = False
 simulation_speed = 5
 timer = None
+worker = None
+last_rendered_frame = None
+last_view = None
+checkpoint_results = queue.Queue()
+recording_results = queue.Queue()
+is_recording = False
+# 回放录像时的播放器与播放位置 (帧号, 可为小数); 为 None 时显示实时模拟
+replay_player = None
+replay_position = 0.0
+replay_clock = 0.0
+replay_playing = False
+last_replay_frame = None
+# 界面线程的渲染计时; 物理线程的计时在 worker.profiler 中
+render_profiler = PhaseProfiler()
+last_performance_update = 0.0
+PERFORMANCE_UPDATE_INTERVAL = 0.5
+last_history_update = 0.0
+HISTORY_UPDATE_INTERVAL = 0.5
+EVENT_LABELS = {
+    'nuclear_fusion': '核聚变',
+    'star_formation': '恒星形成',
+    'galaxy_formation': '星系形成',
+    'black_hole_formation': '黑洞形成',
+}
+PHASE_LABELS = {
+    'filter': '过滤',
+    'neighbor_index': '邻居表',
+    'gravity': '引力',
+    'integration': '积分',
+    'trails': '轨迹',
+    'fusion': '反应',
+    'snapshot': '快照',
+}
+# 配置文件中记录的随机种子; 为 None 时每次重置使用新的种子
+random_seed = None
+# 界面按显示刷新率读取最新快照, 与物理步进的节拍无关
+DISPLAY_INTERVAL_MS = 16
+# pyqtgraph 与 pyqtgraph.opengl 导入较慢, 在窗口显示之后由 build_scene 导入并创建三维视图和历史曲线
+pg = None
 gl_widget = None
 stats_label = None
+history_plots = None
+composition_plot = None
+scale_factor_plot = None
+scale_factor_curve = None
+# 粒子类型码 -> 组成曲线, 某类粒子第一次出现时创建
+composition_curves = {}
+show_performance = None
+performance_label = None
 composition_button = None
 composition_label = None
 initial_energy_spin = None
@@ -84,10 +104,19 @@ fusion_prob_spin = None
 structure_prob_spin = None
 particle_count_spin = None
 show_trajectories = None
+trail_length_spin = None
+point_budget_spin = None
 show_interaction_effects = None
 show_particle_info = None
 inflation_checkbox = None
 quantum_fluctuations_checkbox = None
+gravity_solver_combo = None
+opening_angle_spin = None
+mesh_size_spin = None
+compute_backend_combo = None
+compute_threads_spin = None
+integrator_combo = None
+timestep_accuracy_spin = None
 
 app = QApplication(sys.argv)
 app.setStyle('Windows')
@@ -164,6 +193,65 @@ quantum_fluctuations_checkbox.setChecked(True)
 physics_layout.addWidget(inflation_checkbox)
 physics_layout.addWidget(quantum_fluctuations_checkbox)
 
+gravity_layout = QHBoxLayout()
+gravity_solver_combo = QComboBox()
+gravity_solver_combo.addItem("网格邻居表", 'cell_list')
+gravity_solver_combo.addItem("直接求和", 'direct')
+gravity_solver_combo.addItem("Barnes-Hut 八叉树", 'barnes_hut')
+gravity_solver_combo.addItem("粒子网格 (PM)", 'particle_mesh')
+gravity_solver_combo.addItem("P³M (网格 + 近场逐对)", 'p3m')
+opening_angle_spin = QDoubleSpinBox()
+opening_angle_spin.setRange(0.1, 1.5)
+opening_angle_spin.setValue(0.5)
+opening_angle_spin.setSingleStep(0.1)
+gravity_layout.addWidget(QLabel("引力求解:"))
+gravity_layout.addWidget(gravity_solver_combo)
+gravity_layout.addWidget(QLabel("开角:"))
+gravity_layout.addWidget(opening_angle_spin)
+mesh_size_spin = QSpinBox()
+mesh_size_spin.setRange(8, 128)
+mesh_size_spin.setValue(DEFAULT_MESH_SIZE)
+mesh_size_spin.setSingleStep(8)
+gravity_layout.addWidget(QLabel("网格:"))
+gravity_layout.addWidget(mesh_size_spin)
+physics_layout.addLayout(gravity_layout)
+
+backend_layout = QHBoxLayout()
+compute_backend_combo = QComboBox()
+compute_backend_combo.addItem("自动", 'auto')
+compute_backend_combo.addItem("参考实现 (慢)", 'reference')
+compute_backend_combo.addItem("NumPy", 'numpy')
+compute_backend_combo.addItem("Numba JIT", 'numba')
+# 未安装 numba 时该项不可选
+compute_backend_combo.model().item(3).setEnabled('numba' in available_backends())
+compute_backend_combo.setCurrentIndex(max(compute_backend_combo.findData(DEFAULT_BACKEND), 0))
+backend_layout.addWidget(QLabel("计算后端:"))
+backend_layout.addWidget(compute_backend_combo)
+compute_threads_spin = QSpinBox()
+compute_threads_spin.setRange(0, 256)
+compute_threads_spin.setSpecialValueText("全部核心")
+compute_threads_spin.setValue(DEFAULT_THREADS)
+compute_threads_spin.setToolTip("引力与反应候选对分块并行计算的线程数, 结果与线程数无关")
+backend_layout.addWidget(QLabel("线程:"))
+backend_layout.addWidget(compute_threads_spin)
+physics_layout.addLayout(backend_layout)
+
+integrator_layout = QHBoxLayout()
+integrator_combo = QComboBox()
+integrator_combo.addItem("显式欧拉 (固定步长)", 'euler')
+integrator_combo.addItem("蛙跳 KDK (分级步长)", 'leapfrog')
+timestep_accuracy_spin = QDoubleSpinBox()
+timestep_accuracy_spin.setDecimals(3)
+timestep_accuracy_spin.setRange(0.001, 0.5)
+timestep_accuracy_spin.setSingleStep(0.005)
+timestep_accuracy_spin.setValue(DEFAULT_TIMESTEP_ACCURACY)
+timestep_accuracy_spin.setToolTip("蛙跳积分器的时间步精度参数, 越小步长越细, 能量误差越小")
+integrator_layout.addWidget(QLabel("积分器:"))
+integrator_layout.addWidget(integrator_combo)
+integrator_layout.addWidget(QLabel("精度:"))
+integrator_layout.addWidget(timestep_accuracy_spin)
+physics_layout.addLayout(integrator_layout)
+
 sim_group = QGroupBox("模拟控制")
 sim_layout = QVBoxLayout(sim_group)
 start_btn = QPushButton("▶ 开始模拟")
@@ -180,6 +268,36 @@ sim_layout.addWidget(QLabel("模拟速度:"))
 sim_layout.addWidget(speed_slider)
 sim_layout.addWidget(speed_label)
 
+replay_group = QGroupBox("录制与回放")
+replay_layout = QVBoxLayout(replay_group)
+record_btn = QPushButton("⏺ 开始录制")
+record_btn.setToolTip("把每个物理子步的粒子位置, 类型和事件写入录像文件")
+open_recording_btn = QPushButton("📼 打开录像")
+replay_slider = QSlider(Qt.Horizontal)
+replay_slider.setRange(0, 0)
+replay_play_btn = QPushButton("▶ 播放")
+replay_speed_spin = QDoubleSpinBox()
+replay_speed_spin.setRange(0.1, 1000.0)
+replay_speed_spin.setValue(10.0)
+replay_speed_spin.setSuffix("x")
+replay_speed_spin.setToolTip(f"1x 为每秒 {REPLAY_FRAMES_PER_SECOND:g} 个物理子步")
+exit_replay_btn = QPushButton("⏏ 退出回放")
+replay_label = QLabel("未打开录像")
+recording_buttons_layout = QHBoxLayout()
+recording_buttons_layout.addWidget(record_btn)
+recording_buttons_layout.addWidget(open_recording_btn)
+replay_layout.addLayout(recording_buttons_layout)
+replay_layout.addWidget(replay_slider)
+replay_buttons_layout = QHBoxLayout()
+replay_buttons_layout.addWidget(replay_play_btn)
+replay_buttons_layout.addWidget(QLabel("回放速度:"))
+replay_buttons_layout.addWidget(replay_speed_spin)
+replay_buttons_layout.addWidget(exit_replay_btn)
+replay_layout.addLayout(replay_buttons_layout)
+replay_layout.addWidget(replay_label)
+for widget in (replay_slider, replay_play_btn, replay_speed_spin, exit_replay_btn):
+    widget.setEnabled(False)
+
 param_group = QGroupBox("相互作用参数")
 param_layout = QVBoxLayout(param_group)
 interaction_dist_spin = QDoubleSpinBox()
@@ -211,11 +329,23 @@ display_group = QGroupBox("显示选项")
 display_layout = QVBoxLayout(display_group)
 show_trajectories = QCheckBox("显示粒子轨迹")
 show_trajectories.setChecked(True)
+trail_length_spin = QSpinBox()
+trail_length_spin.setRange(2, 64)
+trail_length_spin.setValue(6)
 show_interaction_effects = QCheckBox("显示相互作用")
 show_interaction_effects.setChecked(True)
 show_particle_info = QCheckBox("显示宇宙信息")
 show_particle_info.setChecked(True)
+point_budget_spin = QSpinBox()
+point_budget_spin.setRange(1000, 5000000)
+point_budget_spin.setSingleStep(10000)
+point_budget_spin.setValue(DEFAULT_POINT_BUDGET)
+point_budget_spin.setToolTip("超过该点数时, 远处和密集区域的粒子合并为替身点绘制")
 display_layout.addWidget(show_trajectories)
+display_layout.addWidget(QLabel("轨迹长度:"))
+display_layout.addWidget(trail_length_spin)
+display_layout.addWidget(QLabel("绘制点数上限:"))
+display_layout.addWidget(point_budget_spin)
 display_layout.addWidget(show_interaction_effects)
 display_layout.addWidget(show_particle_info)
 
@@ -224,46 +354,40 @@ stats_layout = QVBoxLayout(stats_group)
 stats_label = QLabel("宇宙状态将显示在这里...")
 stats_label.setWordWrap(True)
 stats_layout.addWidget(stats_label)
+show_performance = QCheckBox("显示性能分析")
+show_performance.setChecked(False)
+performance_label = QLabel()
+performance_label.setFont(QFont("Consolas", 8))
+performance_label.setVisible(False)
+export_performance_btn = QPushButton("导出性能数据")
+stats_layout.addWidget(show_performance)
+stats_layout.addWidget(performance_label)
+stats_layout.addWidget(export_performance_btn)
 
 control_layout.addWidget(cosmo_group)
 control_layout.addWidget(physics_group)
 control_layout.addWidget(sim_group)
+control_layout.addWidget(replay_group)
 control_layout.addWidget(param_group)
 control_layout.addWidget(display_group)
 control_layout.addWidget(stats_group)
 control_layout.addStretch()
 
-gl_widget = gl.GLViewWidget()
-gl_widget.setCameraPosition(distance=20, elevation=25, azimuth=45)
+gl_placeholder = QLabel("正在加载三维视图...")
+gl_placeholder.setAlignment(Qt.AlignCenter)
 main_layout.addWidget(control_panel)
-main_layout.addWidget(gl_widget)
+main_layout.addWidget(gl_placeholder, 1)
 
 
 def save_cosmology_config():
     """保存宇宙学配置到.cosmos文件"""
-    config = {
-        'dark_matter_ratio': simulator_state['dark_matter_ratio'],
-        'dark_energy_ratio': simulator_state['dark_energy_ratio'],
-        'baryonic_ratio': simulator_state['baryonic_ratio'],
-        'initial_energy': simulator_state['initial_energy'],
-        'expansion_rate': simulator_state['expansion_rate'],
-        'interaction_distance': simulator_state['interaction_distance'],
-        'fusion_probability': simulator_state['fusion_probability'],
-        'structure_formation_probability': simulator_state['structure_formation_probability'],
-        'num_particles': simulator_state['num_particles'],
-        'gravitational_constant': simulator_state['gravitational_constant'],
-        'cosmic_inflation': simulator_state['cosmic_inflation'],
-        'quantum_fluctuations': simulator_state['quantum_fluctuations'],
-        'simulation_speed': simulation_speed,
-        'show_trajectories': show_trajectories.isChecked(),
-        'show_interaction_effects': show_interaction_effects.isChecked(),
-        'show_particle_info': show_particle_info.isChecked(),
-        'timestamp': datetime.now().isoformat(),
-        'simulator_type': 'cosmology_simulator',
-        'version': '1.0',
-        'description': '宇宙演化模拟器配置文件',
-        'universe_model': 'Standard Cosmological Model'
-    }
+    config = build_cosmos_config(
+        worker.state,
+        simulation_speed=simulation_speed,
+        show_trajectories=show_trajectories.isChecked(),
+        show_interaction_effects=show_interaction_effects.isChecked(),
+        show_particle_info=show_particle_info.isChecked()
+    )
 
     file_path, _ = QFileDialog.getSaveFileName(
         window,
@@ -278,13 +402,63 @@ def save_cosmology_config():
             file_path += '.cosmos'
 
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2, ensure_ascii=False)
+            save_cosmos_config(file_path, config)
             QMessageBox.information(window, "成功", f"宇宙学配置已保存到:\n{file_path}")
         except Exception as e:
             QMessageBox.critical(window, "错误", f"保存配置失败: {str(e)}")
 
 
+def apply_config_to_widgets(config):
+    """把配置 (或检查点中的参数) 同步到界面控件和模拟线程"""
+    global random_seed
+    random_seed = config.get('seed')
+
+    dark_matter_spin.setValue(config.get('dark_matter_ratio', 0.27))
+    dark_energy_spin.setValue(config.get('dark_energy_ratio', 0.68))
+    baryonic_spin.setValue(config.get('baryonic_ratio', 0.05))
+    initial_energy_spin.setValue(config.get('initial_energy', 3.0))
+    expansion_rate_spin.setValue(config.get('expansion_rate', 0.00002))
+    interaction_dist_spin.setValue(config.get('interaction_distance', 0.5))
+    fusion_prob_spin.setValue(config.get('fusion_probability', 0.1))
+    structure_prob_spin.setValue(config.get('structure_formation_probability', 0.05))
+    particle_count_spin.setValue(config.get('num_particles', 20))
+    speed_slider.setValue(config.get('simulation_speed', 5))
+
+    # 更新复选框
+    inflation_checkbox.setChecked(config.get('cosmic_inflation', False))
+    quantum_fluctuations_checkbox.setChecked(config.get('quantum_fluctuations', True))
+
+    # 更新引力求解器
+    solver_index = gravity_solver_combo.findData(config.get('gravity_solver', 'cell_list'))
+    gravity_solver_combo.setCurrentIndex(max(solver_index, 0))
+    opening_angle_spin.setValue(config.get('opening_angle', 0.5))
+    mesh_size_spin.setValue(config.get('mesh_size', DEFAULT_MESH_SIZE))
+    backend_index = compute_backend_combo.findData(config.get('compute_backend', 'auto'))
+    compute_backend_combo.setCurrentIndex(max(backend_index, 0))
+    compute_threads_spin.setValue(config.get('compute_threads', DEFAULT_THREADS))
+    integrator_combo.setCurrentIndex(max(integrator_combo.findData(config.get('integrator', DEFAULT_INTEGRATOR)), 0))
+    timestep_accuracy_spin.setValue(config.get('timestep_accuracy', DEFAULT_TIMESTEP_ACCURACY))
+
+    # 更新显示选项
+    show_trajectories.setChecked(config.get('show_trajectories', True))
+    trail_length_spin.setValue(config.get('trail_length', 6))
+    show_interaction_effects.setChecked(config.get('show_interaction_effects', True))
+    show_particle_info.setChecked(config.get('show_particle_info', True))
+
+    # 更新特殊参数
+    worker.set_params(gravitational_constant=config.get('gravitational_constant', 1e-15))
+
+    # 更新状态变量
+    update_physics_params()
+    update_cosmo_params()
+    update_particle_count()
+    update_speed(speed_slider.value())
+
+    # 更新组分标签
+    composition_label.setText(
+        f"DM:{int(dark_matter_spin.value() * 100)}%/DE:{int(dark_energy_spin.value() * 100)}%/B:{int(baryonic_spin.value() * 100)}%")
+
+
 def load_cosmology_config():
     """从.cosmos文件加载宇宙学配置"""
     if is_running:
@@ -300,11 +474,10 @@ def load_cosmology_config():
 
     if file_path:
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-
             # 验证配置文件类型和版本
-            if config.get('simulator_type') != 'cosmology_simulator':
+            try:
+                config = load_cosmos_config(file_path)
+            except CosmosConfigError:
                 QMessageBox.warning(
                     window,
                     "文件类型错误",
@@ -313,50 +486,18 @@ def load_cosmology_config():
                 return
 
             # 检查版本兼容性
-            file_version = config.get('version', '1.0')
-            if file_version != '1.0':
+            file_version = config.get('version', COSMOS_VERSION)
+            if file_version != COSMOS_VERSION:
                 reply = QMessageBox.question(
                     window,
                     "版本警告",
-                    f"此配置文件版本 ({file_version}) 可能与当前版本 (1.0) 不兼容\n是否继续加载?",
+                    f"此配置文件版本 ({file_version}) 可能与当前版本 ({COSMOS_VERSION}) 不兼容\n是否继续加载?",
                     QMessageBox.Yes | QMessageBox.No
                 )
                 if reply == QMessageBox.No:
                     return
 
-            # 更新界面控件
-            dark_matter_spin.setValue(config.get('dark_matter_ratio', 0.27))
-            dark_energy_spin.setValue(config.get('dark_energy_ratio', 0.68))
-            baryonic_spin.setValue(config.get('baryonic_ratio', 0.05))
-            initial_energy_spin.setValue(config.get('initial_energy', 3.0))
-            expansion_rate_spin.setValue(config.get('expansion_rate', 0.00002))
-            interaction_dist_spin.setValue(config.get('interaction_distance', 0.5))
-            fusion_prob_spin.setValue(config.get('fusion_probability', 0.1))
-            structure_prob_spin.setValue(config.get('structure_formation_probability', 0.05))
-            particle_count_spin.setValue(config.get('num_particles', 20))
-            speed_slider.setValue(config.get('simulation_speed', 5))
-
-            # 更新复选框
-            inflation_checkbox.setChecked(config.get('cosmic_inflation', False))
-            quantum_fluctuations_checkbox.setChecked(config.get('quantum_fluctuations', True))
-
-            # 更新显示选项
-            show_trajectories.setChecked(config.get('show_trajectories', True))
-            show_interaction_effects.setChecked(config.get('show_interaction_effects', True))
-            show_particle_info.setChecked(config.get('show_particle_info', True))
-
-            # 更新特殊参数
-            simulator_state['gravitational_constant'] = config.get('gravitational_constant', 1e-15)
-
-            # 更新状态变量
-            update_physics_params()
-            update_cosmo_params()
-            update_particle_count()
-            update_speed(speed_slider.value())
-
-            # 更新组分标签
-            composition_label.setText(
-                f"DM:{int(dark_matter_spin.value() * 100)}%/DE:{int(dark_energy_spin.value() * 100)}%/B:{int(baryonic_spin.value() * 100)}%")
+            apply_config_to_widgets(config)
 
             # 显示文件信息
             file_info = f"配置文件: {os.path.basename(file_path)}"
@@ -373,6 +514,223 @@ def load_cosmology_config():
             QMessageBox.critical(window, "文件错误", "文件格式错误，不是有效的JSON文件")
         except Exception as e:
             QMessageBox.critical(window, "错误", f"加载配置失败: {str(e)}")
+def save_simulation_checkpoint():
+    """保存完整的宇宙状态 (粒子, 事件, 随机数状态) 到检查点文件, 写盘在后台进行"""
+    file_path, _ = QFileDialog.getSaveFileName(
+        window,
+        "保存检查点",
+        f"Cosmos_Checkpoint_{datetime.now().strftime('%Y%m%d_%H%M%S')}{CHECKPOINT_SUFFIX}",
+        f"Cosmos Checkpoint Files (*{CHECKPOINT_SUFFIX});;All Files (*)"
+    )
+
+    if file_path:
+        if not file_path.lower().endswith(CHECKPOINT_SUFFIX):
+            file_path += CHECKPOINT_SUFFIX
+        # 写盘线程只把结果放入队列, 由界面定时器取出后提示
+        worker.save_checkpoint(file_path, lambda path, error: checkpoint_results.put((path, error)))
+
+
+def report_checkpoint_results():
+    while not checkpoint_results.empty():
+        file_path, error = checkpoint_results.get()
+        if error is None:
+            QMessageBox.information(window, "成功", f"检查点已保存到:\n{file_path}")
+        else:
+            QMessageBox.critical(window, "错误", f"保存检查点失败: {str(error)}")
+
+
+def toggle_recording():
+    """开始或结束录制; 结束时剩余数据在后台写盘, 结果由界面定时器提示"""
+    global is_recording
+    if is_recording:
+        is_recording = False
+        worker.stop_recording(lambda path, error: recording_results.put((path, error)))
+        record_btn.setText("⏺ 开始录制")
+        return
+
+    file_path, _ = QFileDialog.getSaveFileName(
+        window,
+        "录制到文件",
+        f"Cosmos_Recording_{datetime.now().strftime('%Y%m%d_%H%M%S')}{RECORDING_SUFFIX}",
+        f"Cosmos Recording Files (*{RECORDING_SUFFIX});;All Files (*)"
+    )
+
+    if file_path:
+        if not file_path.lower().endswith(RECORDING_SUFFIX):
+            file_path += RECORDING_SUFFIX
+        try:
+            recorder = RunRecorder(file_path)
+        except OSError as e:
+            QMessageBox.critical(window, "错误", f"无法创建录像文件: {str(e)}")
+            return
+        worker.start_recording(recorder)
+        is_recording = True
+        record_btn.setText("⏹ 停止录制")
+
+
+def report_recording_results():
+    while not recording_results.empty():
+        file_path, error = recording_results.get()
+        if error is None:
+            QMessageBox.information(window, "成功", f"录像已保存到:\n{file_path}")
+        else:
+            QMessageBox.critical(window, "错误", f"保存录像失败: {str(error)}")
+
+
+def open_recording():
+    """打开录像并进入回放模式; 实时模拟暂停, 回放只读取所需帧所在的数据块"""
+    global replay_player, replay_position, replay_playing, last_replay_frame
+
+    file_path, _ = QFileDialog.getOpenFileName(
+        window,
+        "打开录像",
+        "",
+        f"Cosmos Recording Files (*{RECORDING_SUFFIX});;All Files (*)"
+    )
+
+    if file_path:
+        try:
+            reader = RecordingReader(file_path)
+        except RecordingError as e:
+            QMessageBox.warning(window, "文件类型错误", str(e))
+            return
+        except Exception as e:
+            QMessageBox.critical(window, "错误", f"打开录像失败: {str(e)}")
+            return
+        if not len(reader):
+            reader.close()
+            QMessageBox.warning(window, "录像为空", "录像中没有任何帧")
+            return
+
+        pause_simulation()
+        if replay_player is not None:
+            replay_player.close()
+        replay_player = ReplayPlayer(reader, trail_length_spin.value())
+        if last_view is not None:
+            replay_player.set_view(*last_view)
+        replay_position = 0.0
+        replay_playing = False
+        last_replay_frame = None
+        replay_play_btn.setText("▶ 播放")
+        replay_slider.blockSignals(True)
+        replay_slider.setRange(0, len(reader) - 1)
+        replay_slider.setValue(0)
+        replay_slider.blockSignals(False)
+        for widget in (replay_slider, replay_play_btn, replay_speed_spin, exit_replay_btn):
+            widget.setEnabled(True)
+        scene.clear()
+        render_replay_frame()
+
+
+def exit_replay():
+    """退出回放模式, 恢复显示实时模拟"""
+    global replay_player, replay_playing, last_rendered_frame
+    if replay_player is None:
+        return
+    replay_player.close()
+    replay_player = None
+    replay_playing = False
+    for widget in (replay_slider, replay_play_btn, replay_speed_spin, exit_replay_btn):
+        widget.setEnabled(False)
+    replay_label.setText("未打开录像")
+    scene.clear()
+    last_rendered_frame = None
+
+
+def toggle_replay_playback():
+    global replay_playing, replay_position, replay_clock
+    if replay_player is None:
+        return
+    replay_playing = not replay_playing
+    if replay_playing and int(replay_position) >= len(replay_player.reader) - 1:
+        replay_position = 0.0
+    replay_clock = time.perf_counter()
+    replay_play_btn.setText("⏸ 暂停回放" if replay_playing else "▶ 播放")
+
+
+def seek_replay(value):
+    global replay_position, replay_clock
+    if replay_player is None:
+        return
+    replay_position = float(value)
+    replay_clock = time.perf_counter()
+    render_replay_frame()
+
+
+def update_replay():
+    """按墙钟时间和回放速度推进播放位置; 速度较高时跳过中间帧, 每个显示帧只生成一次快照"""
+    global replay_position, replay_clock, replay_playing
+    now = time.perf_counter()
+    if replay_playing:
+        replay_position += (now - replay_clock) * REPLAY_FRAMES_PER_SECOND * replay_speed_spin.value()
+        last = len(replay_player.reader) - 1
+        if replay_position >= last:
+            replay_position = float(last)
+            replay_playing = False
+            replay_play_btn.setText("▶ 播放")
+    replay_clock = now
+    render_replay_frame()
+
+
+def render_replay_frame():
+    global last_replay_frame
+    index = int(replay_position)
+    if index == last_replay_frame:
+        return
+    last_replay_frame = index
+
+    snapshot = replay_player.snapshot(index)
+    with render_profiler.phase('scene_update'):
+        scene.update(snapshot)
+    render_profiler.end_step()
+    replay_slider.blockSignals(True)
+    replay_slider.setValue(index)
+    replay_slider.blockSignals(False)
+    replay_label.setText(f"帧 {index + 1} / {len(replay_player.reader)}  宇宙年龄 {snapshot.cosmic_age:.2f} 十亿年")
+    if show_particle_info.isChecked():
+        stats_label.setText(snapshot_stats_text(snapshot, "录像回放", f"回放速度: {replay_speed_spin.value():g}x"))
+
+
+def load_simulation_checkpoint():
+    """从检查点文件恢复完整的宇宙状态, 继续运行与保存时逐位一致"""
+    global is_running, last_rendered_frame
+
+    file_path, _ = QFileDialog.getOpenFileName(
+        window,
+        "加载检查点",
+        "",
+        f"Cosmos Checkpoint Files (*{CHECKPOINT_SUFFIX});;All Files (*)"
+    )
+
+    if file_path:
+        try:
+            state = load_checkpoint(file_path)
+        except CheckpointError as e:
+            QMessageBox.warning(window, "文件类型错误", str(e))
+            return
+        except Exception as e:
+            QMessageBox.critical(window, "错误", f"加载检查点失败: {str(e)}")
+            return
+
+        is_running = False
+        worker.load_state(state)
+        scene.clear()
+        last_rendered_frame = None
+        start_btn.setText("▶ 开始模拟")
+        config = {
+            'simulation_speed': simulation_speed,
+            'show_trajectories': show_trajectories.isChecked(),
+            'show_interaction_effects': show_interaction_effects.isChecked(),
+            'show_particle_info': show_particle_info.isChecked(),
+        }
+        config.update(build_cosmos_config(state))
+        apply_config_to_widgets(config)
+        QMessageBox.information(
+            window, "加载成功",
+            f"检查点: {os.path.basename(file_path)}\n粒子数: {len(state['particles'])}\n"
+            f"相互作用: {len(state['interaction_events'])}")
+
+
 def add_cosmology_import_export_buttons():
     """为宇宙模拟器添加导入导出按钮"""
     import_export_group = QGroupBox("配置文件")
@@ -381,163 +739,37 @@ def add_cosmology_import_export_buttons():
     load_btn = QPushButton("📂 导入配置")
     save_btn = QPushButton("💾 导出配置")
 
+    load_checkpoint_btn = QPushButton("⏮ 加载检查点")
+    save_checkpoint_btn = QPushButton("⏺ 保存检查点")
+
     load_btn.clicked.connect(load_cosmology_config)
     save_btn.clicked.connect(save_cosmology_config)
+    load_checkpoint_btn.clicked.connect(load_simulation_checkpoint)
+    save_checkpoint_btn.clicked.connect(save_simulation_checkpoint)
 
     import_export_layout.addWidget(load_btn)
     import_export_layout.addWidget(save_btn)
+    import_export_layout.addWidget(load_checkpoint_btn)
+    import_export_layout.addWidget(save_checkpoint_btn)
 
     # 插入到控制面板的适当位置
     control_layout.insertWidget(1, import_export_group)
-def create_simple_sphere(radius=8.0, slices=16, stacks=8):
-    vertices = []
-    faces = []
-
-    for i in range(stacks + 1):
-        phi = math.pi * i / stacks
-        for j in range(slices):
-            theta = 2 * math.pi * j / slices
-            x = radius * math.sin(phi) * math.cos(theta)
-            y = radius * math.sin(phi) * math.sin(theta)
-            z = radius * math.cos(phi)
-            vertices.append([x, y, z])
-
-    for i in range(stacks):
-        for j in range(slices):
-            first = i * slices + j
-            second = first + slices
-            next_j = (j + 1) % slices
-
-            faces.append([first, second, first + 1])
-            faces.append([second, second + next_j - j, first + 1])
-
-    return np.array(vertices, dtype=np.float32), np.array(faces, dtype=np.uint32)
-
-sphere_vertices, sphere_faces = create_simple_sphere()
-
-cosmic_sphere = gl.GLMeshItem(
-    vertexes=sphere_vertices,
-    faces=sphere_faces,
-    smooth=False,
-    color=(0.1, 0.1, 0.3, 0.05),
-    drawEdges=True,
-    edgeColor=(0.3, 0.3, 0.5, 0.2),
-    glOptions='additive'
-)
-gl_widget.addItem(cosmic_sphere)
-
-axis_length = 4.0
-x_axis = gl.GLLinePlotItem(
-    pos=np.array([[0, 0, 0], [axis_length, 0, 0]], dtype=np.float32),
-    color=(1, 0, 0, 1), width=2
-)
-gl_widget.addItem(x_axis)
-y_axis = gl.GLLinePlotItem(
-    pos=np.array([[0, 0, 0], [0, axis_length, 0]], dtype=np.float32),
-    color=(0, 1, 0, 1), width=2
-)
-gl_widget.addItem(y_axis)
-z_axis = gl.GLLinePlotItem(
-    pos=np.array([[0, 0, 0], [0, 0, axis_length]], dtype=np.float32),
-    color=(0, 0, 1, 1), width=2
-)
-gl_widget.addItem(z_axis)
+# 三维场景在窗口显示后挂接到 gl_widget; 此前的快照只被记录下来
+scene = SceneLayer()
 
 timer = QTimer()
 
-def safe_normalize(vector):
-    norm = np.linalg.norm(vector)
-    if norm == 0 or not np.isfinite(norm) or norm > 1e6:
-        return np.array([0.0, 0.0, 0.0], dtype=np.float32)
-    return (vector / norm).astype(np.float32)
-
-def safe_distance(pos1, pos2):
-    try:
-        diff = pos1 - pos2
-        if not np.all(np.isfinite(diff)):
-            return float('inf')
-        distance = np.linalg.norm(diff)
-        return distance if np.isfinite(distance) else float('inf')
-    except:
-        return float('inf')
-
-def clamp_position(position, max_val):
-    return np.clip(position, -max_val, max_val).astype(np.float32)
-
-def create_stable_particle(position, momentum, p_type, particle_id):
-    particle_mass = cosmology_data[p_type][1]
-
-    position = np.nan_to_num(position, nan=0.0, posinf=3.0, neginf=-3.0).astype(np.float32)
-    momentum = np.nan_to_num(momentum, nan=0.0, posinf=0.5, neginf=-0.5).astype(np.float32)
-
-    particle = {
-        'particle_id': particle_id,
-        'particle_type': p_type,
-        'position': position,
-        'momentum': momentum,
-        'mass': float(particle_mass),
-        'charge': cosmology_data[p_type][2],
-        'lifetime': cosmology_data[p_type][3],
-        'spin': random.choice(["UP", "DOWN", "LEFT", "RIGHT"]),
-        'trajectory': [position.copy()],
-        'creation_time': 0.0,
-        'velocity_history': [],
-        'gravitational_charge': float(particle_mass)
-    }
-
-    momentum_norm = np.linalg.norm(momentum)
-    if not np.isfinite(momentum_norm):
-        momentum_norm = 0.0
-    energy_sq = momentum_norm ** 2 + particle_mass ** 2
-    particle['energy'] = float(math.sqrt(energy_sq) if energy_sq > 0 else 0.001)
-
-    return particle
-
-def initialize_particles():
-    particles = []
-    particle_counter = 0
-
-    for i in range(simulator_state['num_particles']):
-        particle_type_roll = random.random()
-        if particle_type_roll < simulator_state['dark_matter_ratio']:
-            p_type = "DARK_MATTER"
-        elif particle_type_roll < simulator_state['dark_matter_ratio'] + simulator_state['dark_energy_ratio']:
-            p_type = "DARK_ENERGY"
-        else:
-            baryonic_types = ["HYDROGEN", "HELIUM", "PHOTON", "NEUTRINO"]
-            p_type = random.choice(baryonic_types)
-
-        theta = random.uniform(0, 2 * math.pi)
-        phi = random.uniform(0, math.pi)
-        radius = random.uniform(1.0, 5.0)
-
-        position = np.array([
-            radius * math.sin(phi) * math.cos(theta),
-            radius * math.sin(phi) * math.sin(theta),
-            radius * math.cos(phi)
-        ], dtype=np.float32)
-
-        momentum_magnitude = random.uniform(0.02, 0.2) * simulator_state['initial_energy']
-        momentum = np.array([
-            random.gauss(0, 0.05) * momentum_magnitude,
-            random.gauss(0, 0.05) * momentum_magnitude,
-            random.gauss(0, 0.05) * momentum_magnitude
-        ], dtype=np.float32)
-
-        particle = create_stable_particle(position, momentum, p_type, particle_counter)
-        particles.append(particle)
-        particle_counter += 1
-
-    simulator_state['particles'] = particles
-    simulator_state['particle_counter'] = particle_counter
-
-initialize_particles()
+startup.mark('controls')
+initialize_particles(simulator_state)
+worker = SimulationWorker(simulator_state, simulation_speed)
+worker.start()
+startup.mark('worker')
 
 def composition_button_click():
     current_ratios = {
-        'dark_matter': simulator_state['dark_matter_ratio'],
-        'dark_energy': simulator_state['dark_energy_ratio'],
-        'baryonic': simulator_state['baryonic_ratio']
+        'dark_matter': worker.state['dark_matter_ratio'],
+        'dark_energy': worker.state['dark_energy_ratio'],
+        'baryonic': worker.state['baryonic_ratio']
     }
 
     dialog = QDialog(window)
@@ -609,9 +841,11 @@ def composition_button_click():
     cancel_button = QPushButton("取消")
 
     def apply_composition():
-        simulator_state['dark_matter_ratio'] = dm_slider.value() / 100.0
-        simulator_state['dark_energy_ratio'] = de_slider.value() / 100.0
-        simulator_state['baryonic_ratio'] = ba_slider.value() / 100.0
+        worker.set_params(
+            dark_matter_ratio=dm_slider.value() / 100.0,
+            dark_energy_ratio=de_slider.value() / 100.0,
+            baryonic_ratio=ba_slider.value() / 100.0
+        )
         composition_label.setText(f"DM:{dm_slider.value()}%/DE:{de_slider.value()}%/B:{ba_slider.value()}%")
         dialog.accept()
 
@@ -626,47 +860,48 @@ def composition_button_click():
 
 def start_simulation():
     global is_running
+    exit_replay()
     if not is_running:
         is_running = True
-        timer.start(50 // simulation_speed)
+        worker.resume()
         start_btn.setText("⏵ 运行中...")
 
 def pause_simulation():
     global is_running
     if is_running:
         is_running = False
-        timer.stop()
+        worker.pause()
         start_btn.setText("▶ 开始模拟")
 
 def reset_simulation():
-    global is_running
+    global is_running, last_rendered_frame
 
     is_running = False
-    timer.stop()
-
-    global simulator_state
-    simulator_state = initialize_simulator_state()
-
-    simulator_state['interaction_distance'] = interaction_dist_spin.value()
-    simulator_state['fusion_probability'] = fusion_prob_spin.value()
-    simulator_state['structure_formation_probability'] = structure_prob_spin.value()
-    simulator_state['initial_energy'] = initial_energy_spin.value()
-    simulator_state['expansion_rate'] = expansion_rate_spin.value()
-    simulator_state['dark_matter_ratio'] = dark_matter_spin.value()
-    simulator_state['dark_energy_ratio'] = dark_energy_spin.value()
-    simulator_state['baryonic_ratio'] = baryonic_spin.value()
-    simulator_state['cosmic_inflation'] = inflation_checkbox.isChecked()
-    simulator_state['quantum_fluctuations'] = quantum_fluctuations_checkbox.isChecked()
-    simulator_state['num_particles'] = particle_count_spin.value()
-
-    initialize_particles()
-
-    for item in particle_items + trajectory_items + interaction_items + info_items:
-        gl_widget.removeItem(item)
-    particle_items.clear()
-    trajectory_items.clear()
-    interaction_items.clear()
-    info_items.clear()
+    worker.reset({
+        'interaction_distance': interaction_dist_spin.value(),
+        'fusion_probability': fusion_prob_spin.value(),
+        'structure_formation_probability': structure_prob_spin.value(),
+        'initial_energy': initial_energy_spin.value(),
+        'expansion_rate': expansion_rate_spin.value(),
+        'dark_matter_ratio': dark_matter_spin.value(),
+        'dark_energy_ratio': dark_energy_spin.value(),
+        'baryonic_ratio': baryonic_spin.value(),
+        'cosmic_inflation': inflation_checkbox.isChecked(),
+        'quantum_fluctuations': quantum_fluctuations_checkbox.isChecked(),
+        'gravity_solver': gravity_solver_combo.currentData(),
+        'opening_angle': opening_angle_spin.value(),
+        'mesh_size': mesh_size_spin.value(),
+        'compute_backend': compute_backend_combo.currentData(),
+        'compute_threads': compute_threads_spin.value(),
+        'integrator': integrator_combo.currentData(),
+        'timestep_accuracy': timestep_accuracy_spin.value(),
+        'trail_length': trail_length_spin.value(),
+        'num_particles': particle_count_spin.value(),
+        'seed': random_seed
+    })
+
+    scene.clear()
+    last_rendered_frame = None
 
     start_btn.setText("▶ 开始模拟")
 
@@ -674,219 +909,248 @@ def update_speed(value):
     global simulation_speed
     simulation_speed = value
     speed_label.setText(f"速度: {value}x")
-    if is_running:
-        timer.start(50 // simulation_speed)
+    worker.set_speed(value)
 
 def update_physics_params():
-    simulator_state['interaction_distance'] = interaction_dist_spin.value()
-    simulator_state['fusion_probability'] = fusion_prob_spin.value()
-    simulator_state['structure_formation_probability'] = structure_prob_spin.value()
+    worker.set_params(
+        interaction_distance=interaction_dist_spin.value(),
+        fusion_probability=fusion_prob_spin.value(),
+        structure_formation_probability=structure_prob_spin.value(),
+        gravity_solver=gravity_solver_combo.currentData(),
+        opening_angle=opening_angle_spin.value(),
+        mesh_size=mesh_size_spin.value(),
+        compute_backend=compute_backend_combo.currentData(),
+        compute_threads=compute_threads_spin.value(),
+        integrator=integrator_combo.currentData(),
+        timestep_accuracy=timestep_accuracy_spin.value()
+    )
+
+def update_trail_length(value):
+    global last_replay_frame
+    worker.set_params(trail_length=value)
+    if replay_player is not None:
+        replay_player.trail_length = value
+        last_replay_frame = None
 
 def update_particle_count():
     if not is_running:
-        simulator_state['num_particles'] = particle_count_spin.value()
+        worker.set_params(num_particles=particle_count_spin.value())
 
 def update_cosmo_params():
-    simulator_state['initial_energy'] = initial_energy_spin.value()
-    simulator_state['expansion_rate'] = expansion_rate_spin.value()
-    simulator_state['dark_matter_ratio'] = dark_matter_spin.value()
-    simulator_state['dark_energy_ratio'] = dark_energy_spin.value()
-    simulator_state['baryonic_ratio'] = baryonic_spin.value()
-    simulator_state['cosmic_inflation'] = inflation_checkbox.isChecked()
-    simulator_state['quantum_fluctuations'] = quantum_fluctuations_checkbox.isChecked()
+    worker.set_params(
+        initial_energy=initial_energy_spin.value(),
+        expansion_rate=expansion_rate_spin.value(),
+        dark_matter_ratio=dark_matter_spin.value(),
+        dark_energy_ratio=dark_energy_spin.value(),
+        baryonic_ratio=baryonic_spin.value(),
+        cosmic_inflation=inflation_checkbox.isChecked(),
+        quantum_fluctuations=quantum_fluctuations_checkbox.isChecked()
+    )
+
+def update_view():
+    """相机移动或点数上限改变时通知模拟线程, 按新视角重新计算细节层次"""
+    global last_view
+    camera = gl_widget.cameraPosition()
+    eye = (camera.x(), camera.y(), camera.z())
+    budget = point_budget_spin.value()
+    if last_view is not None:
+        last_eye, last_budget = last_view
+        # 相机移动不足观察距离的 2% 时不重新聚合
+        moved = math.dist(eye, last_eye) > 0.02 * max(gl_widget.opts['distance'], 1e-3)
+        if not moved and budget == last_budget:
+            return
+    last_view = (eye, budget)
+    worker.set_view(eye, budget)
+    if replay_player is not None:
+        global last_replay_frame
+        replay_player.set_view(eye, budget)
+        last_replay_frame = None
 
 def update_visualization():
-    if not is_running:
+    global last_rendered_frame
+    if replay_player is not None:
+        update_replay()
+        return
+    # 暂停时仍显示按新视角重新聚合的快照; 重置或加载后在开始运行前不显示
+    if not is_running and scene.last_snapshot is None:
         return
 
-    for _ in range(min(simulation_speed, 2)):
-        dt = 1e8
-
-        valid_particles = []
-        for particle in simulator_state['particles']:
-            if (np.all(np.isfinite(particle['position'])) and
-                    np.all(np.isfinite(particle['momentum'])) and
-                    np.isfinite(particle['energy']) and
-                    np.linalg.norm(particle['position']) < 15.0):
-                valid_particles.append(particle)
-
-        simulator_state['particles'] = valid_particles
-
-        for particle in simulator_state['particles']:
-            if particle['energy'] > 0:
-                velocity = particle['momentum'] / particle['energy']
-            else:
-                velocity = np.array([0.0, 0.0, 0.0], dtype=np.float32)
-
-            velocity = np.nan_to_num(velocity, nan=0.0)
-
-            gravitational_force = np.array([0.0, 0.0, 0.0], dtype=np.float32)
-
-            for other in simulator_state['particles']:
-                if other['particle_id'] != particle['particle_id']:
-                    r_vec = other['position'] - particle['position']
-                    r_mag = safe_distance(particle['position'], other['position'])
-
-                    if (0.3 < r_mag < 6.0 and
-                            particle['mass'] > 0 and other['mass'] > 0):
-
-                        force_mag = simulator_state['gravitational_constant'] * particle['mass'] * other['mass'] / (
-                                    r_mag ** 2 + 0.1)
-                        if np.isfinite(force_mag) and force_mag < 1e8:
-                            force_dir = safe_normalize(r_vec)
-                            gravitational_force += force_mag * force_dir
-
-            if particle['particle_type'] == "DARK_ENERGY":
-                pos_norm = safe_normalize(particle['position'])
-                repulsive_force = particle['energy'] * 1e-18 * pos_norm
-                gravitational_force -= repulsive_force
-
-            if particle['mass'] > 0:
-                acceleration = gravitational_force / (particle['mass'] + 0.001)
-                acceleration = np.nan_to_num(acceleration, nan=0.0)
-                if np.all(np.abs(acceleration) < 1e8):
-                    velocity += acceleration * dt
-
-            velocity = np.clip(velocity, -0.1, 0.1)
-
-            expansion_velocity = simulator_state['expansion_rate'] * particle['position'] * dt * 0.001
-            expansion_velocity = np.nan_to_num(expansion_velocity, nan=0.0)
-
-            position_change = (velocity + expansion_velocity) * dt
-            position_change = np.clip(position_change, -0.1, 0.1)
-
-            particle['position'] += position_change
-            particle['position'] = clamp_position(particle['position'], simulator_state['max_position'])
-
-            if len(particle['trajectory']) > 15:
-                particle['trajectory'] = particle['trajectory'][-15:]
-            particle['trajectory'].append(particle['position'].copy())
-
-        particles_to_remove = set()
-        new_particles = []
-
-        for i in range(len(simulator_state['particles'])):
-            if i in particles_to_remove:
-                continue
-            for j in range(i + 1, len(simulator_state['particles'])):
-                if j in particles_to_remove or i in particles_to_remove:
-                    continue
-
-                p1, p2 = simulator_state['particles'][i], simulator_state['particles'][j]
-                distance = safe_distance(p1['position'], p2['position'])
-
-                if distance > simulator_state['interaction_distance'] or distance == float('inf'):
-                    continue
-
-                if (p1['particle_type'] in ["HYDROGEN", "HELIUM"] and
-                        p2['particle_type'] in ["HYDROGEN", "HELIUM"] and
-                        random.random() < simulator_state['fusion_probability']):
-
-                    total_mass = p1['mass'] + p2['mass']
-                    if total_mass > 20.0 and random.random() < 0.05:
-                        new_particle_type = "STAR"
-                        event_type = "star_formation"
-                    else:
-                        new_particle_type = "HELIUM" if total_mass > 2.0 else "HYDROGEN"
-                        event_type = "nuclear_fusion"
-
-                    new_momentum = (p1['momentum'] + p2['momentum']) * 0.5
-                    new_position = (p1['position'] + p2['position']) * 0.5
-
-                    new_particle = create_stable_particle(new_position, new_momentum, new_particle_type,
-                                                          simulator_state['particle_counter'])
-                    particles_out = [new_particle]
-
-                    event = {
-                        'event_id': simulator_state['event_counter'],
-                        'particles_in': [p1, p2],
-                        'particles_out': particles_out,
-                        'position': new_position,
-                        'energy': p1['energy'] + p2['energy'],
-                        'timestamp': simulator_state['time'],
-                        'event_type': event_type
-                    }
-
-                    simulator_state['event_counter'] += 1
-                    simulator_state['interaction_events'].append(event)
-                    particles_to_remove.update([i, j])
-                    new_particles.extend(particles_out)
-                    simulator_state['particle_counter'] += 1
-                    break
-
-        for idx in sorted(particles_to_remove, reverse=True):
-            if idx < len(simulator_state['particles']):
-                simulator_state['particles'].pop(idx)
-
-        simulator_state['particles'].extend(new_particles)
-        simulator_state['time'] += dt
-        simulator_state['scale_factor'] *= (1 + simulator_state['expansion_rate'] * dt * 0.001)
-
-    for item in particle_items + trajectory_items + interaction_items + info_items:
-        gl_widget.removeItem(item)
-    particle_items.clear()
-    trajectory_items.clear()
-    interaction_items.clear()
-    info_items.clear()
-
-    particle_positions = []
-    particle_colors = []
-    particle_sizes = []
-
-    for particle in simulator_state['particles']:
-        if (np.all(np.isfinite(particle['position'])) and
-                np.linalg.norm(particle['position']) < 20.0):
-
-            pos = particle['position']
-            color = cosmology_data[particle['particle_type']][5]
-            size = 3 + math.log(particle['mass'] + 1) * 1.2
-            size = min(max(size, 2), 12)
-
-            particle_positions.append(pos)
-            particle_colors.append(color)
-            particle_sizes.append(size)
-
-            if show_trajectories.isChecked() and len(particle['trajectory']) > 1:
-                trajectory = np.array(particle['trajectory'][-6:])
-                if (np.all(np.isfinite(trajectory)) and
-                        np.all(np.abs(trajectory) < 25.0)):
-                    trajectory_item = gl.GLLinePlotItem(
-                        pos=trajectory.astype(np.float32),
-                        color=color,
-                        width=1.2,
-                        antialias=True
-                    )
-                    gl_widget.addItem(trajectory_item)
-                    trajectory_items.append(trajectory_item)
-
-    if particle_positions:
-        particles_item = gl.GLScatterPlotItem(
-            pos=np.array(particle_positions).astype(np.float32),
-            color=np.array(particle_colors),
-            size=np.array(particle_sizes).astype(np.float32)
-        )
-        gl_widget.addItem(particles_item)
-        particle_items.append(particles_item)
+    snapshot = worker.latest_snapshot()
+    if snapshot is None or snapshot.frame == last_rendered_frame:
+        return
+    last_rendered_frame = snapshot.frame
+
+    with render_profiler.phase('scene_update'):
+        uploaded = scene.update(snapshot)
+    render_profiler.count('items_uploaded', uploaded)
+    render_profiler.count('vertices_uploaded', len(snapshot.positions) + len(snapshot.trail_vertices))
+    render_profiler.end_step()
+
+    if show_performance.isChecked():
+        update_performance_overlay()
 
     if show_particle_info.isChecked():
-        cosmic_time = simulator_state['time'] / 3.154e7 / 1e9
-        stats_text = f"""宇宙演化状态
-宇宙年龄: {cosmic_time:.2f} 十亿年
-尺度因子: {simulator_state['scale_factor']:.3f}
-粒子数: {len(simulator_state['particles'])}
-相互作用: {len(simulator_state['interaction_events'])}
-模拟速度: {simulation_speed}x"""
+        stats_label.setText(snapshot_stats_text(snapshot, "宇宙演化状态", f"模拟速度: {simulation_speed}x"))
+        update_history_plots()
+
+def snapshot_stats_text(snapshot, heading, speed_text):
+    stats_text = f"""{heading}
+宇宙年龄: {snapshot.cosmic_age:.2f} 十亿年
+尺度因子: {snapshot.scale_factor:.3f}
+粒子数: {snapshot.particle_count}
+绘制点数: {len(snapshot.positions)} (替身点 {snapshot.impostor_count})
+相互作用: {snapshot.event_count}
+{speed_text}"""
+    if snapshot.stats is not None:
+        totals = snapshot.stats
+        composition = "  ".join(f"{cosmology_data[p_type][0]} {count}"
+                                for p_type, count in totals['particle_counts'].items())
+        events = "  ".join(f"{EVENT_LABELS.get(name, name)} {count}"
+                           for name, count in totals['event_counts'].items())
+        stats_text += f"""
+组成: {composition}
+总能量: {totals['total_energy']:.4g}
+总动量: {totals['momentum_magnitude']:.4g}
+平均质量: {totals['mean_mass']:.4g}
+事件: {events or '无'}"""
+    return stats_text
+
+def update_history_plots():
+    """按降采样历史刷新组成与尺度因子曲线, 最多每 HISTORY_UPDATE_INTERVAL 秒一次"""
+    global last_history_update
+    now = time.perf_counter()
+    if now - last_history_update < HISTORY_UPDATE_INTERVAL:
+        return
+    last_history_update = now
+
+    series = worker.stats.series()
+    ages = series['cosmic_age']
+    counts = series['particle_counts']
+    for code in np.flatnonzero(counts.any(axis=0)):
+        if code not in composition_curves:
+            color = tuple(int(c * 255) for c in TYPE_COLOR[code][:3])
+            composition_curves[code] = composition_plot.plot(
+                pen=pg.mkPen(color, width=2), name=cosmology_data[PARTICLE_TYPES[code]][0])
+    for code, curve in composition_curves.items():
+        curve.setData(ages, counts[:, code])
+    # 尺度因子按对数坐标绘制, 溢出为无穷大的样本不画
+    finite = np.isfinite(series['scale_factor']) & (series['scale_factor'] > 0)
+    scale_factor_curve.setData(ages[finite], series['scale_factor'][finite])
+
+def build_scene():
+    """导入 pyqtgraph 与 OpenGL, 创建三维视图 (边界球, 坐标轴, 粒子图元) 和历史曲线"""
+    global pg, gl_widget, history_plots, composition_plot, scale_factor_plot, scale_factor_curve
+    import pyqtgraph as pg
+    import pyqtgraph.opengl as gl
+    startup.mark('scene_imports')
+
+    gl_widget = gl.GLViewWidget()
+    gl_widget.setCameraPosition(distance=20, elevation=25, azimuth=45)
+    add_backdrop(gl_widget)
+    scene.attach(gl_widget)
+    main_layout.replaceWidget(gl_placeholder, gl_widget)
+    gl_placeholder.deleteLater()
+
+    history_plots = pg.GraphicsLayoutWidget()
+    history_plots.setMinimumHeight(280)
+    composition_plot = history_plots.addPlot(row=0, col=0, title="粒子组成")
+    composition_plot.addLegend(offset=(-5, 5))
+    composition_plot.showGrid(x=True, y=True, alpha=0.2)
+    scale_factor_plot = history_plots.addPlot(row=1, col=0, title="尺度因子")
+    scale_factor_plot.setLabel('bottom', "宇宙年龄 (十亿年)")
+    scale_factor_plot.setLogMode(y=True)
+    scale_factor_plot.showGrid(x=True, y=True, alpha=0.2)
+    scale_factor_plot.setXLink(composition_plot)
+    scale_factor_curve = scale_factor_plot.plot(pen=pg.mkPen((230, 200, 90), width=2))
+    stats_layout.insertWidget(1, history_plots)
+
+
+def finish_startup():
+    """窗口显示后的启动步骤; 可交互时间记为 'window' 标记
+
+    设置了环境变量 COSMOS_STARTUP_REPORT 时把各阶段耗时写入该 JSON 文件,
+    设置了 COSMOS_STARTUP_EXIT 时随后退出 (cosmic_bench 用它测量启动时间).
+    """
+    app.processEvents()
+    startup.mark('window')
+    build_scene()
+    timer.start(DISPLAY_INTERVAL_MS)
+    app.processEvents()
+    startup.mark('scene')
+
+    report_path = os.environ.get('COSMOS_STARTUP_REPORT')
+    if report_path:
+        startup.write(report_path)
+    if os.environ.get('COSMOS_STARTUP_EXIT'):
+        app.quit()
+
+
+def update_performance_overlay():
+    """刷新性能叠加信息, 最多每 PERFORMANCE_UPDATE_INTERVAL 秒一次"""
+    global last_performance_update
+    now = time.perf_counter()
+    if now - last_performance_update < PERFORMANCE_UPDATE_INTERVAL:
+        return
+    last_performance_update = now
+
+    physics = worker.profiler.summary()
+    render = render_profiler.summary()
+    lines = [f"渲染 {render['rate']:.1f} FPS | 物理 {physics['rate']:.1f} 步/秒",
+             f"启动: 可交互 {startup.marks['window']:.2f} s | 三维视图 {startup.marks.get('scene', 0.0):.2f} s"]
+    for name, values in physics['phases'].items():
+        lines.append(f"{PHASE_LABELS.get(name, name):<6}{values['mean_ms']:8.2f} ms  (p95 {values['p95_ms']:.2f})")
+    for name, values in render['phases'].items():
+        lines.append(f"{'场景更新':<6}{values['mean_ms']:8.2f} ms  (p95 {values['p95_ms']:.2f})")
+    counters = physics['counters']
+    lines.append(f"候选对 {counters.get('pairs_tested', 0):.0f} | 距离内 {counters.get('pairs_in_range', 0):.0f}"
+                 f" | 事件 {counters.get('events_fired', 0):.2f}/步")
+    lines.append(f"上传图元 {render['counters'].get('items_uploaded', 0):.1f}/帧"
+                 f" | 顶点 {render['counters'].get('vertices_uploaded', 0):.0f}/帧")
+    performance_label.setText('\n'.join(lines))
+
+
+def toggle_performance_overlay(checked):
+    performance_label.setVisible(checked)
+    if checked:
+        update_performance_overlay()
+
+
+def export_performance_data():
+    """把物理与渲染两条性能时间序列导出为 CSV 或 JSON"""
+    file_path, _ = QFileDialog.getSaveFileName(
+        window,
+        "导出性能数据",
+        f"Cosmos_Profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+        "CSV Files (*.csv);;JSON Files (*.json);;All Files (*)"
+    )
 
-        stats_label.setText(stats_text)
+    if file_path:
+        try:
+            export_profiles(file_path, {'physics': worker.profiler, 'render': render_profiler})
+            QMessageBox.information(window, "成功", f"性能数据已导出到:\n{file_path}")
+        except Exception as e:
+            QMessageBox.critical(window, "错误", f"导出性能数据失败: {str(e)}")
 
 composition_button.clicked.connect(composition_button_click)
 start_btn.clicked.connect(start_simulation)
 pause_btn.clicked.connect(pause_simulation)
 reset_btn.clicked.connect(reset_simulation)
+record_btn.clicked.connect(toggle_recording)
+open_recording_btn.clicked.connect(open_recording)
+replay_play_btn.clicked.connect(toggle_replay_playback)
+exit_replay_btn.clicked.connect(exit_replay)
+replay_slider.valueChanged.connect(seek_replay)
 speed_slider.valueChanged.connect(update_speed)
 interaction_dist_spin.valueChanged.connect(update_physics_params)
 fusion_prob_spin.valueChanged.connect(update_physics_params)
 structure_prob_spin.valueChanged.connect(update_physics_params)
+gravity_solver_combo.currentIndexChanged.connect(update_physics_params)
+opening_angle_spin.valueChanged.connect(update_physics_params)
+mesh_size_spin.valueChanged.connect(update_physics_params)
+compute_backend_combo.currentIndexChanged.connect(update_physics_params)
+compute_threads_spin.valueChanged.connect(update_physics_params)
+integrator_combo.currentIndexChanged.connect(update_physics_params)
+timestep_accuracy_spin.valueChanged.connect(update_physics_params)
 particle_count_spin.valueChanged.connect(update_particle_count)
 initial_energy_spin.valueChanged.connect(update_cosmo_params)
 expansion_rate_spin.valueChanged.connect(update_cosmo_params)
@@ -895,8 +1159,19 @@ dark_energy_spin.valueChanged.connect(update_cosmo_params)
 baryonic_spin.valueChanged.connect(update_cosmo_params)
 inflation_checkbox.stateChanged.connect(update_cosmo_params)
 quantum_fluctuations_checkbox.stateChanged.connect(update_cosmo_params)
+show_trajectories.toggled.connect(scene.set_trajectories_visible)
+show_performance.toggled.connect(toggle_performance_overlay)
+export_performance_btn.clicked.connect(export_performance_data)
+trail_length_spin.valueChanged.connect(update_trail_length)
+point_budget_spin.valueChanged.connect(lambda value: update_view())
+timer.timeout.connect(update_view)
 timer.timeout.connect(update_visualization)
+timer.timeout.connect(report_checkpoint_results)
+timer.timeout.connect(report_recording_results)
+app.aboutToQuit.connect(worker.stop)
 
 window.show()
 add_cosmology_import_export_buttons()
+# 先进入事件循环显示窗口, 再在第一轮事件处理中创建三维视图
+QTimer.singleShot(0, finish_startup)
 sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,276 @@
+import importlib.util
+import os
+
+import numpy as np
+
+from gravity import (GRAVITY_MIN_DISTANCE, GRAVITY_MAX_DISTANCE, GRAVITY_SOFTENING, MAX_FORCE_MAGNITUDE,
+                     cell_list_gravity_forces, direct_gravity_forces, reference_gravity_forces, target_cells)
+from parallel import ordered_map
+
+
+BACKEND_NAMES = ('reference', 'numpy', 'numba')
+# 'auto' 在装有 numba 时选 numba, 否则选 numpy; 环境变量 COSMOS_BACKEND 可以在启动时改变默认值
+DEFAULT_BACKEND = os.environ.get('COSMOS_BACKEND', 'auto')
+# 打包成单文件程序时模块目录是临时目录, JIT 缓存放到用户目录才能跨次启动复用
+NUMBA_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cosmic_evolution_simulator', 'numba')
+# numba 直接求和每个分块的受力粒子数
+NUMBA_DIRECT_ROWS = 256
+
+
+class BackendError(ValueError):
+    """未知的计算后端"""
+
+
+class ReferenceBackend:
+    """逐粒子, 逐粒子对的 Python 循环实现, 速度慢, 用作其他后端的对照
+
+    所有后端提供同样的四类热点核函数: 引力 (direct / cell_list), 积分, 邻居对查找
+    和反应粒子对的无冲突匹配; 结果在浮点误差范围内一致. 参考实现忽略 threads 参数,
+    其余后端把引力和邻居对查找分块在线程池中计算, 结果与线程数无关.
+    引力给出 targets 时只返回这些下标的粒子所受的力 (len(targets), 3).
+    """
+
+    name = 'reference'
+
+    def direct_gravity(self, positions, masses, gravitational_constant, threads=1, targets=None):
+        forces = reference_gravity_forces(positions, masses, gravitational_constant)
+        return forces if targets is None else forces[targets]
+
+    def cell_list_gravity(self, positions, masses, gravitational_constant, index, threads=1, targets=None):
+        positions = np.asarray(positions, dtype=np.float64)
+        forces = np.zeros((len(positions), 3), dtype=np.float64)
+        radius = GRAVITY_MAX_DISTANCE + index.skin
+        for pair_i, pair_j in index.subset(np.asarray(masses) > 0).candidate_pairs(radius):
+            for i, j in zip(pair_i.tolist(), pair_j.tolist()):
+                r_vec = positions[j] - positions[i]
+                r_sq = float(r_vec @ r_vec)
+                r_mag = r_sq ** 0.5
+                force_mag = gravitational_constant * masses[i] * masses[j] / (r_sq + GRAVITY_SOFTENING)
+                if (GRAVITY_MIN_DISTANCE < r_mag < GRAVITY_MAX_DISTANCE and np.isfinite(force_mag)
+                        and force_mag < MAX_FORCE_MAGNITUDE):
+                    forces[i] += force_mag / r_mag * r_vec
+                    forces[j] -= force_mag / r_mag * r_vec
+        if targets is not None:
+            forces = forces[targets]
+        return forces.astype(np.float32)
+
+    def integrate(self, positions, momenta, masses, energies, forces, expansion_rate, dt, max_position):
+        new_positions = np.empty_like(positions)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for n in range(len(positions)):
+                velocity = np.zeros(3, dtype=np.float32)
+                if energies[n] > 0:
+                    velocity[:] = np.nan_to_num(momenta[n] / energies[n], nan=0.0)
+                if masses[n] > 0:
+                    acceleration = np.nan_to_num(forces[n] / (masses[n] + 0.001), nan=0.0).astype(np.float32)
+                    if np.all(np.abs(acceleration) < 1e8):
+                        velocity += acceleration * np.float32(dt)
+                velocity = np.clip(velocity, -0.1, 0.1)
+                expansion = np.nan_to_num(expansion_rate * positions[n] * dt * 0.001, nan=0.0)
+                change = np.clip((velocity + expansion) * dt, -0.1, 0.1)
+                new_positions[n] = np.clip(positions[n] + change, -max_position, max_position)
+        return new_positions
+
+    def pairs_within(self, index, radius, positions, skin=0.0, threads=1):
+        # 不使用索引, 直接检查全部粒子对
+        positions = np.asarray(positions, dtype=np.float64)
+        found_i, found_j = [], []
+        for i in range(len(positions)):
+            for j in range(i + 1, len(positions)):
+                if np.linalg.norm(positions[j] - positions[i]) <= radius:
+                    found_i.append(i)
+                    found_j.append(j)
+        return np.array(found_i, dtype=np.int64), np.array(found_j, dtype=np.int64)
+
+    def match_pairs(self, pair_i, pair_j, candidates, count):
+        """按 candidates 的顺序贪心选出互不共用粒子的粒子对, 返回选中的候选下标 (升序)"""
+        used = set()
+        selected = []
+        for k in np.asarray(candidates).tolist():
+            i, j = int(pair_i[k]), int(pair_j[k])
+            if i in used or j in used:
+                continue
+            used.update((i, j))
+            selected.append(k)
+        return np.array(selected, dtype=np.int64)
+
+
+class NumpyBackend(ReferenceBackend):
+    """分块向量化的 NumPy 实现 (默认)"""
+
+    name = 'numpy'
+
+    def direct_gravity(self, positions, masses, gravitational_constant, threads=1, targets=None):
+        return direct_gravity_forces(positions, masses, gravitational_constant, targets=targets, threads=threads)
+
+    def cell_list_gravity(self, positions, masses, gravitational_constant, index, threads=1, targets=None):
+        return cell_list_gravity_forces(positions, masses, gravitational_constant, index, threads, targets)
+
+    def integrate(self, positions, momenta, masses, energies, forces, expansion_rate, dt, max_position):
+        velocity = np.zeros_like(momenta)
+        moving = energies > 0
+        velocity[moving] = momenta[moving] / energies[moving, np.newaxis]
+        velocity = np.nan_to_num(velocity, nan=0.0)
+
+        massive = masses > 0
+        acceleration = np.zeros_like(forces)
+        acceleration[massive] = forces[massive] / (masses[massive, np.newaxis] + 0.001)
+        acceleration = np.nan_to_num(acceleration, nan=0.0)
+        accelerated = massive & np.all(np.abs(acceleration) < 1e8, axis=1)
+        velocity[accelerated] += acceleration[accelerated] * dt
+
+        velocity = np.clip(velocity, -0.1, 0.1)
+
+        expansion_velocity = expansion_rate * positions * dt * 0.001
+        expansion_velocity = np.nan_to_num(expansion_velocity, nan=0.0)
+
+        position_change = (velocity + expansion_velocity) * dt
+        position_change = np.clip(position_change, -0.1, 0.1)
+
+        return np.clip(positions + position_change, -max_position, max_position).astype(np.float32)
+
+    def pairs_within(self, index, radius, positions, skin=0.0, threads=1):
+        return index.pairs_within(radius, positions, skin, threads)
+
+    def match_pairs(self, pair_i, pair_j, candidates, count):
+        """与顺序贪心匹配结果相同的分轮向量化实现
+
+        每一轮选出对两端粒子而言都是最早的剩余候选对 (顺序贪心也必然选中它们),
+        再删去与已选粒子冲突的候选对; 每轮至少选中最早的一对, 通常几轮即可结束.
+        """
+        remaining = np.asarray(candidates, dtype=np.int64)
+        selected = []
+        first = np.empty(count, dtype=np.int64)
+        used = np.zeros(count, dtype=bool)
+        while len(remaining):
+            i, j = pair_i[remaining], pair_j[remaining]
+            first[i] = np.iinfo(np.int64).max
+            first[j] = np.iinfo(np.int64).max
+            np.minimum.at(first, i, remaining)
+            np.minimum.at(first, j, remaining)
+            chosen = (first[i] == remaining) & (first[j] == remaining)
+            selected.append(remaining[chosen])
+            used[i[chosen]] = True
+            used[j[chosen]] = True
+            remaining = remaining[~(used[i] | used[j])]
+        if not selected:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(selected))
+
+
+class NumbaBackend(NumpyBackend):
+    """numba 编译的逐粒子对循环; 候选对仍由 NumPy 的 CellList 生成
+
+    编译结果缓存在 NUMBA_CACHE_DIR (可用同名环境变量覆盖), 只有第一次运行需要编译.
+    """
+
+    name = 'numba'
+
+    def __init__(self):
+        os.environ.setdefault('NUMBA_CACHE_DIR', NUMBA_CACHE_DIR)
+        import numba_kernels
+        self.kernels = numba_kernels
+
+    def direct_gravity(self, positions, masses, gravitational_constant, threads=1, targets=None):
+        positions = np.ascontiguousarray(positions, dtype=np.float64)
+        masses = np.ascontiguousarray(masses, dtype=np.float64)
+        valid = (masses > 0) & np.all(np.isfinite(positions), axis=1)
+        target_rows = np.arange(len(positions)) if targets is None else np.asarray(targets, dtype=np.int64)
+        tiles = [target_rows[start:start + NUMBA_DIRECT_ROWS]
+                 for start in range(0, len(target_rows), NUMBA_DIRECT_ROWS)]
+        blocks = ordered_map(lambda rows: self.kernels.direct_gravity_forces(
+            positions, masses, float(gravitational_constant), valid, rows), tiles, threads)
+        forces = np.concatenate(list(blocks)) if tiles else np.zeros((0, 3))
+        return forces.astype(np.float32)
+
+    def cell_list_gravity(self, positions, masses, gravitational_constant, index, threads=1, targets=None):
+        positions = np.ascontiguousarray(positions, dtype=np.float64)
+        masses = np.ascontiguousarray(masses, dtype=np.float64)
+        forces = np.zeros((len(positions), 3), dtype=np.float64)
+        index = index.subset(masses > 0)
+        active, cells = target_cells(index, targets, len(positions))
+
+        def batch_forces(batch):
+            rows, first, second = index.batch_local_pairs(batch)
+            if active is not None:
+                touching = active[rows[first]] | active[rows[second]]
+                first, second = first[touching], second[touching]
+            partial = np.zeros((len(rows), 3), dtype=np.float64)
+            self.kernels.pair_gravity_forces(positions[rows], masses[rows], float(gravitational_constant), rows,
+                                             first, second, partial)
+            return len(first), rows, partial
+
+        # 每批累加到只含它涉及的行的缓冲, 再按批的顺序合并: 结果与线程数无关, 开销与粒子对数成正比
+        batches = index.candidate_batches(GRAVITY_MAX_DISTANCE + index.skin, cells=cells)
+        for tested, rows, partial in ordered_map(batch_forces, batches, threads):
+            index.stats['pairs_tested'] += tested
+            self.kernels.add_rows(forces, rows, partial)
+        if targets is not None:
+            forces = forces[targets]
+        return forces.astype(np.float32)
+
+    def integrate(self, positions, momenta, masses, energies, forces, expansion_rate, dt, max_position):
+        return self.kernels.integrate_positions(
+            np.ascontiguousarray(positions, dtype=np.float32), np.ascontiguousarray(momenta, dtype=np.float32),
+            np.ascontiguousarray(masses, dtype=np.float64), np.ascontiguousarray(energies, dtype=np.float64),
+            np.ascontiguousarray(forces, dtype=np.float32), float(expansion_rate), float(dt), float(max_position))
+
+    def pairs_within(self, index, radius, positions, skin=0.0, threads=1):
+        positions = np.ascontiguousarray(positions, dtype=np.float64)
+
+        def close_pairs(batch):
+            i, j = index.batch_pairs(batch)
+            close = self.kernels.close_pairs(positions, i, j, float(radius))
+            return len(i), i[close], j[close]
+
+        found_i, found_j = [], []
+        for tested, i, j in ordered_map(close_pairs, index.candidate_batches(radius + skin), threads):
+            index.stats['pairs_tested'] += tested
+            found_i.append(i)
+            found_j.append(j)
+        if not found_i:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        i, j = np.concatenate(found_i), np.concatenate(found_j)
+        order = np.lexsort((j, i))
+        return i[order], j[order]
+
+    def match_pairs(self, pair_i, pair_j, candidates, count):
+        return self.kernels.greedy_match(np.ascontiguousarray(pair_i, dtype=np.int64),
+                                         np.ascontiguousarray(pair_j, dtype=np.int64),
+                                         np.ascontiguousarray(candidates, dtype=np.int64), int(count))
+
+
+_BACKEND_CLASSES = {
+    'reference': ReferenceBackend,
+    'numpy': NumpyBackend,
+    'numba': NumbaBackend,
+}
+_instances = {}
+
+
+def numba_available():
+    return importlib.util.find_spec('numba') is not None
+
+
+def available_backends():
+    return [name for name in BACKEND_NAMES if name != 'numba' or numba_available()]
+
+
+def resolve_backend_name(name):
+    """把 'auto' 或未安装的 'numba' 换成实际使用的后端名; 未知的名称抛出 BackendError"""
+    if name in (None, 'auto'):
+        return 'numba' if numba_available() else 'numpy'
+    if name not in _BACKEND_CLASSES:
+        raise BackendError(f"未知的计算后端: {name}")
+    if name == 'numba' and not numba_available():
+        # 在没有 numba 的机器上打开别处保存的配置时退回 NumPy
+        return 'numpy'
+    return name
+
+
+def get_backend(name=None):
+    """按名称返回 (缓存的) 后端实例"""
+    name = resolve_backend_name(name)
+    if name not in _instances:
+        _instances[name] = _BACKEND_CLASSES[name]()
+    return _instances[name]
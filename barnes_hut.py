@@ -0,0 +1,333 @@
+import argparse
+import time
+
+import numpy as np
+
+from gravity import (GRAVITY_MIN_DISTANCE, GRAVITY_MAX_DISTANCE, GRAVITY_SOFTENING,
+                     MAX_FORCE_MAGNITUDE, direct_gravity_forces)
+from parallel import ordered_map
+from spatial_index import expand_ranges
+
+
+MORTON_BITS = 21
+DEFAULT_OPENING_ANGLE = 0.5
+DEFAULT_LEAF_SIZE = 8
+# 每批同时遍历的受力粒子数, 限制 (粒子, 节点) 前沿数组的大小
+TRAVERSAL_CHUNK = 2048
+
+
+def _spread_bits(values):
+    """把 21 位整数的每一位间隔两位展开, 用于三维 Morton 编码"""
+    x = values.astype(np.uint64) & np.uint64(0x1fffff)
+    x = (x | (x << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+    x = (x | (x << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return x
+
+
+def morton_keys(cells):
+    """(N, 3) 的整数网格坐标 -> Morton 键"""
+    return (_spread_bits(cells[:, 0]) << np.uint64(2)) | (_spread_bits(cells[:, 1]) << np.uint64(1)) | \
+        _spread_bits(cells[:, 2])
+
+
+class Octree:
+    """按 Morton 序线性化的八叉树
+
+    粒子按 Morton 键排序后, 每个节点对应排序数组中的一段 [start, end),
+    同一父节点的子节点在节点数组中连续存放. 节点的质量与质心由前缀和求得.
+    """
+
+    def __init__(self, positions, masses, leaf_size=DEFAULT_LEAF_SIZE):
+        positions = np.asarray(positions, dtype=np.float64)
+        masses = np.asarray(masses, dtype=np.float64)
+        self.leaf_size = leaf_size
+
+        # 只有质量为正且位置有限的粒子才产生引力
+        source_index = np.flatnonzero((masses > 0) & np.all(np.isfinite(positions), axis=1))
+        source_pos = positions[source_index]
+
+        if len(source_index):
+            low = source_pos.min(axis=0)
+            size = float((source_pos.max(axis=0) - low).max())
+        else:
+            low = np.zeros(3)
+            size = 0.0
+        size = size * (1 + 1e-9) if size > 0 else 1.0
+        self.low = low
+        self.size = size
+
+        resolution = 1 << MORTON_BITS
+        cells = np.clip(((source_pos - low) / size * resolution).astype(np.int64), 0, resolution - 1)
+        keys = morton_keys(cells)
+        order = np.argsort(keys, kind='stable')
+
+        self.keys = keys[order]
+        self.cells = cells[order]
+        self.particle_index = source_index[order]
+        self.positions = source_pos[order]
+        self.masses = masses[source_index][order]
+
+        self._build_nodes()
+        self._compute_moments()
+
+    def _build_nodes(self):
+        n = len(self.keys)
+        starts = [np.array([0], dtype=np.int64)]
+        ends = [np.array([n], dtype=np.int64)]
+        levels = [np.array([0], dtype=np.int64)]
+        first_child = [np.array([-1], dtype=np.int64)]
+        child_count = [np.array([0], dtype=np.int64)]
+
+        level_start, level_end, level_offset = starts[0], ends[0], 0
+        for level in range(1, MORTON_BITS + 1):
+            split = np.flatnonzero(level_end - level_start > self.leaf_size)
+            if len(split) == 0 or n == 0:
+                break
+            parent_start = level_start[split]
+            parent_end = level_end[split]
+
+            # 只在需要细分的父节点区间内寻找新的子节点起点
+            covered = np.zeros(n + 1, dtype=np.int64)
+            np.add.at(covered, parent_start, 1)
+            np.add.at(covered, parent_end, -1)
+            covered = np.cumsum(covered[:-1]) > 0
+
+            prefix = self.keys >> np.uint64(3 * (MORTON_BITS - level))
+            boundary = np.ones(n, dtype=bool)
+            boundary[1:] = prefix[1:] != prefix[:-1]
+            boundary[parent_start] = True
+            child_start = np.flatnonzero(covered & boundary)
+
+            child_parent = np.searchsorted(parent_start, child_start, side='right') - 1
+            next_start = np.append(child_start[1:], n)
+            child_end = np.minimum(next_start, parent_end[child_parent])
+
+            node_base = level_offset + len(level_start)
+            counts = np.bincount(child_parent, minlength=len(split))
+            first_child[-1][split] = node_base + np.concatenate(([0], np.cumsum(counts)[:-1]))
+            child_count[-1][split] = counts
+
+            starts.append(child_start)
+            ends.append(child_end)
+            levels.append(np.full(len(child_start), level, dtype=np.int64))
+            first_child.append(np.full(len(child_start), -1, dtype=np.int64))
+            child_count.append(np.zeros(len(child_start), dtype=np.int64))
+
+            level_offset = node_base
+            level_start, level_end = child_start, child_end
+
+        self.node_start = np.concatenate(starts)
+        self.node_end = np.concatenate(ends)
+        self.node_level = np.concatenate(levels)
+        self.first_child = np.concatenate(first_child)
+        self.child_count = np.concatenate(child_count)
+
+    def _compute_moments(self):
+        cumulative_mass = np.concatenate(([0.0], np.cumsum(self.masses)))
+        cumulative_moment = np.vstack((np.zeros((1, 3)),
+                                       np.cumsum(self.masses[:, np.newaxis] * self.positions, axis=0)))
+        self.node_mass = cumulative_mass[self.node_end] - cumulative_mass[self.node_start]
+        moment = cumulative_moment[self.node_end] - cumulative_moment[self.node_start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.node_com = np.where(self.node_mass[:, np.newaxis] > 0,
+                                     moment / self.node_mass[:, np.newaxis], 0.0)
+
+        # 节点包围盒: 由节点中第一个粒子的网格坐标截取到该层得到
+        if len(self.cells):
+            shift = (MORTON_BITS - self.node_level)[:, np.newaxis]
+            first = self.cells[np.minimum(self.node_start, len(self.cells) - 1)]
+            cell = first >> shift
+        else:
+            cell = np.zeros((len(self.node_start), 3), dtype=np.int64)
+        width = self.size / (1 << self.node_level).astype(np.float64)
+        self.node_center = self.low + (cell + 0.5) * width[:, np.newaxis]
+        self.node_half = width / 2
+
+    def refit(self, positions):
+        """粒子移动后保留拓扑, 只更新质心与包围盒
+
+        适用于一步内位移远小于叶节点尺寸的情况; 位移较大时应重建.
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        self.positions = positions[self.particle_index]
+        cumulative_moment = np.vstack((np.zeros((1, 3)),
+                                       np.cumsum(self.masses[:, np.newaxis] * self.positions, axis=0)))
+        moment = cumulative_moment[self.node_end] - cumulative_moment[self.node_start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.node_com = np.where(self.node_mass[:, np.newaxis] > 0,
+                                     moment / self.node_mass[:, np.newaxis], 0.0)
+
+        # 包围盒收缩/扩展为恰好覆盖节点内全部粒子, 保证窗口判断仍然保守
+        if len(self.positions) == 0:
+            return
+        node_low = np.zeros((len(self.node_start), 3))
+        node_high = np.zeros((len(self.node_start), 3))
+        leaves = np.flatnonzero(self.child_count == 0)
+        leaves = leaves[np.argsort(self.node_start[leaves])]
+        node_low[leaves] = np.minimum.reduceat(self.positions, self.node_start[leaves], axis=0)
+        node_high[leaves] = np.maximum.reduceat(self.positions, self.node_start[leaves], axis=0)
+        # 自底向上合并: 同一层父节点的子节点恰好是下一层的全部节点且按父节点顺序连续
+        for level in range(int(self.node_level.max()) - 1, -1, -1):
+            parents = np.flatnonzero((self.node_level == level) & (self.child_count > 0))
+            if len(parents) == 0:
+                continue
+            first = self.first_child[parents]
+            stop = first[-1] + self.child_count[parents[-1]]
+            node_low[parents] = np.minimum.reduceat(node_low[:stop], first, axis=0)
+            node_high[parents] = np.maximum.reduceat(node_high[:stop], first, axis=0)
+        self.node_center = (node_low + node_high) / 2
+        self.node_half = (node_high - node_low).max(axis=1) / 2
+
+    def forces(self, target_positions, target_masses, gravitational_constant,
+               opening_angle=DEFAULT_OPENING_ANGLE, threads=1):
+        """计算每个目标粒子受到的引力, 规则与直接求和相同
+
+        节点整体落在 0.3 < r < 6.0 窗口内且满足 2h / d < opening_angle 时使用质心近似,
+        整体在窗口之外时跳过, 否则继续打开; 叶节点内逐对精确求和.
+        跨越 r = 6.0 截断球面的节点总是被打开到叶节点, 因此窗口边界是精确的,
+        误差只来自窗口内部的质心近似; opening_angle = 0 时结果与直接求和一致.
+        各批受力粒子互不重叠, 在 threads 个线程中并行遍历.
+        """
+        target_positions = np.asarray(target_positions, dtype=np.float64)
+        target_masses = np.asarray(target_masses, dtype=np.float64)
+        forces = np.zeros((len(target_positions), 3), dtype=np.float64)
+        receivers = np.flatnonzero((target_masses > 0) & np.all(np.isfinite(target_positions), axis=1))
+        if len(receivers) == 0 or len(self.masses) == 0:
+            return forces.astype(np.float32)
+
+        def chunk_forces(chunk):
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                return self._chunk_forces(target_positions[chunk], target_masses[chunk],
+                                          gravitational_constant, opening_angle)
+
+        chunks = [receivers[start:start + TRAVERSAL_CHUNK] for start in range(0, len(receivers), TRAVERSAL_CHUNK)]
+        for chunk, chunk_result in zip(chunks, ordered_map(chunk_forces, chunks, threads)):
+            forces[chunk] = chunk_result
+        return forces.astype(np.float32)
+
+    def _chunk_forces(self, pos, mass, gravitational_constant, opening_angle):
+        forces = np.zeros((len(pos), 3), dtype=np.float64)
+        target = np.arange(len(pos))
+        node = np.zeros(len(pos), dtype=np.int64)
+
+        while len(target):
+            offset = np.abs(pos[target] - self.node_center[node])
+            half = self.node_half[node][:, np.newaxis]
+            nearest = np.sqrt((np.maximum(offset - half, 0.0) ** 2).sum(axis=1))
+            farthest = np.sqrt(((offset + half) ** 2).sum(axis=1))
+
+            reachable = nearest < GRAVITY_MAX_DISTANCE
+            target, node = target[reachable], node[reachable]
+            nearest, farthest = nearest[reachable], farthest[reachable]
+
+            d_vec = self.node_com[node] - pos[target]
+            d_sq = (d_vec ** 2).sum(axis=1)
+            distance = np.sqrt(d_sq)
+            leaf = self.child_count[node] == 0
+            inside_window = (nearest > GRAVITY_MIN_DISTANCE) & (farthest < GRAVITY_MAX_DISTANCE)
+            accept = ~leaf & inside_window & (2 * self.node_half[node] < opening_angle * distance)
+
+            if accept.any():
+                t = target[accept]
+                force_mag = gravitational_constant * mass[t] * self.node_mass[node[accept]] / (
+                        d_sq[accept] + GRAVITY_SOFTENING)
+                force_mag = np.where(np.isfinite(force_mag), force_mag, 0.0)
+                self._accumulate(forces, t, (force_mag / distance[accept])[:, np.newaxis] * d_vec[accept])
+
+            if leaf.any():
+                self._leaf_forces(forces, pos, mass, target[leaf], node[leaf], gravitational_constant)
+
+            opened = ~leaf & ~accept
+            target, node = target[opened], node[opened]
+            counts = self.child_count[node]
+            target = np.repeat(target, counts)
+            node = expand_ranges(self.first_child[node], counts)
+
+        return forces
+
+    def _leaf_forces(self, forces, pos, mass, target, node, gravitational_constant):
+        counts = self.node_end[node] - self.node_start[node]
+        target = np.repeat(target, counts)
+        source = expand_ranges(self.node_start[node], counts)
+        r_vec = self.positions[source] - pos[target]
+        r_sq = (r_vec ** 2).sum(axis=1)
+        r_mag = np.sqrt(r_sq)
+        force_mag = gravitational_constant * mass[target] * self.masses[source] / (r_sq + GRAVITY_SOFTENING)
+        in_range = ((r_mag > GRAVITY_MIN_DISTANCE) & (r_mag < GRAVITY_MAX_DISTANCE) &
+                    np.isfinite(force_mag) & (force_mag < MAX_FORCE_MAGNITUDE))
+        coefficient = np.where(in_range, force_mag / r_mag, 0.0)
+        self._accumulate(forces, target, coefficient[:, np.newaxis] * r_vec)
+
+    @staticmethod
+    def _accumulate(forces, target, contribution):
+        for axis in range(3):
+            forces[:, axis] += np.bincount(target, weights=contribution[:, axis], minlength=len(forces))
+
+
+def barnes_hut_gravity_forces(positions, masses, gravitational_constant,
+                              opening_angle=DEFAULT_OPENING_ANGLE, leaf_size=DEFAULT_LEAF_SIZE, threads=1,
+                              targets=None):
+    """每步按当前位置重建八叉树并计算全部粒子 (或 targets 中的粒子) 所受引力"""
+    tree = Octree(positions, masses, leaf_size=leaf_size)
+    if targets is not None:
+        positions, masses = np.asarray(positions)[targets], np.asarray(masses)[targets]
+    return tree.forces(positions, masses, gravitational_constant, opening_angle, threads)
+
+
+def compare_gravity_solvers(particle_counts, opening_angle=DEFAULT_OPENING_ANGLE, sample_size=512,
+                            gravitational_constant=1e-15, max_position=10.0, seed=0):
+    """比较直接求和与八叉树求解器的耗时和力误差
+
+    大 N 时直接求和只对随机抽取的 sample_size 个粒子计算, 总耗时按比例外推.
+    误差为抽样粒子上 |F_tree - F_direct| / |F_direct| 的中位数和最大值.
+    """
+    rng = np.random.default_rng(seed)
+    mass_table = np.array([1.0, 0.938, 3.727, 0.0, 1e-9])
+    results = []
+    for count in particle_counts:
+        positions = rng.uniform(-max_position, max_position, (count, 3)).astype(np.float32)
+        masses = rng.choice(mass_table, count)
+
+        started = time.perf_counter()
+        tree_forces = barnes_hut_gravity_forces(positions, masses, gravitational_constant, opening_angle)
+        tree_seconds = time.perf_counter() - started
+
+        sample = rng.choice(count, size=min(sample_size, count), replace=False)
+        started = time.perf_counter()
+        direct_forces = direct_gravity_forces(positions, masses, gravitational_constant, targets=sample)
+        direct_seconds = (time.perf_counter() - started) * count / len(sample)
+
+        direct_norm = np.linalg.norm(direct_forces, axis=1)
+        error = np.linalg.norm(tree_forces[sample] - direct_forces, axis=1)
+        nonzero = direct_norm > 0
+        relative = error[nonzero] / direct_norm[nonzero]
+        results.append({
+            'particles': count,
+            'opening_angle': opening_angle,
+            'direct_seconds': direct_seconds,
+            'tree_seconds': tree_seconds,
+            'median_relative_error': float(np.median(relative)) if len(relative) else 0.0,
+            'max_relative_error': float(relative.max()) if len(relative) else 0.0,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较直接求和与 Barnes-Hut 引力求解器")
+    parser.add_argument('counts', nargs='*', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--theta', type=float, default=DEFAULT_OPENING_ANGLE, help="开角")
+    parser.add_argument('--sample', type=int, default=512, help="直接求和的抽样粒子数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'N':>9} {'theta':>6} {'direct(s)':>11} {'tree(s)':>9} {'median err':>11} {'max err':>9}")
+    for row in compare_gravity_solvers(args.counts, args.theta, args.sample, seed=args.seed):
+        print(f"{row['particles']:>9} {row['opening_angle']:>6.2f} {row['direct_seconds']:>11.3f} "
+              f"{row['tree_seconds']:>9.3f} {row['median_relative_error']:>11.2e} {row['max_relative_error']:>9.2e}")
+
+
+if __name__ == '__main__':
+    main()
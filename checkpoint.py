@@ -0,0 +1,195 @@
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from cosmic_engine import COSMOS_SIMULATOR_TYPE, initialize_simulator_state
+from event_log import EVENT_DTYPE, EVENT_TYPES, EventLog, compatible_event_types
+from particle_store import ParticleStore
+
+
+CHECKPOINT_MAGIC = b'COSMCKPT'
+CHECKPOINT_VERSION = 2
+CHECKPOINT_SUFFIX = '.cosmosckpt'
+# 文件头: 魔数, 版本, JSON 头的偏移和长度; 数据块按 64 字节对齐以便内存映射
+_PREFIX = struct.Struct('<8sIQQ')
+_ALIGNMENT = 64
+
+
+class CheckpointError(ValueError):
+    """检查点文件损坏或格式不符"""
+
+
+def _scalar_state(state):
+    # 只保存可直接写入 JSON 的标量状态 (参数, 计数器, 时间, 尺度因子等)
+    return {key: value for key, value in state.items()
+            if isinstance(value, (bool, int, float, str))}
+
+
+def capture_checkpoint(state):
+    """在拥有 state 的线程中拷贝出检查点所需的全部数据; 之后的写盘可以在任意线程进行
+
+    落盘的事件块只记录索引, 写盘时再逐块读回.
+    """
+    store = state['particles']
+    events = state['interaction_events']
+    memory_events = events.memory_chunks()
+    return {
+        'scalars': _scalar_state(state),
+        'rng': state['rng'].bit_generator.state,
+        'columns': {name: getattr(store, name).copy() for name in store.column_names},
+        'spilled_events': events.spilled_chunks(),
+        'memory_events': np.concatenate(memory_events) if memory_events else np.zeros(0, dtype=EVENT_DTYPE),
+    }
+
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % _ALIGNMENT))
+    return f.tell()
+
+
+def write_checkpoint(file_path, captured):
+    """把 capture_checkpoint 的结果写入文件; 先写临时文件再替换, 中途失败不会破坏旧检查点"""
+    temp_path = file_path + '.tmp'
+    header = {
+        'simulator_type': COSMOS_SIMULATOR_TYPE,
+        'scalars': captured['scalars'],
+        'rng': captured['rng'],
+        'event_types': list(EVENT_TYPES),
+        'columns': {},
+        'events': {'chunks': []},
+    }
+    with open(temp_path, 'wb') as f:
+        f.write(_PREFIX.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, 0, 0))
+
+        for name, column in captured['columns'].items():
+            offset = _pad(f)
+            f.write(np.ascontiguousarray(column).tobytes())
+            header['columns'][name] = {
+                'offset': offset,
+                'dtype': column.dtype.str,
+                'shape': list(column.shape[1:]),
+            }
+        header['particle_count'] = len(next(iter(captured['columns'].values()), ()))
+
+        # 事件连续写成一个 EVENT_DTYPE 数组, 并保留分块索引供按时间范围筛选
+        header['events']['offset'] = _pad(f)
+        row = 0
+        chunks = [EventLog.read_chunk(entry) for entry in captured['spilled_events']]
+        chunks.append(captured['memory_events'])
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            f.write(np.ascontiguousarray(chunk, dtype=EVENT_DTYPE).tobytes())
+            counts = np.bincount(chunk['event_type'], minlength=len(EVENT_TYPES))
+            header['events']['chunks'].append([
+                row, len(chunk), float(chunk['timestamp'][0]), float(chunk['timestamp'][-1]),
+                counts.tolist()])
+            row += len(chunk)
+        header['events']['count'] = row
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        header_offset = _pad(f)
+        f.write(header_bytes)
+        f.seek(0)
+        f.write(_PREFIX.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, header_offset, len(header_bytes)))
+    os.replace(temp_path, file_path)
+
+
+def _mapped_from(array, file_path):
+    # array 是否为映射自 file_path 的内存映射 (或其视图)
+    filename = getattr(array, 'filename', None)
+    return filename is not None and os.path.exists(file_path) and os.path.samefile(filename, file_path)
+
+
+def release_checkpoint_file(state, file_path):
+    """把 state 中映射自 file_path 的粒子列和落盘事件读入内存, 之后才能用新检查点覆盖该文件
+
+    load_checkpoint 返回的 state 以内存映射引用原文件; Windows 上无法替换仍被映射的文件,
+    其它平台上替换后这些映射也会失去与文件的对应.
+    """
+    store = state['particles']
+    store.materialize([name for name in store.column_names if _mapped_from(getattr(store, name), file_path)])
+    state['interaction_events'].materialize_spilled(lambda source: _mapped_from(source, file_path))
+
+
+def save_checkpoint(file_path, state):
+    release_checkpoint_file(state, file_path)
+    write_checkpoint(file_path, capture_checkpoint(state))
+
+
+def save_checkpoint_in_background(file_path, state, on_done=None):
+    """在调用线程中拷贝状态, 在后台线程中写盘; 完成后调用 on_done(file_path, error)"""
+    release_checkpoint_file(state, file_path)
+    captured = capture_checkpoint(state)
+
+    def write():
+        error = None
+        try:
+            write_checkpoint(file_path, captured)
+        except OSError as e:
+            error = e
+        if on_done is not None:
+            on_done(file_path, error)
+
+    thread = threading.Thread(target=write, name='checkpoint-writer', daemon=True)
+    thread.start()
+    return thread
+
+
+def _read_header(f):
+    prefix = f.read(_PREFIX.size)
+    if len(prefix) != _PREFIX.size:
+        raise CheckpointError("检查点文件不完整")
+    magic, version, header_offset, header_length = _PREFIX.unpack(prefix)
+    if magic != CHECKPOINT_MAGIC:
+        raise CheckpointError("这不是宇宙模拟器检查点文件")
+    if version != CHECKPOINT_VERSION:
+        raise CheckpointError(f"不支持的检查点版本: {version}")
+    f.seek(header_offset)
+    try:
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise CheckpointError(f"检查点文件头损坏: {e}") from e
+    if not compatible_event_types(header.get('event_types')):
+        raise CheckpointError("检查点中的事件类型与当前版本不一致")
+    return header
+
+
+def load_checkpoint(file_path):
+    """读取检查点, 返回可直接继续模拟的 state
+
+    粒子列和事件以写时复制的内存映射打开, 不会整体读入内存; 粒子列在下一次扩容时复制,
+    事件按需逐块读取, 因此返回的 state 使用期间不应删除该文件; 用 save_checkpoint 覆盖该文件时
+    会先把映射的数据读入内存.
+    随机数生成器的状态一并恢复, 后续演化与保存时逐位一致.
+    """
+    with open(file_path, 'rb') as f:
+        header = _read_header(f)
+
+    count = header['particle_count']
+    columns = {}
+    for name, info in header['columns'].items():
+        shape = (count,) + tuple(info['shape'])
+        if count:
+            columns[name] = np.memmap(file_path, dtype=np.dtype(info['dtype']), mode='c',
+                                      offset=info['offset'], shape=shape)
+        else:
+            columns[name] = np.zeros(shape, dtype=np.dtype(info['dtype']))
+
+    state = initialize_simulator_state()
+    state.update(header['scalars'])
+    state['particles'] = ParticleStore.from_columns(columns)
+
+    events = header['events']
+    if events['count']:
+        records = np.memmap(file_path, dtype=EVENT_DTYPE, mode='r',
+                            offset=events['offset'], shape=(events['count'],))
+        state['interaction_events'].attach_spilled(
+            [(records, row, n, first, last, counts) for row, n, first, last, counts in events['chunks']])
+
+    state['rng'] = np.random.default_rng()
+    state['rng'].bit_generator.state = header['rng']
+    return state
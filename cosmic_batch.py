@@ -0,0 +1,112 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from backends import BACKEND_NAMES, resolve_backend_name
+from cosmic_engine import Universe, load_cosmos_config
+from cosmic_stats import CosmicStats, export_history
+from integrators import INTEGRATORS
+from particle_store import PARTICLE_COLUMNS
+from recording import RunRecorder
+
+
+def run_batch(config, steps, report_every=0, log=None, record_history=False, record_path=None):
+    """运行 steps 个物理子步, 不做帧率控制; 返回 (universe, 结果字典)
+
+    record_history 为真时挂接 CosmicStats, 运行结束后可从 universe.state['stats'] 读取降采样历史.
+    给出 record_path 时把初始状态和每个子步写入录像文件, 可在界面中回放.
+    """
+    universe = Universe(config)
+    if record_history:
+        universe.state['stats'] = CosmicStats()
+        universe.state['stats'].rebuild(universe.state)
+    recorder = None
+    if record_path:
+        recorder = RunRecorder(record_path)
+        recorder.capture(universe.state)
+    started = time.perf_counter()
+    done = 0
+    while done < steps:
+        chunk = steps - done if not report_every else min(report_every, steps - done)
+        if recorder is None:
+            universe.step(chunk)
+        else:
+            for _ in range(chunk):
+                universe.step(1)
+                recorder.capture(universe.state)
+        done += chunk
+        if log is not None and report_every:
+            summary = universe.summary()
+            log.write(f"step {done}/{steps}: {summary['particle_count']} 粒子, "
+                      f"{summary['event_count']} 相互作用, 尺度因子 {summary['scale_factor']:.4f}\n")
+    wall_time = time.perf_counter() - started
+    if recorder is not None:
+        error = recorder.close()
+        if error is not None:
+            raise error
+
+    result = universe.summary()
+    result.update({
+        'compute_backend': resolve_backend_name(universe.state['compute_backend']),
+        'integrator': universe.state['integrator'],
+        'steps': steps,
+        'wall_time': wall_time,
+        'steps_per_second': steps / wall_time if wall_time > 0 else float('inf'),
+    })
+    return universe, result
+
+
+def save_particles(file_path, universe):
+    """把全部粒子列写入 .npz 文件"""
+    store = universe.particles
+    np.savez_compressed(file_path, **{name: getattr(store, name) for name in PARTICLE_COLUMNS})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无界面运行宇宙演化模拟")
+    parser.add_argument('config', help=".cosmos 配置文件")
+    parser.add_argument('--steps', type=int, default=1000, help="物理子步数")
+    parser.add_argument('--output', help="结果摘要 JSON 文件, 默认输出到标准输出")
+    parser.add_argument('--particles', help="最终粒子状态 .npz 文件")
+    parser.add_argument('--history', help="降采样的统计时间序列 CSV 文件")
+    parser.add_argument('--record', help="逐步录像文件 (.cosmosrec), 可在界面中回放")
+    parser.add_argument('--report-every', type=int, default=0, help="每隔多少步在标准错误输出进度")
+    parser.add_argument('--backend', choices=('auto',) + BACKEND_NAMES, help="计算后端, 覆盖配置中的设置")
+    parser.add_argument('--threads', type=int, help="每步分块计算的线程数, 0 表示全部核心, 覆盖配置中的设置")
+    parser.add_argument('--integrator', choices=INTEGRATORS, help="积分器, 覆盖配置中的设置")
+    args = parser.parse_args(argv)
+
+    config = load_cosmos_config(args.config)
+    if args.backend:
+        config['compute_backend'] = args.backend
+    if args.threads is not None:
+        config['compute_threads'] = args.threads
+    if args.integrator:
+        config['integrator'] = args.integrator
+    universe, result = run_batch(config, args.steps, args.report_every, log=sys.stderr,
+                                 record_history=bool(args.history), record_path=args.record)
+    result['config'] = args.config
+    if args.record:
+        result['recording_file'] = args.record
+
+    if args.history:
+        export_history(args.history, universe.state['stats'])
+        result['history_file'] = args.history
+
+    if args.particles:
+        save_particles(args.particles, universe)
+        result['particles_file'] = args.particles
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
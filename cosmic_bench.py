@@ -0,0 +1,347 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from backends import BACKEND_NAMES, DEFAULT_BACKEND, resolve_backend_name
+from checkpoint import load_checkpoint, save_checkpoint
+from cosmic_engine import (STEP_DT, build_cosmos_config, initialize_particles, initialize_simulator_state,
+                           integrate_particles, load_cosmos_config, physics_step, record_trails,
+                           save_cosmos_config)
+from integrators import DEFAULT_INTEGRATOR, INTEGRATORS
+from lod import PointLOD
+from parallel import DEFAULT_THREADS, resolve_threads
+from profiling import PhaseProfiler
+from simulation_worker import take_snapshot
+
+
+BENCH_COUNTS = (30, 1000, 10000, 100000, 1000000)
+BENCH_SEED = 20240601
+
+
+def _timed(function, repeats):
+    """先在 tracemalloc 下运行一次 (兼作预热) 记录峰值内存, 再计时运行 repeats 次"""
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return times, peak
+
+
+def _record(case, particles, times, peak, **extra):
+    record = {
+        'case': case,
+        'particles': particles,
+        'repeats': len(times),
+        'wall_time': statistics.median(times),
+        'wall_time_min': min(times),
+        'peak_memory': peak,
+    }
+    record.update(extra)
+    return record
+
+
+def bench_state(count, solver, backend=DEFAULT_BACKEND, threads=DEFAULT_THREADS, integrator=DEFAULT_INTEGRATOR):
+    state = initialize_simulator_state()
+    state.update(num_particles=count, seed=BENCH_SEED, gravity_solver=solver, compute_backend=backend,
+                 compute_threads=threads, integrator=integrator)
+    initialize_particles(state)
+    return state
+
+
+def bench_initialize(count, solver, repeats, backend=DEFAULT_BACKEND):
+    state = initialize_simulator_state()
+    state.update(num_particles=count, seed=BENCH_SEED, gravity_solver=solver, compute_backend=backend)
+    times, peak = _timed(lambda: initialize_particles(state), repeats)
+    return [_record('initialize_particles', count, times, peak)]
+
+
+def bench_step(count, solver, repeats, backend=DEFAULT_BACKEND, threads=DEFAULT_THREADS,
+               integrator=DEFAULT_INTEGRATOR):
+    """用 physics_step 自带的分阶段计时推进 repeats 个子步; 另用一个子步测量各阶段峰值内存"""
+    state = bench_state(count, solver, backend, threads, integrator)
+
+    state['profiler'] = PhaseProfiler(trace_memory=True)
+    tracemalloc.start()
+    physics_step(state)
+    tracemalloc.stop()
+    peaks = state['profiler'].series()
+
+    profiler = state['profiler'] = PhaseProfiler()
+    step_times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        physics_step(state)
+        step_times.append(time.perf_counter() - started)
+    series = profiler.series()
+
+    records = [_record('physics_step', count, step_times, int(max(peaks[f'{phase}.peak_memory'][0]
+                                                                  for phase in profiler.phases)),
+                       steps_per_second=1.0 / statistics.median(step_times), solver=solver,
+                       pairs_tested=float(series['pairs_tested'].mean()),
+                       pairs_in_range=float(series['pairs_in_range'].mean()),
+                       force_evaluations=float(series['force_evaluations'].mean()))]
+    for phase in profiler.phases:
+        records.append(_record(f'physics_step.{phase}', count, series[phase].tolist(),
+                               int(peaks[f'{phase}.peak_memory'][0]), solver=solver))
+    return records
+
+
+def _scene_layer():
+    """无显示环境下创建离屏的 GL 场景; 缺少 Qt 或 OpenGL 时返回 None"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+        import pyqtgraph.opengl as gl
+        from gl_scene import SceneLayer
+    except ImportError:
+        return None
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    widget = gl.GLViewWidget()
+    return app, widget, SceneLayer(widget)
+
+
+def bench_render(count, solver, repeats, scene=None, backend=DEFAULT_BACKEND):
+    state = bench_state(count, solver, backend)
+    # 不计算引力, 只推进几步并记录轨迹, 让轨迹缓冲里有线段可画
+    for _ in range(3):
+        integrate_particles(state, np.zeros_like(state['particles'].momentum), STEP_DT)
+        record_trails(state)
+    trail_vertices = len(take_snapshot(state, 0).trail_vertices)
+    if not trail_vertices:
+        raise RuntimeError("预热后快照中没有轨迹线段, 渲染基准无法反映轨迹的开销")
+
+    frame = [0]
+
+    def snapshot():
+        frame[0] += 1
+        return take_snapshot(state, frame[0])
+
+    times, peak = _timed(snapshot, repeats)
+    records = [_record('snapshot', count, times, peak, trail_vertices=trail_vertices)]
+    lod = PointLOD()
+    times, peak = _timed(lambda: take_snapshot(state, 0, lod), repeats)
+    records.append(_record('snapshot_lod', count, times, peak))
+    if scene is not None:
+        layer = scene[2]
+        latest = snapshot()
+        times, peak = _timed(lambda: layer.update(latest), repeats)
+        records.append(_record('scene_update', count, times, peak))
+    return records
+
+
+def bench_io(count, solver, repeats, directory, backend=DEFAULT_BACKEND):
+    state = bench_state(count, solver, backend)
+    config_path = os.path.join(directory, 'bench.cosmos')
+    checkpoint_path = os.path.join(directory, 'bench.cosmosckpt')
+    config = build_cosmos_config(state)
+    records = []
+    times, peak = _timed(lambda: save_cosmos_config(config_path, config), repeats)
+    records.append(_record('config_save', count, times, peak))
+    times, peak = _timed(lambda: load_cosmos_config(config_path), repeats)
+    records.append(_record('config_load', count, times, peak))
+    times, peak = _timed(lambda: save_checkpoint(checkpoint_path, state), repeats)
+    records.append(_record('checkpoint_save', count, times, peak))
+    times, peak = _timed(lambda: load_checkpoint(checkpoint_path), repeats)
+    records.append(_record('checkpoint_load', count, times, peak))
+    return records
+
+
+def bench_startup(repeats, timeout=120.0):
+    """在子进程中离屏启动界面, 记录从启动进程到窗口可交互和三维视图就绪的时间及各启动阶段的耗时
+
+    界面在写出 COSMOS_STARTUP_REPORT 后按 COSMOS_STARTUP_EXIT 立即退出; 启动失败时返回空列表.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CosmicEvolutionSimulator.py')
+    reports = []
+    with tempfile.TemporaryDirectory(prefix='cosmos_startup_') as directory:
+        report_path = os.path.join(directory, 'startup.json')
+        env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'),
+                   COSMOS_STARTUP_REPORT=report_path, COSMOS_STARTUP_EXIT='1')
+        for _ in range(repeats):
+            launched = time.time()
+            try:
+                subprocess.run([sys.executable, script], env=env, cwd=directory, capture_output=True,
+                               timeout=timeout, check=True)
+                with open(report_path, 'r', encoding='utf-8') as f:
+                    report = json.load(f)
+            except (OSError, subprocess.SubprocessError, ValueError):
+                return []
+            report['launched'] = launched
+            reports.append(report)
+
+    records = []
+    for name, mark in (('startup.interactive', 'window'), ('startup.scene_ready', 'scene')):
+        times = [report['wall_clock'][mark] - report['launched'] for report in reports]
+        records.append(_record(name, 0, times, 0))
+    for phase in reports[0]['phases']:
+        records.append(_record(f'startup.{phase}', 0, [report['phases'][phase] for report in reports], 0))
+    return records
+
+
+def _git_revision():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=directory, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=directory,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ('-dirty' if dirty else '')
+
+
+def run_suite(counts=BENCH_COUNTS, solver='cell_list', repeats=3, budget=60.0, log=None, backend=DEFAULT_BACKEND,
+              threads=DEFAULT_THREADS, integrator=DEFAULT_INTEGRATOR, startup=True):
+    """运行全部基准, 返回可写成 JSON 的结果
+
+    物理子步的耗时在粒子密集时近似随 N^2 增长; 按上一档的实测时间预计超过 budget 秒的
+    档位会被跳过并在结果中注明, 避免 10^6 粒子时长时间无响应.
+    startup 为真且可以创建 GL 场景时, 另外测量界面的启动时间 (粒子数记为 0).
+    """
+    scene = _scene_layer()
+    results = []
+    skipped = []
+    if startup and scene is not None:
+        startup_records = bench_startup(repeats)
+        results.extend(startup_records)
+        if log is not None and startup_records:
+            log.write(f"界面可交互: {startup_records[0]['wall_time']:.3f}s\n")
+    last_step = None
+    with tempfile.TemporaryDirectory(prefix='cosmos_bench_') as directory:
+        for count in sorted(counts):
+            results.extend(bench_initialize(count, solver, repeats, backend))
+            results.extend(bench_render(count, solver, repeats, scene, backend))
+            results.extend(bench_io(count, solver, repeats, directory, backend))
+
+            if last_step is not None:
+                last_count, last_time = last_step
+                predicted = last_time * (count / last_count) ** 2 * (repeats + 1)
+                if predicted > budget:
+                    skipped.append({'case': 'physics_step', 'particles': count,
+                                    'reason': f"预计耗时 {predicted:.0f}s 超过预算 {budget:.0f}s"})
+                    if log is not None:
+                        log.write(f"跳过 {count} 粒子的 physics_step: 预计 {predicted:.0f}s\n")
+                    continue
+            step_records = bench_step(count, solver, repeats, backend, threads, integrator)
+            results.extend(step_records)
+            last_step = (count, step_records[0]['wall_time'])
+            if log is not None:
+                log.write(f"{count} 粒子: {step_records[0]['steps_per_second']:.2f} 子步/秒\n")
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': BENCH_SEED,
+            'solver': solver,
+            'backend': resolve_backend_name(backend),
+            'threads': resolve_threads(threads),
+            'integrator': integrator,
+            'repeats': repeats,
+            'scene': scene is not None,
+        },
+        'results': results,
+        'skipped': skipped,
+    }
+
+
+def compare_results(baseline, candidate, threshold=0.1):
+    """按 (case, particles) 对齐两次结果, 返回比较行; ratio > 1 + threshold 记为退化"""
+    old = {(r['case'], r['particles']): r for r in baseline['results']}
+    rows = []
+    for record in candidate['results']:
+        key = (record['case'], record['particles'])
+        if key not in old:
+            continue
+        ratio = record['wall_time'] / old[key]['wall_time'] if old[key]['wall_time'] > 0 else float('inf')
+        rows.append({
+            'case': record['case'],
+            'particles': record['particles'],
+            'baseline': old[key]['wall_time'],
+            'candidate': record['wall_time'],
+            'ratio': ratio,
+            'memory_ratio': record['peak_memory'] / max(old[key]['peak_memory'], 1),
+            'regression': ratio > 1 + threshold,
+        })
+    return rows
+
+
+def _format_comparison(rows, baseline, candidate):
+    lines = [f"基准: {baseline['meta'].get('revision')}  对比: {candidate['meta'].get('revision')}",
+             f"{'case':<28}{'N':>9}{'baseline':>12}{'candidate':>12}{'ratio':>8}{'mem':>8}"]
+    for row in rows:
+        flag = '  退化' if row['regression'] else ''
+        lines.append(f"{row['case']:<28}{row['particles']:>9}{row['baseline']:>12.5f}"
+                     f"{row['candidate']:>12.5f}{row['ratio']:>8.2f}{row['memory_ratio']:>8.2f}{flag}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="宇宙演化模拟器性能基准")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="运行基准并输出 JSON")
+    run.add_argument('--counts', default=','.join(str(c) for c in BENCH_COUNTS), help="粒子数列表, 逗号分隔")
+    run.add_argument('--solver', default='cell_list',
+                     choices=['cell_list', 'direct', 'barnes_hut', 'particle_mesh', 'p3m'])
+    run.add_argument('--backend', default=DEFAULT_BACKEND, choices=('auto',) + BACKEND_NAMES, help="计算后端")
+    run.add_argument('--threads', type=int, default=DEFAULT_THREADS, help="physics_step 的计算线程数, 0 表示全部核心")
+    run.add_argument('--integrator', default=DEFAULT_INTEGRATOR, choices=INTEGRATORS, help="physics_step 的积分器")
+    run.add_argument('--repeats', type=int, default=3, help="每项计时的重复次数")
+    run.add_argument('--budget', type=float, default=60.0, help="单档 physics_step 的预计耗时上限 (秒)")
+    run.add_argument('--skip-startup', action='store_true', help="不测量界面启动时间")
+    run.add_argument('--output', help="结果 JSON 文件, 默认输出到标准输出")
+
+    compare = commands.add_parser('compare', help="比较两次运行 (通常来自两个版本) 的结果")
+    compare.add_argument('baseline', help="基准结果 JSON")
+    compare.add_argument('candidate', help="对比结果 JSON")
+    compare.add_argument('--threshold', type=float, default=0.1, help="耗时增加超过该比例记为退化")
+    compare.add_argument('--json', action='store_true', help="以 JSON 输出比较结果")
+    compare.add_argument('--fail-on-regression', action='store_true', help="存在退化时以状态码 1 退出")
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        counts = [int(c) for c in args.counts.split(',') if c.strip()]
+        result = run_suite(counts, args.solver, args.repeats, args.budget, log=sys.stderr, backend=args.backend,
+                           threads=args.threads, integrator=args.integrator, startup=not args.skip_startup)
+        text = json.dumps(result, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        else:
+            print(text)
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        candidate = json.load(f)
+    rows = compare_results(baseline, candidate, args.threshold)
+    if args.json:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+    else:
+        print(_format_comparison(rows, baseline, candidate))
+    return 1 if args.fail_on_regression and any(row['regression'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
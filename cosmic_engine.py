@@ -0,0 +1,693 @@
+import json
+import math
+from datetime import datetime
+
+import numpy as np
+
+from backends import DEFAULT_BACKEND, get_backend
+from event_log import EventLog
+from integrators import (DEFAULT_INTEGRATOR, DEFAULT_TIMESTEP_ACCURACY, INTEGRATORS, IntegratorError,
+                         leapfrog_step, pair_potential)
+from parallel import DEFAULT_THREADS, resolve_threads
+from particle_store import ParticleStore
+from profiling import NULL_PROFILER
+from reactions import REACTION_RULES, ReactionTable
+from gravity import GRAVITY_MAX_DISTANCE, dark_energy_repulsion
+from barnes_hut import barnes_hut_gravity_forces
+from particle_mesh import DEFAULT_MESH_SIZE, MESH_SOLVERS, mesh_gravity_forces, mesh_inner_distance
+from spatial_index import CellList
+
+
+cosmology_data = {
+    "DARK_MATTER": ("DM", 1.0, 0, 1e30, 0, (0.2, 0.2, 0.6, 1)),
+    "DARK_ENERGY": ("DE", 0.0, 0, 1e30, 0, (0.6, 0.2, 0.6, 1)),
+    "HYDROGEN": ("H", 0.938, 1, 1e30, 0.5, (0.1, 0.5, 0.9, 1)),
+    "HELIUM": ("He", 3.727, 2, 1e30, 0, (0.3, 0.7, 0.9, 1)),
+    "NEUTRON": ("n", 0.940, 0, 880, 0.5, (0.7, 0.7, 0.7, 1)),
+    "PHOTON": ("γ", 0, 0, 1e30, 1, (1, 1, 0.8, 1)),
+    "NEUTRINO": ("ν", 1e-9, 0, 1e30, 0.5, (0.8, 0.8, 1, 1)),
+    "ELECTRON": ("e-", 0.000511, -1, 1e30, 0.5, (1, 0.3, 0.3, 1)),
+    "PROTON": ("p+", 0.938, 1, 1e30, 0.5, (1, 0.5, 0.5, 1)),
+    "QUARK_UP": ("u", 0.003, 0.667, 1e30, 0.5, (0.9, 0.2, 0.2, 1)),
+    "QUARK_DOWN": ("d", 0.006, -0.333, 1e30, 0.5, (0.2, 0.2, 0.9, 1)),
+    "GRAVITON": ("G", 0, 0, 1e30, 2, (0.5, 0.8, 0.5, 1)),
+    "STAR": ("★", 1000, 0, 1e20, 0, (1, 1, 0.3, 1)),
+    "GALAXY": ("🌀", 10000, 0, 1e25, 0, (0.8, 0.4, 0.8, 1)),
+    "BLACK_HOLE": ("●", 100000, 0, 1e30, 0, (0.1, 0.1, 0.1, 1))
+}
+
+# 按整数类型码索引的粒子属性表, 供列式计算直接查表
+PARTICLE_TYPES = list(cosmology_data)
+TYPE_CODES = {p_type: code for code, p_type in enumerate(PARTICLE_TYPES)}
+TYPE_MASS = np.array([cosmology_data[p_type][1] for p_type in PARTICLE_TYPES], dtype=np.float64)
+TYPE_CHARGE = np.array([cosmology_data[p_type][2] for p_type in PARTICLE_TYPES], dtype=np.float64)
+TYPE_COLOR = np.array([cosmology_data[p_type][5] for p_type in PARTICLE_TYPES], dtype=np.float32)
+SPIN_STATES = ["UP", "DOWN", "LEFT", "RIGHT"]
+BARYONIC_TYPE_CODES = np.array([TYPE_CODES[p_type] for p_type in ["HYDROGEN", "HELIUM", "PHOTON", "NEUTRINO"]],
+                               dtype=np.int16)
+# 聚变与结构形成的反应规则, 见 reactions.py
+REACTION_TABLE = ReactionTable(REACTION_RULES, PARTICLE_TYPES)
+
+# 每个子步每个坐标分量的位移被限制在 0.1 以内
+MAX_STEP_DISPLACEMENT = 0.1 * math.sqrt(3)
+# 蛙跳积分在各小步间复用邻居索引, 粒子离开建索引时的位置超过 skin / 2 才重建;
+# 步末的索引因此与反应检测的 2 * MAX_STEP_DISPLACEMENT 余量相容
+LEAPFROG_INDEX_SKIN = 2 * MAX_STEP_DISPLACEMENT
+STEP_DT = 1e8
+DEFAULT_TRAIL_LENGTH = 6
+
+COSMOS_SIMULATOR_TYPE = 'cosmology_simulator'
+COSMOS_VERSION = '1.0'
+# .cosmos 文件中直接对应 simulator_state 的物理参数
+COSMOS_STATE_KEYS = (
+    'dark_matter_ratio',
+    'dark_energy_ratio',
+    'baryonic_ratio',
+    'initial_energy',
+    'expansion_rate',
+    'interaction_distance',
+    'fusion_probability',
+    'structure_formation_probability',
+    'num_particles',
+    'gravitational_constant',
+    'cosmic_inflation',
+    'quantum_fluctuations',
+    'gravity_solver',
+    'opening_angle',
+    'mesh_size',
+    'trail_length',
+    'seed',
+    'compute_backend',
+    'compute_threads',
+    'integrator',
+    'timestep_accuracy',
+)
+
+
+class CosmosConfigError(ValueError):
+    """文件不是本模拟器的 .cosmos 配置"""
+
+
+def trail_columns(trail_length):
+    """轨迹环形缓冲列: 每个粒子 trail_length 个位置, 以及已写入的点数"""
+    return {
+        'trail': (np.float32, (trail_length, 3)),
+        'trail_count': (np.int16, ()),
+    }
+
+
+def new_particle_store(trail_length, capacity=64):
+    return ParticleStore(capacity, extra_columns=trail_columns(trail_length))
+
+
+def new_seed():
+    """从系统熵源生成一个 32 位随机种子"""
+    return int(np.random.SeedSequence().generate_state(1)[0])
+
+
+def initialize_simulator_state():
+    seed = new_seed()
+    return {
+        'particles': new_particle_store(DEFAULT_TRAIL_LENGTH),
+        'trail_head': 0,
+        'interaction_events': EventLog(),
+        # 全部随机数都来自这个生成器; initialize_particles 按 seed 重新播种
+        'seed': seed,
+        'rng': np.random.default_rng(seed),
+        'gravitational_pairs': [],
+        'time': 0.0,
+        'scale_factor': 1.0,
+        'event_counter': 0,
+        'particle_counter': 0,
+        'interaction_distance': 0.5,
+        'fusion_probability': 0.1,
+        'structure_formation_probability': 0.05,
+        'initial_energy': 3.0,
+        'num_particles': 20,
+        'universe_age': 13.8,
+        'dark_matter_ratio': 0.27,
+        'dark_energy_ratio': 0.68,
+        'baryonic_ratio': 0.05,
+        'expansion_rate': 0.00002,
+        'gravitational_constant': 1e-15,
+        'cosmic_inflation': False,
+        'quantum_fluctuations': True,
+        'gravity_solver': 'cell_list',
+        'opening_angle': 0.5,
+        # 'particle_mesh' 与 'p3m' 求解器每个方向的网格数, 见 particle_mesh.py
+        'mesh_size': DEFAULT_MESH_SIZE,
+        # 'auto', 'reference', 'numpy' 或 'numba', 见 backends.py
+        'compute_backend': DEFAULT_BACKEND,
+        # 引力与反应候选对分块计算的线程数, 0 表示全部核心; 结果与线程数无关
+        'compute_threads': DEFAULT_THREADS,
+        # 'euler' (固定步长, 带位移限制) 或 'leapfrog' (分级步长的 KDK 蛙跳), 见 integrators.py
+        'integrator': DEFAULT_INTEGRATOR,
+        'timestep_accuracy': DEFAULT_TIMESTEP_ACCURACY,
+        'trail_length': DEFAULT_TRAIL_LENGTH,
+        'max_position': 10.0
+    }
+
+
+def clamp_position(position, max_val):
+    return np.clip(position, -max_val, max_val).astype(np.float32)
+
+
+def create_stable_particles(state, positions, momenta, type_codes, particle_ids, creation_time=0.0, spin=None,
+                            **extra_columns):
+    """批量创建粒子并追加到列式存储中, 返回新行的起始下标; extra_columns 为附加列 (如 universe) 的取值
+
+    spin 为 None 时从 state['rng'] 抽取自旋.
+    """
+    store = state['particles']
+    type_codes = np.asarray(type_codes, dtype=np.int16)
+    particle_mass = TYPE_MASS[type_codes]
+
+    positions = np.nan_to_num(np.asarray(positions, dtype=np.float32).reshape(-1, 3),
+                              nan=0.0, posinf=3.0, neginf=-3.0)
+    momenta = np.nan_to_num(np.asarray(momenta, dtype=np.float32).reshape(-1, 3),
+                            nan=0.0, posinf=0.5, neginf=-0.5)
+
+    momentum_norm = np.linalg.norm(momenta, axis=1)
+    momentum_norm = np.where(np.isfinite(momentum_norm), momentum_norm, 0.0)
+    energy_sq = momentum_norm.astype(np.float64) ** 2 + particle_mass ** 2
+    energy = np.where(energy_sq > 0, np.sqrt(energy_sq), 0.001)
+
+    if spin is None:
+        spin = state['rng'].integers(0, len(SPIN_STATES), size=len(type_codes), dtype=np.int8)
+
+    start = store.extend(
+        position=positions,
+        momentum=momenta,
+        mass=particle_mass,
+        charge=TYPE_CHARGE[type_codes],
+        energy=energy,
+        type_code=type_codes,
+        particle_id=np.asarray(particle_ids, dtype=np.int64),
+        creation_time=np.full(len(type_codes), creation_time, dtype=np.float64),
+        spin=spin,
+        **extra_columns
+    )
+    start_trails(state, start)
+    stats = state.get('stats')
+    if stats is not None:
+        stats.add_rows(store, slice(start, None))
+    return start
+
+
+def start_trails(state, start):
+    """从第 start 行起的新粒子以当前位置作为轨迹的第一个点, 写在最近一次写入的槽位上"""
+    store = state['particles']
+    latest_slot = (state['trail_head'] - 1) % store.trail.shape[1]
+    store.trail[start:, latest_slot] = store.position[start:]
+    store.trail_count[start:] = 1
+
+
+def create_stable_particle(state, position, momentum, p_type, particle_id, creation_time=0.0):
+    """创建单个粒子, 返回其行下标"""
+    return create_stable_particles(state, [position], [momentum], [TYPE_CODES[p_type]],
+                                   [particle_id], creation_time)
+
+
+def remove_particles(state, remove_mask):
+    """按掩码删除粒子并压缩存储 (轨迹随行一起移动)"""
+    remove_mask = np.asarray(remove_mask, dtype=bool)
+    if not remove_mask.any():
+        return
+    stats = state.get('stats')
+    if stats is not None:
+        stats.remove_rows(state['particles'], remove_mask)
+    state['particles'].compact(~remove_mask)
+
+
+def record_trails(state):
+    """把当前位置写入每个粒子的轨迹环形缓冲; 只写一个槽位, 不分配内存"""
+    store = state['particles']
+    trail_length = store.trail.shape[1]
+    head = state['trail_head']
+    store.trail[:, head] = store.position
+    np.minimum(store.trail_count + 1, trail_length, out=store.trail_count)
+    state['trail_head'] = (head + 1) % trail_length
+
+
+def ordered_trails(state, rows=None):
+    """按时间顺序 (旧 -> 新) 返回轨迹 (N, L, 3) 与每行有效点数; 前 L - count 个点无效"""
+    store = state['particles']
+    trail_length = store.trail.shape[1]
+    slots = (state['trail_head'] + np.arange(trail_length)) % trail_length
+    if rows is None:
+        return store.trail[:, slots], store.trail_count.copy()
+    return store.trail[rows][:, slots], store.trail_count[rows]
+
+
+def set_trail_length(state, trail_length):
+    """修改轨迹长度: 重建环形缓冲并保留最近的点; 之后每步的开销与长度无关"""
+    trail_length = max(int(trail_length), 2)
+    store = state['particles']
+    trails, counts = ordered_trails(state)
+    kept = min(trail_length, trails.shape[1])
+    store.define_column('trail', np.float32, (trail_length, 3))
+    store.trail[:, :kept] = trails[:, trails.shape[1] - kept:]
+    store.trail_count = np.minimum(counts, kept)
+    state['trail_head'] = kept % trail_length
+    state['trail_length'] = trail_length
+
+
+# 初始条件依次抽取的随机数组: 类型, 重子种类, theta, phi, 半径, 动量大小, 动量方向;
+# 之后 create_stable_particles 为同样多的粒子抽取自旋
+_INITIAL_DRAWS = (
+    lambda rng, n: rng.random(n),
+    lambda rng, n: rng.integers(0, len(BARYONIC_TYPE_CODES), size=n),
+    lambda rng, n: rng.uniform(0, 2 * math.pi, n),
+    lambda rng, n: rng.uniform(0, math.pi, n),
+    lambda rng, n: rng.uniform(1.0, 5.0, n),
+    lambda rng, n: rng.uniform(0.02, 0.2, n),
+    lambda rng, n: rng.normal(0, 0.05, (n, 3)),
+)
+# initial_particle_chunks 每块的粒子数; 取 8 的倍数, 分块抽取的随机数与一次抽取完全相同
+INITIAL_CHUNK_SIZE = 1 << 16
+
+
+def _initial_columns(state, draws):
+    """由 _INITIAL_DRAWS 抽出的随机数组得到 (类型码, 位置, 动量)"""
+    particle_type_roll, baryonic_choice, theta, phi, radius, momentum_magnitude, direction = draws
+    dark_matter_limit = state['dark_matter_ratio']
+    dark_energy_limit = state['dark_matter_ratio'] + state['dark_energy_ratio']
+    type_codes = np.where(
+        particle_type_roll < dark_matter_limit, TYPE_CODES["DARK_MATTER"],
+        np.where(particle_type_roll < dark_energy_limit, TYPE_CODES["DARK_ENERGY"],
+                 BARYONIC_TYPE_CODES[baryonic_choice])).astype(np.int16)
+
+    positions = np.column_stack((
+        radius * np.sin(phi) * np.cos(theta),
+        radius * np.sin(phi) * np.sin(theta),
+        radius * np.cos(phi)
+    )).astype(np.float32)
+
+    momentum_magnitude = momentum_magnitude * state['initial_energy']
+    momenta = (direction * momentum_magnitude[:, np.newaxis]).astype(np.float32)
+    return type_codes, positions, momenta
+
+
+def initial_particle_chunks(state, chunk_size=INITIAL_CHUNK_SIZE):
+    """按 state['seed'] 逐块生成与 initialize_particles 相同的初始粒子 (编号, 类型码, 位置, 动量, 自旋)
+
+    每个随机数组各用一个定位到其起点的生成器副本, 按块同步抽取, 内存占用只与块大小有关;
+    子域分解的工作进程用它只保留本域拥有的粒子.
+    """
+    num_particles = state['num_particles']
+    rng = np.random.default_rng(state['seed'])
+    draws = _INITIAL_DRAWS + (lambda rng, n: rng.integers(0, len(SPIN_STATES), size=n, dtype=np.int8),)
+    cursors = []
+    for draw in draws:
+        cursors.append(np.random.Generator(type(rng.bit_generator)()))
+        cursors[-1].bit_generator.state = rng.bit_generator.state
+        for start in range(0, num_particles, chunk_size):
+            draw(rng, min(chunk_size, num_particles - start))
+    for start in range(0, num_particles, chunk_size):
+        count = min(chunk_size, num_particles - start)
+        values = [draw(cursor, count) for draw, cursor in zip(draws, cursors)]
+        type_codes, positions, momenta = _initial_columns(state, values[:-1])
+        yield np.arange(start, start + count), type_codes, positions, momenta, values[-1]
+
+
+def initialize_particles(state):
+    """按 state['seed'] 重新播种随机数生成器, 并批量生成初始粒子"""
+    num_particles = state['num_particles']
+    if state.get('seed') is None:
+        state['seed'] = new_seed()
+    rng = state['rng'] = np.random.default_rng(state['seed'])
+    type_codes, positions, momenta = _initial_columns(state, [draw(rng, num_particles) for draw in _INITIAL_DRAWS])
+
+    state['particles'] = new_particle_store(max(int(state['trail_length']), 2), capacity=max(num_particles, 64))
+    state['trail_head'] = 0
+    create_stable_particles(state, positions, momenta, type_codes, np.arange(num_particles))
+    state['particle_counter'] = num_particles
+    if state.get('stats') is not None:
+        # 换成了新的粒子存储, 统计量和历史从头开始
+        state['stats'].rebuild(state)
+
+
+def universe_tiles(state, universe_count):
+    """多宇宙集合中各宇宙在邻居索引里的平移量 (M, 3) 与索引盒子的半宽
+
+    各宇宙排成立方阵列, 间距大于引力截断和反应候选半径, 因此同一个邻居索引里
+    不会出现跨宇宙的粒子对; 物理量仍按各自的局部坐标计算.
+    """
+    side = max(1, int(math.ceil(universe_count ** (1 / 3) - 1e-9)))
+    reach = max(GRAVITY_MAX_DISTANCE, REACTION_TABLE.reach(state) + 2 * MAX_STEP_DISPLACEMENT)
+    spacing = 2 * state['max_position'] + reach + 1.0
+    index = np.arange(universe_count)
+    coords = np.stack((index // (side * side), (index // side) % side, index % side), axis=-1)
+    return (coords - (side - 1) / 2) * spacing, side * spacing / 2
+
+
+def remove_invalid_particles(state):
+    """删除位置, 动量或能量非有限以及离原点过远的粒子"""
+    store = state['particles']
+    valid = (np.all(np.isfinite(store.position), axis=1) &
+             np.all(np.isfinite(store.momentum), axis=1) &
+             np.isfinite(store.energy) &
+             (np.linalg.norm(store.position, axis=1) < 15.0))
+    remove_particles(state, ~valid)
+
+
+def neighbor_search_positions(state, positions=None):
+    """邻居索引和引力使用的坐标与索引盒子半宽; positions 默认为当前粒子位置
+
+    多宇宙集合 (带 universe 列) 中返回平移到各自网格块后的坐标, 物理量仍按局部坐标计算.
+    """
+    store = state['particles']
+    if positions is None:
+        positions = store.position
+    if 'universe' in store.column_names:
+        tile_offsets, half_width = universe_tiles(state, state['universe_count'])
+        return positions + tile_offsets[store.universe], half_width
+    return positions, state['max_position']
+
+
+def build_neighbor_index(state, positions=None, skin=0.0):
+    """每步建立一次邻居索引, 引力截断与反应候选对都从中读取; 返回 (索引, 建索引时的坐标)
+
+    skin 见 CellList; 网格边长随引力查询半径 GRAVITY_MAX_DISTANCE + skin 放大, 查询仍只跨 3 个网格.
+    """
+    index_positions, half_width = neighbor_search_positions(state, positions)
+    neighbor_index = CellList(
+        index_positions,
+        max((GRAVITY_MAX_DISTANCE + skin) / 3, REACTION_TABLE.reach(state) + 2 * MAX_STEP_DISPLACEMENT),
+        half_width, skin)
+    return neighbor_index, index_positions
+
+
+def gravity_forces(state, positions, masses, neighbor_index, targets=None):
+    """按所选求解器计算 positions 处各粒子 (或 targets 中的粒子) 受到的引力
+
+    direct 与 cell_list 使用所选计算后端的核函数; p3m 的近场部分与 cell_list 相同.
+    """
+    backend = get_backend(state['compute_backend'])
+    threads = resolve_threads(state['compute_threads'])
+    gravitational_constant = state['gravitational_constant']
+    if state['gravity_solver'] in MESH_SOLVERS:
+        return mesh_forces(state, positions, masses, targets) + near_field_forces(state, positions, masses,
+                                                                                  neighbor_index, targets)
+    if state['gravity_solver'] == 'barnes_hut':
+        return barnes_hut_gravity_forces(positions, masses, gravitational_constant, state['opening_angle'],
+                                         threads=threads, targets=targets)
+    if state['gravity_solver'] == 'cell_list':
+        return backend.cell_list_gravity(positions, masses, gravitational_constant, neighbor_index, threads, targets)
+    return backend.direct_gravity(positions, masses, gravitational_constant, threads, targets)
+
+
+def mesh_forces(state, positions, masses, targets=None):
+    """粒子网格部分的引力; 多宇宙集合中每个宇宙在自己的局部坐标里各用一张网格, 宇宙之间没有长程引力"""
+    store = state['particles']
+
+    def solve(rows):
+        return mesh_gravity_forces(positions[rows], masses[rows], state['gravitational_constant'],
+                                   state['max_position'], state['mesh_size'],
+                                   mesh_inner_distance(state['gravity_solver']))
+
+    if 'universe' not in store.column_names:
+        forces = solve(slice(None))
+    else:
+        tile_offsets, _ = universe_tiles(state, state['universe_count'])
+        positions = positions - tile_offsets[store.universe]
+        forces = np.zeros((len(positions), 3), dtype=np.float32)
+        for universe in np.unique(store.universe):
+            rows = np.flatnonzero(store.universe == universe)
+            forces[rows] = solve(rows)
+    return forces if targets is None else forces[targets]
+
+
+def near_field_forces(state, positions, masses, neighbor_index, targets=None):
+    """网格求解器中逐对求和的部分: p3m 为 r < 6.0 窗口内的引力, 纯粒子网格求解器为零"""
+    if state['gravity_solver'] != 'p3m':
+        return np.zeros((len(positions) if targets is None else len(targets), 3), dtype=np.float32)
+    return get_backend(state['compute_backend']).cell_list_gravity(
+        positions, masses, state['gravitational_constant'], neighbor_index, resolve_threads(state['compute_threads']),
+        targets)
+
+
+def compute_forces(state, neighbor_index, index_positions):
+    """按所选求解器计算引力, 再叠加暗能量斥力"""
+    store = state['particles']
+    gravitational_force = gravity_forces(state, index_positions, store.mass, neighbor_index)
+    add_dark_energy_repulsion(state, gravitational_force)
+    return gravitational_force
+
+
+def add_dark_energy_repulsion(state, gravitational_force):
+    """把暗能量粒子受到的斥力叠加到本地粒子的受力上"""
+    store = state['particles']
+    dark_energy = store.type_code == TYPE_CODES["DARK_ENERGY"]
+    if dark_energy.any():
+        gravitational_force[dark_energy] -= dark_energy_repulsion(store.position[dark_energy],
+                                                                  store.energy[dark_energy])
+
+
+def leapfrog_particles(state, dt):
+    """用蛙跳积分器推进 dt. 返回 (步末的邻居索引, 求力的粒子次数)
+
+    邻居索引带 LEAPFROG_INDEX_SKIN 余量, 在各小步间复用, 只有粒子移动超过余量的一半时才重建;
+    小步只查询要求力的粒子所在的网格, 开销因此随该小步的粒子数而不是总粒子数增长.
+    暗能量粒子质量为零, 与显式积分一样不因受力加速, 因此这里不计算暗能量斥力.
+    网格求解器的网格力作为长程力只在 dt 首尾求两次, 分级步长只用于近场逐对部分.
+    """
+    store = state['particles']
+    split = state['gravity_solver'] in MESH_SOLVERS
+    near_field = near_field_forces if split else gravity_forces
+    built = {}
+    max_shift_squared = (LEAPFROG_INDEX_SKIN / 2) ** 2
+
+    def evaluate_forces(positions, targets):
+        index_positions, _ = neighbor_search_positions(state, positions)
+        if not built or np.max(np.sum((index_positions - built['positions']) ** 2, axis=1),
+                               initial=0.0) > max_shift_squared:
+            # positions 在积分中原地更新, 索引需保留建立时的坐标副本
+            built['index'], built['positions'] = build_neighbor_index(state, positions.copy(), LEAPFROG_INDEX_SKIN)
+        neighbor_index = built['index']
+        return near_field(state, index_positions, store.mass, neighbor_index, targets), neighbor_index
+
+    def evaluate_long_range(positions):
+        return mesh_forces(state, neighbor_search_positions(state, positions)[0], store.mass)
+
+    return leapfrog_step(state, dt, evaluate_forces, STEP_DT, evaluate_long_range if split else None)
+
+
+def system_energy(state):
+    """动能与窗口引力势能之和, 以 STEP_DT 为时间单位; 用于检查蛙跳积分器的能量误差
+
+    动能按积分器的惯性约定 (m + 0.001) 只计有质量的粒子, 速度取 momentum / energy.
+    """
+    store = state['particles']
+    massive = store.mass > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity = np.nan_to_num(store.momentum[massive] / store.energy[massive, np.newaxis], nan=0.0)
+    kinetic = 0.5 * float(((store.mass[massive] + 0.001) * (velocity.astype(np.float64) ** 2).sum(axis=1)).sum())
+
+    neighbor_index, index_positions = build_neighbor_index(state)
+    pair_i, pair_j = get_backend(state['compute_backend']).pairs_within(
+        neighbor_index.subset(massive), GRAVITY_MAX_DISTANCE, index_positions,
+        threads=resolve_threads(state['compute_threads']))
+    distances = np.linalg.norm(index_positions[pair_j].astype(np.float64) - index_positions[pair_i], axis=1)
+    potential = pair_potential(distances, store.mass[pair_i], store.mass[pair_j], state['gravitational_constant'])
+    return kinetic + float(potential.sum()) * STEP_DT ** 2
+
+
+def integrate_particles(state, gravitational_force, dt):
+    """由动量和受力更新位置 (含宇宙膨胀与逐步位移限制)"""
+    store = state['particles']
+    store.position = get_backend(state['compute_backend']).integrate(
+        store.position, store.momentum, store.mass, store.energy, gravitational_force,
+        state['expansion_rate'], dt, state['max_position'])
+
+
+def reaction_pass(state, neighbor_index):
+    """在移动后的位置上查找反应距离内的粒子对, 按 REACTION_TABLE 的规则与概率反应; 返回搜索半径内的粒子对数
+
+    候选对的规则编号, 接受判定和产物都按类型码整体查表, 增加反应规则不增加逐对的 Python 开销.
+    """
+    store = state['particles']
+    ensemble = 'universe' in store.column_names
+    backend = get_backend(state['compute_backend'])
+
+    # 候选对按 (i, j) 排序; 每步为全部候选对一次性抽取 (接受, 产物选择) 两列随机数
+    index_positions, _ = neighbor_search_positions(state)
+    pair_i, pair_j = backend.pairs_within(
+        neighbor_index, REACTION_TABLE.reach(state), index_positions, skin=2 * MAX_STEP_DISPLACEMENT,
+        threads=resolve_threads(state['compute_threads']))
+    rolls = state['rng'].random((len(pair_i), 2))
+    rules = REACTION_TABLE.rule_of[store.type_code[pair_i], store.type_code[pair_j]]
+
+    def pair_distances(rows):
+        return np.linalg.norm(index_positions[pair_j[rows]].astype(np.float64) - index_positions[pair_i[rows]], axis=1)
+
+    accepted = np.flatnonzero(REACTION_TABLE.accept(state, rules, rolls[:, 0], pair_distances))
+
+    # 按顺序贪心匹配: 已参与反应的粒子不再参与后面的候选对
+    chosen = backend.match_pairs(pair_i, pair_j, accepted, len(store))
+    if not len(chosen):
+        return len(pair_i)
+    i, j = pair_i[chosen], pair_j[chosen]
+
+    new_types, event_codes = REACTION_TABLE.products(rules[chosen], rolls[chosen, 1])
+    new_momenta = (store.momentum[i] + store.momentum[j]) * 0.5
+    new_positions = (store.position[i] + store.position[j]) * 0.5
+    extra_columns = {'universe': store.universe[i]} if ensemble else {}
+
+    first_event = state['event_counter']
+    first_id = state['particle_counter']
+    state['event_counter'] += len(chosen)
+    state['particle_counter'] += len(chosen)
+    new_ids = np.arange(first_id, state['particle_counter'])
+    state['interaction_events'].extend(
+        np.arange(first_event, state['event_counter']), event_codes,
+        np.full(len(chosen), state['time']), new_positions, store.energy[i] + store.energy[j],
+        np.column_stack((store.particle_id[i], store.particle_id[j])), new_ids)
+    if ensemble:
+        np.add.at(state['universe_event_counts'], (extra_columns['universe'], event_codes), 1)
+
+    remove_mask = np.zeros(len(store), dtype=bool)
+    remove_mask[i] = True
+    remove_mask[j] = True
+    remove_particles(state, remove_mask)
+    create_stable_particles(state, new_positions, new_momenta, new_types, new_ids, state['time'],
+                            **extra_columns)
+
+    return len(pair_i)
+
+
+def advance_cosmic_time(state, dt):
+    state['time'] += dt
+    state['scale_factor'] *= (1 + state['expansion_rate'] * dt * 0.001)
+
+
+def physics_step(state, dt=STEP_DT):
+    """推进一个物理子步: 有效性过滤, 引力, 积分, 轨迹记录与粒子反应
+
+    state['profiler'] (PhaseProfiler) 存在时记录各阶段耗时与计数器, 每个子步一行;
+    state['stats'] (cosmic_stats.CosmicStats) 存在时随粒子增删更新累计统计量, 并在步末写入历史.
+    """
+    profiler = state.get('profiler')
+    if profiler is None:
+        profiler = NULL_PROFILER
+    events_before = state['event_counter']
+    if state['integrator'] not in INTEGRATORS:
+        raise IntegratorError(f"未知的积分器: {state['integrator']}")
+    with profiler.phase('filter'):
+        remove_invalid_particles(state)
+    if state['integrator'] == 'leapfrog':
+        # 位移不再受每步 0.1 的限制, 反应使用步末重建的邻居索引; 求力包含在 integration 阶段中
+        with profiler.phase('integration'):
+            neighbor_index, force_evaluations = leapfrog_particles(state, dt)
+            if state.get('stats') is not None:
+                state['stats'].set_momentum(state['particles'].momentum)
+        if neighbor_index is None:
+            neighbor_index, _ = build_neighbor_index(state)
+    else:
+        with profiler.phase('neighbor_index'):
+            neighbor_index, index_positions = build_neighbor_index(state)
+        with profiler.phase('gravity'):
+            gravitational_force = compute_forces(state, neighbor_index, index_positions)
+        with profiler.phase('integration'):
+            integrate_particles(state, gravitational_force, dt)
+        force_evaluations = len(state['particles'])
+        if 'has_force' in state['particles'].column_names:
+            # 切回蛙跳积分器时缓存的加速度已过时
+            state['particles'].has_force = False
+    with profiler.phase('trails'):
+        record_trails(state)
+    with profiler.phase('fusion'):
+        pairs_in_range = reaction_pass(state, neighbor_index)
+    advance_cosmic_time(state, dt)
+
+    profiler.count('particles', len(state['particles']))
+    profiler.count('pairs_tested', neighbor_index.stats['pairs_tested'])
+    profiler.count('pairs_in_range', pairs_in_range)
+    profiler.count('events_fired', state['event_counter'] - events_before)
+    profiler.count('force_evaluations', force_evaluations)
+    profiler.end_step()
+    if state.get('stats') is not None:
+        state['stats'].end_step(state)
+
+
+def cosmic_age_gyr(state):
+    """模拟时间换算为十亿年"""
+    return state['time'] / 3.154e7 / 1e9
+
+
+def build_cosmos_config(state, **extra):
+    """由当前状态生成 .cosmos 配置字典, extra 用于附加界面相关的字段"""
+    config = {key: state[key] for key in COSMOS_STATE_KEYS}
+    config.update(extra)
+    config.update({
+        'timestamp': datetime.now().isoformat(),
+        'simulator_type': COSMOS_SIMULATOR_TYPE,
+        'version': COSMOS_VERSION,
+        'description': '宇宙演化模拟器配置文件',
+        'universe_model': 'Standard Cosmological Model'
+    })
+    return config
+
+
+def save_cosmos_config(file_path, config):
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+
+
+def load_cosmos_config(file_path):
+    """读取 .cosmos 文件; JSON 格式错误时抛出 json.JSONDecodeError, 文件类型不符时抛出 CosmosConfigError"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if not isinstance(config, dict) or config.get('simulator_type') != COSMOS_SIMULATOR_TYPE:
+        raise CosmosConfigError("这不是有效的宇宙模拟器配置文件")
+    return config
+
+
+def apply_cosmos_config(state, config):
+    """把配置中的物理参数写入状态, 缺失的键保持默认值"""
+    for key in COSMOS_STATE_KEYS:
+        if key in config:
+            state[key] = config[key]
+    return state
+
+
+class Universe:
+    """无界面的模拟引擎: Universe(config).step(n)
+
+    config 为 .cosmos 配置字典 (或 None 使用默认参数). 不依赖 Qt, 可在无显示的
+    计算节点上运行; 图形界面驱动的也是同一套 physics_step.
+    """
+
+    def __init__(self, config=None):
+        self.state = initialize_simulator_state()
+        if config:
+            apply_cosmos_config(self.state, config)
+        initialize_particles(self.state)
+
+    @classmethod
+    def from_file(cls, file_path):
+        return cls(load_cosmos_config(file_path))
+
+    @property
+    def particles(self):
+        return self.state['particles']
+
+    def step(self, n=1, dt=STEP_DT):
+        for _ in range(n):
+            physics_step(self.state, dt)
+        return self
+
+    def summary(self):
+        """当前状态的摘要: 时间, 尺度因子, 各类粒子数与各类事件数"""
+        store = self.state['particles']
+        type_counts = np.bincount(store.type_code, minlength=len(PARTICLE_TYPES))
+        events = self.state['interaction_events']
+        return {
+            'time': self.state['time'],
+            'cosmic_age_gyr': cosmic_age_gyr(self.state),
+            'scale_factor': self.state['scale_factor'],
+            'particle_count': len(store),
+            'particle_counts': {p_type: int(count) for p_type, count in zip(PARTICLE_TYPES, type_counts) if count},
+            'event_count': len(events),
+            'event_counts': events.type_counts(),
+        }
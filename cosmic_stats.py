@@ -0,0 +1,175 @@
+import csv
+import threading
+
+import numpy as np
+
+from cosmic_engine import PARTICLE_TYPES, cosmic_age_gyr
+from event_log import EVENT_TYPES
+
+
+# 历史缓冲的样本数上限 (取偶数); 填满后相邻两个样本合并为一个, 采样间隔加倍
+DEFAULT_HISTORY_CAPACITY = 2048
+
+
+class CosmicStats:
+    """宇宙演化的累计统计量与降采样历史
+
+    各类粒子数, 总能量, 总动量和总质量由每步的增减量维护: physics_step 通过 state['stats']
+    在粒子创建和删除时调用 add_rows / remove_rows, 不再每帧重新扫描全部粒子.
+    end_step 每步调用一次, 在 stride 的整数倍步写入一个历史样本; 样本数达到 capacity 时只保留
+    步数为 2 * stride 整数倍的样本, 被丢弃样本的区间事件数并入下一个样本, 再把 stride 加倍,
+    因此任意长的运行内存占用不变, 采样间隔始终均匀.
+    在物理线程中写入, 可以在界面线程中读取 totals / series.
+    """
+
+    def __init__(self, capacity=DEFAULT_HISTORY_CAPACITY):
+        self.capacity = max(int(capacity) // 2 * 2, 2)
+        self._lock = threading.Lock()
+        self._type_counts = np.zeros(len(PARTICLE_TYPES), dtype=np.int64)
+        self._energy = 0.0
+        self._mass = 0.0
+        self._momentum = np.zeros(3, dtype=np.float64)
+        self._event_totals = np.zeros(len(EVENT_TYPES), dtype=np.int64)
+        self._history = {
+            'step': np.zeros(self.capacity, dtype=np.int64),
+            'time': np.zeros(self.capacity, dtype=np.float64),
+            'cosmic_age': np.zeros(self.capacity, dtype=np.float64),
+            'scale_factor': np.zeros(self.capacity, dtype=np.float64),
+            'total_energy': np.zeros(self.capacity, dtype=np.float64),
+            'mean_mass': np.zeros(self.capacity, dtype=np.float64),
+            'momentum': np.zeros((self.capacity, 3), dtype=np.float64),
+            'particle_counts': np.zeros((self.capacity, len(PARTICLE_TYPES)), dtype=np.int64),
+            'interval_events': np.zeros((self.capacity, len(EVENT_TYPES)), dtype=np.int64),
+        }
+        self._fill = 0
+        self.stride = 1
+        self._steps = 0
+        self._pending_events = np.zeros(len(EVENT_TYPES), dtype=np.int64)
+
+    # ---- 由物理线程调用 ----
+
+    def rebuild(self, state):
+        """从当前状态完整扫描一次, 并清空历史; 在挂接到新状态 (重置, 读回检查点) 时调用"""
+        store = state['particles']
+        with self._lock:
+            self._type_counts[:] = np.bincount(store.type_code, minlength=len(PARTICLE_TYPES))
+            self._energy = float(store.energy.sum())
+            self._mass = float(store.mass.sum())
+            self._momentum[:] = store.momentum.sum(axis=0, dtype=np.float64)
+            self._event_totals[:] = self._event_counts(state)
+            self._fill = 0
+            self.stride = 1
+            self._steps = 0
+            self._pending_events[:] = 0
+        self._record(state)
+
+    def add_rows(self, store, rows):
+        """把 store 中 rows 行 (新创建的粒子) 计入累计量"""
+        self._account(store, rows, 1)
+
+    def remove_rows(self, store, rows):
+        """把即将删除的 rows 行 (下标或布尔掩码) 从累计量中扣除"""
+        self._account(store, rows, -1)
+
+    def _account(self, store, rows, sign):
+        with self._lock:
+            self._type_counts += sign * np.bincount(store.type_code[rows], minlength=len(PARTICLE_TYPES))
+            self._energy += sign * float(store.energy[rows].sum())
+            self._mass += sign * float(store.mass[rows].sum())
+            self._momentum += sign * store.momentum[rows].sum(axis=0, dtype=np.float64)
+            if not self._type_counts.any():
+                # 粒子全部删除后去掉增减累积的舍入误差
+                self._energy = self._mass = 0.0
+                self._momentum[:] = 0.0
+
+    def set_momentum(self, momenta):
+        """积分器改写了全部粒子的动量时, 随积分的这一遍重新累加总动量"""
+        with self._lock:
+            self._momentum[:] = np.asarray(momenta).sum(axis=0, dtype=np.float64)
+
+    def end_step(self, state):
+        """结束一个物理子步: 累加本步新增的事件, 步数是 stride 的整数倍时写入一个历史样本"""
+        counts = self._event_counts(state)
+        with self._lock:
+            self._pending_events += counts - self._event_totals
+            self._event_totals[:] = counts
+        self._steps += 1
+        if self._steps % self.stride == 0:
+            self._record(state)
+
+    @staticmethod
+    def _event_counts(state):
+        counts = state['interaction_events'].type_counts()
+        return np.array([counts.get(name, 0) for name in EVENT_TYPES], dtype=np.int64)
+
+    def _record(self, state):
+        with self._lock:
+            if self._fill == self.capacity:
+                self._downsample()
+            slot = self._fill
+            history = self._history
+            history['step'][slot] = self._steps
+            history['time'][slot] = state['time']
+            history['cosmic_age'][slot] = cosmic_age_gyr(state)
+            history['scale_factor'][slot] = state['scale_factor']
+            history['total_energy'][slot] = self._energy
+            history['mean_mass'][slot] = self._mean_mass()
+            history['momentum'][slot] = self._momentum
+            history['particle_counts'][slot] = self._type_counts
+            history['interval_events'][slot] = self._pending_events
+            self._fill += 1
+            self._pending_events[:] = 0
+
+    def _downsample(self):
+        # 保留偶数下标的样本 (步数为 2 * stride 的整数倍), 奇数下标样本的区间事件数并入其后的样本;
+        # 最后一个样本之后的样本即将写入, 它的事件数并入待写入的区间
+        half = self.capacity // 2
+        events = self._history['interval_events']
+        self._pending_events += events[-1]
+        events[2::2] += events[1:-1:2]
+        for column in self._history.values():
+            column[:half] = column[0::2]
+        self._fill = half
+        self.stride *= 2
+
+    def _mean_mass(self):
+        count = int(self._type_counts.sum())
+        return self._mass / count if count else 0.0
+
+    # ---- 可在其他线程中调用 ----
+
+    def __len__(self):
+        return self._fill
+
+    def totals(self):
+        """当前的累计量: 各类粒子数, 总能量, 总动量, 平均质量与各类事件总数"""
+        with self._lock:
+            return {
+                'particle_count': int(self._type_counts.sum()),
+                'particle_counts': {p_type: int(count) for p_type, count in zip(PARTICLE_TYPES, self._type_counts)
+                                    if count},
+                'total_energy': self._energy,
+                'total_momentum': self._momentum.tolist(),
+                'momentum_magnitude': float(np.linalg.norm(self._momentum)),
+                'mean_mass': self._mean_mass(),
+                'event_counts': {name: int(count) for name, count in zip(EVENT_TYPES, self._event_totals) if count},
+            }
+
+    def series(self):
+        """按时间顺序返回历史样本的拷贝 {列名: 数组}; particle_counts 与 interval_events 按类型分列"""
+        with self._lock:
+            return {name: column[:self._fill].copy() for name, column in self._history.items()}
+
+
+def export_history(file_path, stats):
+    """把历史样本写成 CSV: 每行一个样本, 粒子数和区间事件数按类型各占一列"""
+    series = stats.series()
+    columns = ['step', 'time', 'cosmic_age', 'scale_factor', 'total_energy', 'mean_mass']
+    header = (columns + ['momentum_x', 'momentum_y', 'momentum_z'] +
+              [f'count_{p_type}' for p_type in PARTICLE_TYPES] + [f'events_{name}' for name in EVENT_TYPES])
+    with open(file_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in range(len(series['step'])):
+            writer.writerow([series[name][row] for name in columns] + series['momentum'][row].tolist() +
+                            series['particle_counts'][row].tolist() + series['interval_events'][row].tolist())
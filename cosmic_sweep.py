@@ -0,0 +1,184 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cosmic_batch import run_batch
+from cosmic_engine import COSMOS_STATE_KEYS, PARTICLE_TYPES, load_cosmos_config
+from event_log import EVENT_TYPES
+
+
+SUMMARY_COLUMNS = ['time', 'cosmic_age_gyr', 'scale_factor', 'particle_count', 'event_count',
+                   'steps', 'wall_time', 'steps_per_second']
+
+
+class SweepError(ValueError):
+    """扫描参数不合法"""
+
+
+def _parse_value(text):
+    # 网格取值按 JSON 解析 (数字, true/false, 字符串), 解析失败时当作字符串
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def parse_grid(specs):
+    """把 ['fusion_probability=0.1,0.2', ...] 解析为 {参数名: [取值, ...]}"""
+    grid = {}
+    for spec in specs:
+        name, sep, values = spec.partition('=')
+        if not sep or not values:
+            raise SweepError(f"网格参数格式应为 名称=值1,值2,...: {spec}")
+        grid[name.strip()] = [_parse_value(value.strip()) for value in values.split(',')]
+    return grid
+
+
+def expand_grid(grid):
+    """参数网格的笛卡尔积, 按参数名的给出顺序展开"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def validate_points(points):
+    for point in points:
+        if not isinstance(point, dict):
+            raise SweepError("每个参数点必须是 {参数名: 取值} 字典")
+        unknown = set(point) - set(COSMOS_STATE_KEYS)
+        if unknown:
+            raise SweepError(f"未知的参数: {', '.join(sorted(unknown))}")
+
+
+def point_key(params):
+    """参数点的规范化键, 用于断点续跑时识别已完成的点"""
+    return json.dumps(params, sort_keys=True)
+
+
+def point_config(base_config, params):
+    """由基础配置和参数点生成单次运行的配置; 未指定种子时由参数点确定性地派生
+
+    并行已经在进程之间展开, 未指定 compute_threads 时每个进程只用一个计算线程.
+    """
+    config = dict(base_config)
+    config.update(params)
+    if config.get('seed') is None:
+        config['seed'] = zlib.crc32(point_key(params).encode('utf-8'))
+    config.setdefault('compute_threads', 1)
+    return config
+
+
+def result_columns(param_names):
+    return (['point'] + list(param_names) + ['seed'] + SUMMARY_COLUMNS +
+            [f'count_{p_type}' for p_type in PARTICLE_TYPES] +
+            [f'events_{event_type}' for event_type in EVENT_TYPES])
+
+
+def run_point(config, steps):
+    """在工作进程中运行一个参数点, 返回结果表中的一行 (不含参数列)"""
+    _, result = run_batch(config, steps)
+    row = {name: result[name] for name in SUMMARY_COLUMNS}
+    row['seed'] = config['seed']
+    for p_type in PARTICLE_TYPES:
+        row[f'count_{p_type}'] = result['particle_counts'].get(p_type, 0)
+    for event_type in EVENT_TYPES:
+        row[f'events_{event_type}'] = result['event_counts'].get(event_type, 0)
+    return row
+
+
+def completed_points(results_path):
+    """读取已有结果表中完成的参数点键"""
+    if not os.path.exists(results_path):
+        return set()
+    with open(results_path, newline='', encoding='utf-8') as f:
+        return {row['point'] for row in csv.DictReader(f)}
+
+
+def run_sweep(base_config, points, steps, results_path, workers=None, log=None):
+    """在进程池中运行全部参数点, 每完成一个点立即追加到 CSV 结果表
+
+    结果表中已有的点会被跳过, 因此中断后用相同参数再次运行即可从断点继续.
+    某个点在工作进程中出错时记入日志并继续其它点, 出错的点不写入结果表, 再次运行时会重试.
+    返回 (本次新完成的点数, 出错的点数).
+    """
+    validate_points(points)
+    param_names = list(dict.fromkeys(name for point in points for name in point if name != 'seed'))
+    columns = result_columns(param_names)
+
+    done = completed_points(results_path)
+    pending = [point for point in points if point_key(point) not in done]
+    if log is not None:
+        log.write(f"共 {len(points)} 个参数点, 已完成 {len(points) - len(pending)}, 待运行 {len(pending)}\n")
+    if not pending:
+        return 0, 0
+
+    if os.path.exists(results_path):
+        with open(results_path, newline='', encoding='utf-8') as f:
+            existing = next(csv.reader(f), None)
+        if existing is not None and existing != columns:
+            raise SweepError("已有结果表的列与本次扫描不一致, 请换一个输出文件")
+    write_header = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+
+    finished = failed = 0
+    with open(results_path, 'a', newline='', encoding='utf-8') as f, \
+            ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        if write_header:
+            writer.writeheader()
+            f.flush()
+        futures = {pool.submit(run_point, point_config(base_config, point), steps): point for point in pending}
+        for future in as_completed(futures):
+            point = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                failed += 1
+                if log is not None:
+                    log.write(f"参数点 {point_key(point)} 运行失败: {type(e).__name__}: {e}\n")
+                continue
+            row.update(point)
+            row['point'] = point_key(point)
+            writer.writerow(row)
+            f.flush()
+            finished += 1
+            if log is not None:
+                log.write(f"[{finished}/{len(pending)}] {row['point']}: {row['particle_count']} 粒子, "
+                          f"{row['event_count']} 相互作用, {row['wall_time']:.1f}s\n")
+    if failed and log is not None:
+        log.write(f"{failed} 个参数点运行失败, 用相同参数再次运行可重试\n")
+    return finished, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在多进程中批量扫描 .cosmos 参数")
+    parser.add_argument('config', help="基础 .cosmos 配置文件")
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help="参数网格, 可重复给出, 取笛卡尔积")
+    parser.add_argument('--samples', help="JSON 文件, 内容为参数点字典的列表, 与 --grid 二选一")
+    parser.add_argument('--steps', type=int, default=1000, help="每个参数点的物理子步数")
+    parser.add_argument('--workers', type=int, default=None, help="进程数, 默认使用全部核心")
+    parser.add_argument('--output', default='sweep_results.csv', help="CSV 结果表, 已存在时断点续跑")
+    args = parser.parse_args(argv)
+
+    if bool(args.grid) == bool(args.samples):
+        parser.error("需要且只能给出 --grid 或 --samples 之一")
+    try:
+        if args.samples:
+            with open(args.samples, 'r', encoding='utf-8') as f:
+                points = json.load(f)
+        else:
+            points = expand_grid(parse_grid(args.grid))
+        _, failed = run_sweep(load_cosmos_config(args.config), points, args.steps, args.output,
+                              workers=args.workers, log=sys.stderr)
+    except SweepError as e:
+        parser.error(str(e))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
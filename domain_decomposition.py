@@ -0,0 +1,472 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+import numpy as np
+
+from backends import BACKEND_NAMES, get_backend, resolve_backend_name
+from cosmic_engine import (MAX_STEP_DISPLACEMENT, PARTICLE_TYPES, REACTION_TABLE, STEP_DT, add_dark_energy_repulsion,
+                           advance_cosmic_time, apply_cosmos_config, cosmic_age_gyr, create_stable_particles,
+                           SPIN_STATES, gravity_forces, initial_particle_chunks, initialize_simulator_state,
+                           integrate_particles, load_cosmos_config, new_particle_store, new_seed, record_trails,
+                           remove_invalid_particles, remove_particles)
+from event_log import EVENT_TYPES
+from gravity import GRAVITY_MAX_DISTANCE
+from integrators import IntegratorError
+from parallel import resolve_threads
+from particle_mesh import MESH_SOLVERS
+from particle_store import PARTICLE_COLUMNS
+from spatial_index import CellList
+
+
+# 交换给相邻子域的反应候选粒子字段
+REACTION_HALO_FIELDS = ('particle_id', 'position', 'momentum', 'energy', 'mass', 'type_code')
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+class DomainError(RuntimeError):
+    """子域工作进程出错或意外退出"""
+
+
+def domain_shape(count):
+    """把子域个数分解为尽量接近立方的 (nx, ny, nz)"""
+    count = max(int(count), 1)
+    best = (count, 1, 1)
+    for nx in range(1, count + 1):
+        if count % nx:
+            continue
+        for ny in range(1, count // nx + 1):
+            if (count // nx) % ny:
+                continue
+            shape = tuple(sorted((nx, ny, count // nx // ny), reverse=True))
+            if max(shape) - min(shape) < max(best) - min(best):
+                best = shape
+    return best
+
+
+def _mix(x):
+    # splitmix64 的混合函数; uint64 数组运算按 2^64 取模
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def pair_rolls(seed, step, id_lo, id_hi, streams=2):
+    """由 (种子, 子步序号, 粒子对编号) 唯一确定的 [0, 1) 均匀随机数 (N, streams)
+
+    与粒子所在的子域和行号无关, 因此同一个粒子对无论由哪个子域处理都得到相同的随机数.
+    """
+    with np.errstate(over='ignore'):
+        key = np.full(len(id_lo), np.uint64(seed) ^ (np.uint64(step) * _GOLDEN), dtype=np.uint64)
+        key = _mix(_mix(_mix(key) + np.asarray(id_lo).astype(np.uint64)) + np.asarray(id_hi).astype(np.uint64))
+        bits = np.stack([_mix(key + np.uint64(stream + 1) * _GOLDEN) for stream in range(streams)], axis=-1)
+    return (bits >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+class DomainGrid:
+    """把 [-max_position, max_position]^3 均匀切成 shape 个长方体子域, 子域按 C 顺序编号"""
+
+    def __init__(self, shape, max_position):
+        self.shape = tuple(int(n) for n in shape)
+        self.max_position = float(max_position)
+        self.widths = 2 * self.max_position / np.array(self.shape, dtype=np.float64)
+        self.count = int(np.prod(self.shape))
+
+    def owner(self, positions):
+        """各粒子所在的子域; 盒子外的粒子归入边界子域"""
+        positions = np.nan_to_num(np.asarray(positions, dtype=np.float64))
+        coords = np.floor((positions + self.max_position) / self.widths).astype(np.int64)
+        coords = np.clip(coords, 0, np.array(self.shape) - 1)
+        return np.ravel_multi_index(tuple(coords.T), self.shape)
+
+    def bounds(self, domain):
+        low = -self.max_position + np.array(np.unravel_index(domain, self.shape)) * self.widths
+        return low, low + self.widths
+
+    def distance_to(self, positions, domain):
+        """各粒子到子域长方体的最近距离, 在子域内为 0"""
+        low, high = self.bounds(domain)
+        positions = np.asarray(positions, dtype=np.float64)
+        gap = np.maximum(np.maximum(low - positions, positions - high), 0.0)
+        return np.sqrt((gap ** 2).sum(axis=1))
+
+
+class DomainWorker:
+    """在工作进程中推进一个子域: 拥有子域内的粒子, 并接收相邻子域的晕区 (halo) 粒子
+
+    每个子步分三次与协调进程交换数据:
+    1. gravity_exports: 把离开本域的粒子迁移给新的拥有者, 把距其他子域不足引力截断的粒子作为晕区发出;
+    2. gravity_step: 在本地粒子 + 晕区粒子上计算引力, 只积分本地粒子, 再发出反应候选的晕区;
+    3. reaction_candidates / apply_reactions: 找出跨边界的候选对交给协调进程统一匹配, 再执行选中的反应.
+    """
+
+    def __init__(self, config, grid, domain):
+        self.grid = grid
+        self.domain = domain
+        self.step_index = 0
+        state = self.state = initialize_simulator_state()
+        apply_cosmos_config(state, config)
+        # 各进程用同一个种子逐块生成完整的初始条件, 只保留本域的粒子: 与单进程运行的初始条件相同,
+        # 而每个进程的内存只与本域粒子数有关
+        state['particles'] = new_particle_store(max(int(state['trail_length']), 2))
+        state['trail_head'] = 0
+        for ids, type_codes, positions, momenta, spin in initial_particle_chunks(state):
+            owned = grid.owner(positions) == domain
+            create_stable_particles(state, positions[owned], momenta[owned], type_codes[owned], ids[owned],
+                                    spin=spin[owned])
+        state['particle_counter'] = state['num_particles']
+        self._pending = None
+        self._departed = None
+
+    def neighbor_cell_size(self):
+        return max(GRAVITY_MAX_DISTANCE / 3, REACTION_TABLE.reach(self.state) + 2 * MAX_STEP_DISPLACEMENT)
+
+    def gravity_exports(self):
+        """返回发往每个子域的 (迁移粒子的全部列, 晕区编号, 晕区位置, 晕区质量); 本域及无内容的子域为 None"""
+        state = self.state
+        remove_invalid_particles(state)
+        store = state['particles']
+        owner = self.grid.owner(store.position)
+        exports = [None] * self.grid.count
+        for domain in range(self.grid.count):
+            if domain == self.domain:
+                continue
+            migrants = owner == domain
+            halo = ~migrants & (self.grid.distance_to(store.position, domain) < GRAVITY_MAX_DISTANCE)
+            if migrants.any() or halo.any():
+                exports[domain] = ({name: getattr(store, name)[migrants] for name in store.column_names},
+                                   store.particle_id[halo], store.position[halo], store.mass[halo])
+        # 迁出的粒子仍是本域粒子附近的引力源, 在本子域中作为晕区保留到本步求力之后
+        leaving = owner != self.domain
+        self._departed = (store.particle_id[leaving], store.position[leaving], store.mass[leaving])
+        remove_particles(state, leaving)
+        return exports
+
+    def gravity_step(self, imports, dt):
+        """接收迁入粒子与引力晕区, 计算受力并积分本地粒子; 返回发往每个子域的反应晕区"""
+        state = self.state
+        store = state['particles']
+        ghost_ids, ghost_positions, ghost_masses = [[column] for column in self._departed]
+        self._departed = None
+        for migrants, ids, positions, masses in imports:
+            if len(migrants['mass']):
+                store.extend(**migrants)
+            ghost_ids.append(ids)
+            ghost_positions.append(positions)
+            ghost_masses.append(masses)
+
+        # 本地与晕区粒子按编号排序后求力: 每个粒子受力的求和顺序与本域的行顺序和子域划分无关.
+        # 欧拉积分把很小的加速度放大到位移上限, 求和顺序造成的舍入差异会改变位移的方向
+        local_count = len(store)
+        order = np.argsort(np.concatenate([store.particle_id] + ghost_ids), kind='stable')
+        positions = np.concatenate([store.position] + ghost_positions)[order]
+        masses = np.concatenate([store.mass] + ghost_masses)[order]
+        neighbor_index = CellList(positions, self.neighbor_cell_size(), state['max_position'])
+        # 晕区粒子只施力, 它们受到的力由各自的子域计算, 因此只对本地粒子求力
+        targets = np.flatnonzero(order < local_count)
+        gravitational_force = np.empty((local_count, 3), dtype=np.float32)
+        gravitational_force[order[targets]] = gravity_forces(state, positions, masses, neighbor_index, targets)
+        add_dark_energy_repulsion(state, gravitational_force)
+        integrate_particles(state, gravitational_force, dt)
+        record_trails(state)
+
+        # 积分后本地粒子最多离开子域 MAX_STEP_DISPLACEMENT, 晕区相应加宽
+        # 只交换当前接受概率大于 0 的规则涉及的粒子
+        reach = REACTION_TABLE.reach(state) + MAX_STEP_DISPLACEMENT
+        reactive = np.flatnonzero(REACTION_TABLE.active_types(state)[store.type_code])
+        exports = [None] * self.grid.count
+        for domain in range(self.grid.count):
+            if domain == self.domain:
+                continue
+            rows = reactive[self.grid.distance_to(store.position[reactive], domain) <= reach]
+            if len(rows):
+                exports[domain] = {name: getattr(store, name)[rows] for name in REACTION_HALO_FIELDS}
+        return exports
+
+    def reaction_candidates(self, imports):
+        """按概率接受的候选对 (id_lo, id_hi)
+
+        两端都在本域的粒子对由本域上报; 跨边界的粒子对由编号较小的一端所在的子域上报,
+        因此每个粒子对恰好上报一次.
+        """
+        state = self.state
+        store = state['particles']
+        reactive = np.flatnonzero(REACTION_TABLE.active_types(state)[store.type_code])
+        fields = {name: np.concatenate([getattr(store, name)[reactive]] + [ghosts[name] for ghosts in imports])
+                  for name in REACTION_HALO_FIELDS}
+        local_count = len(reactive)
+
+        neighbor_index = CellList(fields['position'], self.neighbor_cell_size(), state['max_position'])
+        positions = fields['position']
+        a, b = get_backend(state['compute_backend']).pairs_within(
+            neighbor_index, REACTION_TABLE.reach(state), positions, threads=resolve_threads(state['compute_threads']))
+        ids = fields['particle_id']
+        # a < b, 晕区粒子排在本地粒子之后, 所以 a 为晕区时 b 也是晕区
+        reported = (a < local_count) & ((b < local_count) | (ids[a] < ids[b]))
+        a, b = a[reported], b[reported]
+        id_lo, id_hi = np.minimum(ids[a], ids[b]), np.maximum(ids[a], ids[b])
+        # 三列随机数: 接受, 产物选择, 产物自旋
+        rolls = pair_rolls(state['seed'], self.step_index, id_lo, id_hi, streams=3)
+        rules = REACTION_TABLE.rule_of[fields['type_code'][a], fields['type_code'][b]]
+
+        def pair_distances(rows):
+            return np.linalg.norm(positions[b[rows]].astype(np.float64) - positions[a[rows]], axis=1)
+
+        accepted = REACTION_TABLE.accept(state, rules, rolls[:, 0], pair_distances)
+
+        self._pending = (fields, a[accepted], b[accepted], rules[accepted], rolls[accepted, 1:])
+        return id_lo[accepted], id_hi[accepted]
+
+    def apply_reactions(self, selected, new_ids, event_ids, consumed_ids, dt):
+        """执行协调进程选中的本域上报的反应, 删除参与了 (任一子域的) 反应的本地粒子; 返回本地粒子数"""
+        state = self.state
+        fields, a, b, rules, product_rolls = self._pending
+        self._pending = None
+        a, b = a[selected], b[selected]
+        if len(selected):
+            new_types, event_codes = REACTION_TABLE.products(rules[selected], product_rolls[selected, 0])
+            # 自旋同样由粒子对编号决定, 与子域划分无关
+            new_spin = (product_rolls[selected, 1] * len(SPIN_STATES)).astype(np.int8)
+            new_positions = (fields['position'][a] + fields['position'][b]) * 0.5
+            new_momenta = (fields['momentum'][a] + fields['momentum'][b]) * 0.5
+            ids = fields['particle_id']
+            state['interaction_events'].extend(
+                event_ids, event_codes, np.full(len(selected), state['time']), new_positions,
+                fields['energy'][a] + fields['energy'][b],
+                np.column_stack((np.minimum(ids[a], ids[b]), np.maximum(ids[a], ids[b]))), new_ids)
+        if len(consumed_ids):
+            remove_particles(state, np.isin(state['particles'].particle_id, consumed_ids))
+        if len(selected):
+            create_stable_particles(state, new_positions, new_momenta, new_types, new_ids, state['time'],
+                                    spin=new_spin)
+        advance_cosmic_time(state, dt)
+        self.step_index += 1
+        return len(state['particles'])
+
+    def summary(self):
+        store = self.state['particles']
+        events = self.state['interaction_events']
+        return {
+            'particle_counts': np.bincount(store.type_code, minlength=len(PARTICLE_TYPES)),
+            'event_counts': np.array([events.count(event_type) for event_type in EVENT_TYPES]),
+        }
+
+    def particles(self):
+        store = self.state['particles']
+        return {name: getattr(store, name).copy() for name in PARTICLE_COLUMNS}
+
+
+def _run_worker(connection, config, grid, domain):
+    """工作进程主循环: 接收 (方法名, 参数), 回复 ('ok', 结果) 或 ('error', 异常信息)"""
+    try:
+        worker = DomainWorker(config, grid, domain)
+        connection.send(('ok', None))
+        while True:
+            method, args = connection.recv()
+            if method == 'close':
+                break
+            connection.send(('ok', getattr(worker, method)(*args)))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def _route(exports):
+    """exports[发送方][接收方] -> 每个接收方收到的列表 (按发送方顺序)"""
+    return [[sent[receiver] for sent in exports if sent[receiver] is not None] for receiver in range(len(exports))]
+
+
+class DomainDecomposedUniverse:
+    """把宇宙按空间切成若干子域, 每个子域在自己的进程中推进: DomainDecomposedUniverse(config, 8).step(n)
+
+    每个进程只保存本域粒子与一层晕区, 用于单个进程内存放不下的规模. 进程间通过协调进程
+    (本进程) 转发数据, 本机的多进程在这里代替集群节点. 跨子域的反应候选对汇总到协调进程,
+    按粒子编号顺序统一做无冲突匹配, 每个反应只发生一次; 反应的随机数由粒子编号决定,
+    所以结果与子域划分无关. 推进时的随机数序列与单进程的 Universe 不同.
+    """
+
+    def __init__(self, config=None, domains=None, start_method='spawn'):
+        config = dict(config or {})
+        if config.get('seed') is None:
+            config['seed'] = new_seed()
+        # 并行已经在进程之间展开, 未指定时每个进程只用一个计算线程
+        config.setdefault('compute_threads', 1)
+        self.state = apply_cosmos_config(initialize_simulator_state(), config)
+        if self.state['integrator'] != 'euler':
+            # 晕区宽度依赖每步位移不超过 MAX_STEP_DISPLACEMENT, 分级步长的蛙跳每个子步还需多次交换晕区
+            raise IntegratorError("子域分解模式目前只支持 euler 积分器")
+        if self.state['gravity_solver'] in MESH_SOLVERS:
+            # 子域只持有本地粒子和 6.0 宽的晕区, 长程网格力需要整个盒子的质量分布
+            raise DomainError("子域分解模式不支持粒子网格引力求解器")
+        self.state['particle_counter'] = self.state['num_particles']
+        if domains is None or np.isscalar(domains):
+            domains = domain_shape(domains or os.cpu_count() or 1)
+        self.grid = DomainGrid(domains, self.state['max_position'])
+        self.domain_particle_counts = np.zeros(self.grid.count, dtype=np.int64)
+
+        context = multiprocessing.get_context(start_method)
+        self._connections, self._processes = [], []
+        for domain in range(self.grid.count):
+            parent, child = context.Pipe()
+            process = context.Process(target=_run_worker, args=(child, config, self.grid, domain), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+        for connection in self._connections:
+            self._receive(connection)
+
+    @classmethod
+    def from_file(cls, file_path, domains=None):
+        return cls(load_cosmos_config(file_path), domains)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _receive(self, connection):
+        try:
+            status, result = connection.recv()
+        except EOFError:
+            self.close()
+            raise DomainError("子域工作进程意外退出") from None
+        if status == 'error':
+            self.close()
+            raise DomainError(result)
+        return result
+
+    def _call(self, method, args_per_domain):
+        # 先把命令发给所有进程再依次接收, 各子域同时计算
+        for connection, args in zip(self._connections, args_per_domain):
+            connection.send((method, args))
+        return [self._receive(connection) for connection in self._connections]
+
+    def _call_all(self, method, *args):
+        return self._call(method, [args] * self.grid.count)
+
+    def _match_reactions(self, candidates, dt):
+        """按 (id_lo, id_hi) 顺序贪心匹配全部子域上报的候选对, 返回每个子域 apply_reactions 的参数"""
+        id_lo = np.concatenate([lo for lo, _ in candidates])
+        id_hi = np.concatenate([hi for _, hi in candidates])
+        reporter = np.repeat(np.arange(self.grid.count), [len(lo) for lo, _ in candidates])
+        offsets = np.cumsum([0] + [len(lo) for lo, _ in candidates])
+
+        ids, compact = np.unique(np.concatenate([id_lo, id_hi]), return_inverse=True)
+        order = np.lexsort((id_hi, id_lo))
+        chosen = get_backend(self.state['compute_backend']).match_pairs(
+            compact[:len(id_lo)], compact[len(id_lo):], order, len(ids))
+        chosen = chosen[np.lexsort((id_hi[chosen], id_lo[chosen]))]
+
+        state = self.state
+        new_ids = np.arange(state['particle_counter'], state['particle_counter'] + len(chosen))
+        event_ids = np.arange(state['event_counter'], state['event_counter'] + len(chosen))
+        state['particle_counter'] += len(chosen)
+        state['event_counter'] += len(chosen)
+        consumed = np.concatenate([id_lo[chosen], id_hi[chosen]])
+        args = []
+        for domain in range(self.grid.count):
+            mine = reporter[chosen] == domain
+            args.append((chosen[mine] - offsets[domain], new_ids[mine], event_ids[mine], consumed, dt))
+        return args
+
+    def step(self, n=1, dt=STEP_DT):
+        for _ in range(n):
+            gravity_halo = _route(self._call_all('gravity_exports'))
+            reaction_halo = _route(self._call('gravity_step', [(imports, dt) for imports in gravity_halo]))
+            candidates = self._call('reaction_candidates', [(imports,) for imports in reaction_halo])
+            self.domain_particle_counts[:] = self._call('apply_reactions', self._match_reactions(candidates, dt))
+            advance_cosmic_time(self.state, dt)
+        return self
+
+    def gather_particles(self):
+        """把各子域的粒子列汇总到本进程, 按粒子编号排序; 只适合规模不大时检查结果"""
+        parts = self._call_all('particles')
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in PARTICLE_COLUMNS}
+        order = np.argsort(columns['particle_id'], kind='stable')
+        return {name: column[order] for name, column in columns.items()}
+
+    def summary(self):
+        """与 Universe.summary 相同的字段, 另附子域划分与各子域的粒子数"""
+        parts = self._call_all('summary')
+        type_counts = sum(part['particle_counts'] for part in parts)
+        event_counts = sum(part['event_counts'] for part in parts)
+        domain_counts = [int(part['particle_counts'].sum()) for part in parts]
+        return {
+            'time': self.state['time'],
+            'cosmic_age_gyr': cosmic_age_gyr(self.state),
+            'scale_factor': self.state['scale_factor'],
+            'particle_count': int(type_counts.sum()),
+            'particle_counts': {p_type: int(count) for p_type, count in zip(PARTICLE_TYPES, type_counts) if count},
+            'event_count': int(event_counts.sum()),
+            'event_counts': {event_type: int(count) for event_type, count in zip(EVENT_TYPES, event_counts)
+                             if count},
+            'domains': list(self.grid.shape),
+            'domain_particle_counts': domain_counts,
+        }
+
+    def close(self):
+        for connection, process in zip(self._connections, self._processes):
+            if process.is_alive():
+                try:
+                    connection.send(('close', ()))
+                except (BrokenPipeError, OSError):
+                    pass
+            connection.close()
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._connections, self._processes = [], []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按空间子域把一个宇宙分到多个进程中推进")
+    parser.add_argument('config', help=".cosmos 配置文件")
+    parser.add_argument('--domains', type=int, nargs='+', default=None,
+                        help="子域个数 (自动分解为 nx ny nz) 或直接给出 nx ny nz, 默认为核心数")
+    parser.add_argument('--steps', type=int, default=1000, help="物理子步数")
+    parser.add_argument('--backend', choices=('auto',) + BACKEND_NAMES, help="计算后端, 覆盖配置中的设置")
+    parser.add_argument('--particles', help="最终粒子状态 .npz 文件 (汇总到本进程写出)")
+    parser.add_argument('--output', help="结果摘要 JSON 文件, 默认输出到标准输出")
+    args = parser.parse_args(argv)
+    if args.domains is not None and len(args.domains) not in (1, 3):
+        parser.error("--domains 需要 1 个或 3 个整数")
+
+    config = load_cosmos_config(args.config)
+    if args.backend:
+        config['compute_backend'] = args.backend
+    domains = args.domains[0] if args.domains and len(args.domains) == 1 else args.domains
+    with DomainDecomposedUniverse(config, domains) as universe:
+        started = time.perf_counter()
+        universe.step(args.steps)
+        wall_time = time.perf_counter() - started
+        result = universe.summary()
+        result['compute_backend'] = resolve_backend_name(universe.state['compute_backend'])
+        if args.particles:
+            np.savez_compressed(args.particles, **universe.gather_particles())
+            result['particles_file'] = args.particles
+
+    result.update({
+        'config': args.config,
+        'steps': args.steps,
+        'wall_time': wall_time,
+        'steps_per_second': args.steps / wall_time if wall_time > 0 else float('inf'),
+    })
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
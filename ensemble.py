@@ -0,0 +1,158 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from cosmic_engine import (PARTICLE_TYPES, STEP_DT, apply_cosmos_config, cosmic_age_gyr, initialize_particles,
+                           initialize_simulator_state, load_cosmos_config, physics_step, start_trails,
+                           trail_columns)
+from event_log import EVENT_TYPES
+from particle_store import PARTICLE_COLUMNS, ParticleStore
+
+
+def universe_seeds(seed, count):
+    """由集合种子派生出 count 个互不相关的宇宙种子"""
+    return [int(s) for s in np.random.SeedSequence(seed).generate_state(count)]
+
+
+def _describe(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'min': float(values.min()),
+        'max': float(values.max()),
+    }
+
+
+class Multiverse:
+    """共享同一配置, 种子不同的 M 个宇宙, 打包在同一个列式存储中一起推进
+
+    粒子带有 universe 列; physics_step 识别该列后把各宇宙平移到互不重叠的位置建立邻居
+    索引, 因此宇宙之间没有相互作用, 但引力, 积分和聚变都在一次向量化的子步中完成.
+    初始粒子按各宇宙自己的种子生成; 推进过程中的随机数来自集合共享的生成器.
+    """
+
+    def __init__(self, config=None, universes=100, seed=None):
+        self.state = initialize_simulator_state()
+        if config:
+            apply_cosmos_config(self.state, config)
+        # 未指定集合种子时使用配置中的种子 (配置没有时为新生成的种子)
+        if seed is None:
+            seed = self.state['seed']
+        self.state['seed'] = seed
+        self.state['rng'] = np.random.default_rng(seed)
+        self.universe_count = int(universes)
+        self.seeds = universe_seeds(seed, self.universe_count)
+        self.state['universe_count'] = self.universe_count
+        self.state['universe_event_counts'] = np.zeros((self.universe_count, len(EVENT_TYPES)), dtype=np.int64)
+        self._populate(config)
+
+    def _populate(self, config):
+        state = self.state
+        columns = dict(trail_columns(max(int(state['trail_length']), 2)), universe=(np.int32, ()))
+        capacity = max(self.universe_count * state['num_particles'], 64)
+        store = state['particles'] = ParticleStore(capacity, extra_columns=columns)
+        state['trail_head'] = 0
+
+        for universe, seed in enumerate(self.seeds):
+            universe_state = initialize_simulator_state()
+            if config:
+                apply_cosmos_config(universe_state, config)
+            universe_state['seed'] = seed
+            initialize_particles(universe_state)
+            particles = universe_state['particles']
+            values = {name: getattr(particles, name) for name in PARTICLE_COLUMNS}
+            values['particle_id'] = particles.particle_id + state['particle_counter']
+            values['universe'] = np.full(len(particles), universe, dtype=np.int32)
+            store.extend(**values)
+            state['particle_counter'] += universe_state['particle_counter']
+        start_trails(state, 0)
+
+    @classmethod
+    def from_file(cls, file_path, universes=100, seed=None):
+        return cls(load_cosmos_config(file_path), universes, seed)
+
+    @property
+    def particles(self):
+        return self.state['particles']
+
+    def step(self, n=1, dt=STEP_DT):
+        for _ in range(n):
+            physics_step(self.state, dt)
+        return self
+
+    def universe_table(self):
+        """每个宇宙一行的统计: 粒子总数, 各类粒子数 (M, T), 各类事件数 (M, E)"""
+        store = self.state['particles']
+        type_count = len(PARTICLE_TYPES)
+        type_counts = np.bincount(store.universe.astype(np.int64) * type_count + store.type_code,
+                                  minlength=self.universe_count * type_count).reshape(self.universe_count, -1)
+        return {
+            'seed': np.array(self.seeds, dtype=np.int64),
+            'particle_count': type_counts.sum(axis=1),
+            'particle_counts': type_counts,
+            'event_counts': self.state['universe_event_counts'].copy(),
+        }
+
+    def universe_summaries(self):
+        table = self.universe_table()
+        return [{
+            'universe': universe,
+            'seed': int(table['seed'][universe]),
+            'particle_count': int(table['particle_count'][universe]),
+            'particle_counts': {p_type: int(count) for p_type, count
+                                in zip(PARTICLE_TYPES, table['particle_counts'][universe]) if count},
+            'event_counts': {event_type: int(count) for event_type, count
+                             in zip(EVENT_TYPES, table['event_counts'][universe]) if count},
+        } for universe in range(self.universe_count)]
+
+    def summary(self):
+        """集合统计: 各量在宇宙之间的均值, 标准差, 最小值和最大值"""
+        table = self.universe_table()
+        return {
+            'universes': self.universe_count,
+            'seed': self.state['seed'],
+            'time': self.state['time'],
+            'cosmic_age_gyr': cosmic_age_gyr(self.state),
+            'scale_factor': self.state['scale_factor'],
+            'particle_count': _describe(table['particle_count']),
+            'particle_counts': {p_type: _describe(table['particle_counts'][:, code])
+                                for code, p_type in enumerate(PARTICLE_TYPES)},
+            'event_count': _describe(table['event_counts'].sum(axis=1)),
+            'event_counts': {event_type: _describe(table['event_counts'][:, code])
+                             for code, event_type in enumerate(EVENT_TYPES)},
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以批量数组同时推进多个宇宙")
+    parser.add_argument('config', help=".cosmos 配置文件")
+    parser.add_argument('--universes', type=int, default=100, help="宇宙个数")
+    parser.add_argument('--seed', type=int, default=None, help="集合种子, 默认使用配置中的种子")
+    parser.add_argument('--steps', type=int, default=1000, help="物理子步数")
+    parser.add_argument('--per-universe', action='store_true', help="同时输出每个宇宙的统计")
+    parser.add_argument('--output', help="结果 JSON 文件, 默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    multiverse = Multiverse.from_file(args.config, args.universes, args.seed)
+    started = time.perf_counter()
+    multiverse.step(args.steps)
+    wall_time = time.perf_counter() - started
+
+    result = multiverse.summary()
+    result.update({'config': args.config, 'steps': args.steps, 'wall_time': wall_time})
+    if args.per_universe:
+        result['per_universe'] = multiverse.universe_summaries()
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+
+EVENT_TYPES = ("nuclear_fusion", "star_formation", "galaxy_formation", "black_hole_formation")
+EVENT_TYPE_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+
+# 每个事件最多记录的输入 / 输出粒子数, 不足的位置填 -1
+MAX_EVENT_INPUTS = 2
+MAX_EVENT_OUTPUTS = 1
+
+EVENT_DTYPE = np.dtype([
+    ('event_id', np.int64),
+    ('event_type', np.int8),
+    ('timestamp', np.float64),
+    ('position', np.float32, (3,)),
+    ('energy', np.float64),
+    ('particles_in', np.int64, (MAX_EVENT_INPUTS,)),
+    ('particles_out', np.int64, (MAX_EVENT_OUTPUTS,)),
+])
+
+
+def compatible_event_types(names):
+    """文件中记录的事件类型表能否直接使用当前的类型码: 新事件类型只追加在末尾, 旧文件的列表是当前列表的前缀"""
+    return isinstance(names, list) and 0 < len(names) <= len(EVENT_TYPES) and \
+        names == list(EVENT_TYPES[:len(names)])
+
+
+def _padded_ids(ids, width):
+    ids = np.asarray(ids, dtype=np.int64)
+    if ids.ndim == 1:
+        ids = ids[:, np.newaxis]
+    if ids.shape[1] > width:
+        raise ValueError(f"每个事件最多记录 {width} 个粒子")
+    padded = np.full((len(ids), width), -1, dtype=np.int64)
+    padded[:, :ids.shape[1]] = ids
+    return padded
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class EventLog:
+    """按列存储的相互作用事件日志
+
+    事件以 EVENT_DTYPE 结构化数组分块存放, 每块 chunk_size 条. 内存中的事件超过
+    memory_limit 条时, 最旧的整块依次追加写入 spill_path (未指定时使用临时文件, close
+    时删除), 内存中只保留每个落盘块的时间范围和各类型计数. 事件按时间戳非递减追加,
+    按类型和时间范围计数时只需读取跨越区间边界的落盘块.
+    """
+
+    def __init__(self, chunk_size=4096, memory_limit=65536, spill_path=None):
+        self.chunk_size = max(int(chunk_size), 1)
+        self.memory_limit = max(int(memory_limit), self.chunk_size)
+        self.spill_path = spill_path
+        self._finalizer = None
+        self._spill_ready = False
+        self._chunks = []
+        self._current = np.zeros(self.chunk_size, dtype=EVENT_DTYPE)
+        self._fill = 0
+        # 落盘块索引: (来源, 偏移, 条数, 最早时间, 最晚时间, 各类型计数)
+        # 来源是 np.save 格式的文件路径 (偏移为字节), 或 EVENT_DTYPE 数组 (偏移为行号)
+        self._spilled = []
+        self._spilled_count = 0
+        self._type_counts = np.zeros(len(EVENT_TYPES), dtype=np.int64)
+
+    def __len__(self):
+        return self._spilled_count + self.memory_count
+
+    @property
+    def memory_count(self):
+        return sum(len(chunk) for chunk in self._chunks) + self._fill
+
+    @property
+    def spilled_count(self):
+        return self._spilled_count
+
+    def append(self, event_id, event_type, timestamp, position, energy, particles_in, particles_out):
+        """追加单个事件"""
+        self.extend([event_id], [event_type], [timestamp], [position], [energy],
+                    [particles_in], [particles_out])
+
+    def extend(self, event_ids, event_types, timestamps, positions, energies, particles_in, particles_out):
+        """批量追加事件; event_types 可以是类型名或类型编码"""
+        n = len(event_ids)
+        if n == 0:
+            return
+        records = np.zeros(n, dtype=EVENT_DTYPE)
+        records['event_id'] = event_ids
+        records['event_type'] = [
+            EVENT_TYPE_CODES[t] if isinstance(t, str) else t for t in event_types
+        ]
+        records['timestamp'] = timestamps
+        records['position'] = positions
+        records['energy'] = energies
+        records['particles_in'] = _padded_ids(particles_in, MAX_EVENT_INPUTS)
+        records['particles_out'] = _padded_ids(particles_out, MAX_EVENT_OUTPUTS)
+        self.extend_records(records)
+
+    def extend_records(self, records):
+        """追加 EVENT_DTYPE 结构化数组形式的事件"""
+        n = len(records)
+        self._type_counts += np.bincount(records['event_type'], minlength=len(EVENT_TYPES))
+
+        start = 0
+        while start < n:
+            take = min(self.chunk_size - self._fill, n - start)
+            self._current[self._fill:self._fill + take] = records[start:start + take]
+            self._fill += take
+            start += take
+            if self._fill == self.chunk_size:
+                self._chunks.append(self._current)
+                self._current = np.zeros(self.chunk_size, dtype=EVENT_DTYPE)
+                self._fill = 0
+        self._spill_excess()
+
+    def _open_spill_file(self):
+        if self.spill_path is None:
+            fd, self.spill_path = tempfile.mkstemp(prefix='cosmos_events_', suffix='.npy')
+            os.close(fd)
+            self._finalizer = weakref.finalize(self, _remove_file, self.spill_path)
+        else:
+            open(self.spill_path, 'wb').close()
+        self._spill_ready = True
+
+    def _spill_excess(self):
+        while self._chunks and self.memory_count > self.memory_limit:
+            chunk = self._chunks.pop(0)
+            if not self._spill_ready:
+                self._open_spill_file()
+            with open(self.spill_path, 'ab') as f:
+                offset = f.tell()
+                np.save(f, chunk)
+            counts = np.bincount(chunk['event_type'], minlength=len(EVENT_TYPES))
+            self._spilled.append((self.spill_path, offset, len(chunk),
+                                  chunk['timestamp'][0], chunk['timestamp'][-1], counts))
+            self._spilled_count += len(chunk)
+
+    @staticmethod
+    def _read_spilled(source, offset, n):
+        if isinstance(source, np.ndarray):
+            return np.array(source[offset:offset + n])
+        with open(source, 'rb') as f:
+            f.seek(offset)
+            return np.load(f)
+
+    @classmethod
+    def read_chunk(cls, entry):
+        """读回 spilled_chunks() 中的一块"""
+        source, offset, n = entry[:3]
+        return cls._read_spilled(source, offset, n)
+
+    def spilled_chunks(self):
+        """落盘块索引的副本, 可交给 attach_spilled 在其它日志 (或读回检查点时) 复用"""
+        return list(self._spilled)
+
+    def attach_spilled(self, chunks):
+        """把已有的事件块登记为最旧的落盘块, 不读取其内容
+
+        来源可以是 np.save 格式的文件或 (内存映射的) EVENT_DTYPE 数组; 只能在日志为空时调用,
+        来源文件由调用方负责保留和删除.
+        """
+        if len(self):
+            raise ValueError("只能向空的事件日志登记落盘块")
+        for source, offset, n, first, last, counts in chunks:
+            counts = np.asarray(counts, dtype=np.int64)
+            self._spilled.append((source, offset, n, first, last, counts))
+            self._spilled_count += n
+            self._type_counts += counts
+
+    def materialize_spilled(self, predicate):
+        """把来源满足 predicate(source) 的落盘块读入内存, 之后不再引用这些来源 (例如即将被覆盖的检查点文件)"""
+        self._spilled = [
+            (self._read_spilled(source, offset, n), 0, n, first, last, counts) if predicate(source)
+            else (source, offset, n, first, last, counts)
+            for source, offset, n, first, last, counts in self._spilled]
+
+    def memory_chunks(self):
+        """内存中的事件块 (从旧到新), 最后一块是正在填充的部分"""
+        chunks = list(self._chunks)
+        if self._fill:
+            chunks.append(self._current[:self._fill])
+        return chunks
+
+    def iter_chunks(self):
+        """按时间顺序遍历全部事件块, 落盘块逐块读回"""
+        for entry in self._spilled:
+            yield self.read_chunk(entry)
+        yield from self.memory_chunks()
+
+    def type_counts(self):
+        """各事件类型的总数 (不读磁盘)"""
+        return {name: int(count) for name, count in zip(EVENT_TYPES, self._type_counts) if count}
+
+    @staticmethod
+    def _match(chunk, type_code, t_min, t_max):
+        lo = 0 if t_min is None else np.searchsorted(chunk['timestamp'], t_min, side='left')
+        hi = len(chunk) if t_max is None else np.searchsorted(chunk['timestamp'], t_max, side='right')
+        selected = chunk[lo:hi]
+        if type_code is not None:
+            selected = selected[selected['event_type'] == type_code]
+        return selected
+
+    def count(self, event_type=None, t_min=None, t_max=None):
+        """统计类型为 event_type, 时间在 [t_min, t_max] 内的事件数"""
+        type_code = None if event_type is None else EVENT_TYPE_CODES[event_type]
+        if t_min is None and t_max is None:
+            return len(self) if type_code is None else int(self._type_counts[type_code])
+
+        total = 0
+        for source, offset, n, first, last, counts in self._spilled:
+            if (t_min is not None and last < t_min) or (t_max is not None and first > t_max):
+                continue
+            if (t_min is None or first >= t_min) and (t_max is None or last <= t_max):
+                total += n if type_code is None else int(counts[type_code])
+            else:
+                total += len(self._match(self._read_spilled(source, offset, n), type_code, t_min, t_max))
+        for chunk in self.memory_chunks():
+            total += len(self._match(chunk, type_code, t_min, t_max))
+        return total
+
+    def select(self, event_type=None, t_min=None, t_max=None):
+        """返回满足条件的事件 (EVENT_DTYPE 结构化数组), 只读取与时间范围重叠的落盘块"""
+        type_code = None if event_type is None else EVENT_TYPE_CODES[event_type]
+        parts = []
+        for source, offset, n, first, last, _ in self._spilled:
+            if (t_min is not None and last < t_min) or (t_max is not None and first > t_max):
+                continue
+            parts.append(self._match(self._read_spilled(source, offset, n), type_code, t_min, t_max))
+        for chunk in self.memory_chunks():
+            parts.append(self._match(chunk, type_code, t_min, t_max))
+        if not parts:
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        return np.concatenate(parts)
+
+    def recent(self, n):
+        """最近的 n 个仍在内存中的事件"""
+        chunks = self.memory_chunks()
+        if not chunks or n <= 0:
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        return np.concatenate(chunks)[-n:]
+
+    def clear(self):
+        self._chunks = []
+        self._fill = 0
+        self._spilled = []
+        self._spilled_count = 0
+        self._type_counts[:] = 0
+        if self._spill_ready and os.path.exists(self.spill_path):
+            open(self.spill_path, 'wb').close()
+
+    def close(self):
+        """丢弃全部事件; 自动创建的临时落盘文件会被删除"""
+        self.clear()
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self.spill_path = None
+            self._spill_ready = False
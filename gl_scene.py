@@ -0,0 +1,124 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+# pyqtgraph.opengl 与 PyOpenGL 的导入较慢, 只在场景第一次挂接到视图时导入
+
+
+@lru_cache(maxsize=4)
+def sphere_mesh(radius=8.0, slices=16, stacks=8):
+    """经纬线划分的球面网格 (顶点, 三角形), 按参数缓存, 返回的数组只读
+
+    每一圈纬线 slices 个顶点 (两极也各有一圈重合的顶点), 相邻两圈之间每格两个三角形.
+    """
+    phi = np.pi * np.arange(stacks + 1) / stacks
+    theta = 2 * np.pi * np.arange(slices) / slices
+    vertices = radius * np.stack([
+        np.outer(np.sin(phi), np.cos(theta)),
+        np.outer(np.sin(phi), np.sin(theta)),
+        np.repeat(np.cos(phi)[:, np.newaxis], slices, axis=1),
+    ], axis=-1).reshape(-1, 3).astype(np.float32)
+
+    first = np.arange(stacks * slices)
+    second = first + slices
+    next_first = first - first % slices + (first + 1) % slices + slices
+    faces = np.empty((2 * len(first), 3), dtype=np.uint32)
+    faces[0::2] = np.stack([first, second, first + 1], axis=1)
+    faces[1::2] = np.stack([second, next_first, first + 1], axis=1)
+    vertices.flags.writeable = False
+    faces.flags.writeable = False
+    return vertices, faces
+
+
+def add_backdrop(gl_widget, radius=8.0, axis_length=4.0):
+    """加入半透明的宇宙边界球和三根坐标轴"""
+    import pyqtgraph.opengl as gl
+
+    vertices, faces = sphere_mesh(radius)
+    gl_widget.addItem(gl.GLMeshItem(
+        vertexes=vertices,
+        faces=faces,
+        smooth=False,
+        color=(0.1, 0.1, 0.3, 0.05),
+        drawEdges=True,
+        edgeColor=(0.3, 0.3, 0.5, 0.2),
+        glOptions='additive'
+    ))
+    for axis, color in enumerate(((1, 0, 0, 1), (0, 1, 0, 1), (0, 0, 1, 1))):
+        end = np.zeros(3, dtype=np.float32)
+        end[axis] = axis_length
+        gl_widget.addItem(gl.GLLinePlotItem(pos=np.array([np.zeros(3), end], dtype=np.float32), color=color, width=2))
+
+
+class SceneLayer:
+    """粒子与轨迹的持久 GL 图元
+
+    图元在挂接到 gl_widget 时创建, 之后每帧只推送新的顶点, 颜色和尺寸数组;
+    隐藏轨迹只是切换可见性, 不销毁图元. 未挂接时只记录最新快照, 挂接后立即显示.
+    """
+
+    def __init__(self, gl_widget=None):
+        self.gl_widget = None
+        self.particles_item = None
+        self.trails_item = None
+        self.trajectories_visible = True
+        self.last_snapshot = None
+        if gl_widget is not None:
+            self.attach(gl_widget)
+
+    def attach(self, gl_widget):
+        import pyqtgraph.opengl as gl
+
+        self.gl_widget = gl_widget
+        self.particles_item = gl.GLScatterPlotItem(pos=np.zeros((0, 3), dtype=np.float32))
+        self.particles_item.setVisible(False)
+        gl_widget.addItem(self.particles_item)
+        # 所有轨迹合并为一个 mode='lines' 的线段图元, 每帧一次 setData
+        self.trails_item = gl.GLLinePlotItem(pos=np.zeros((0, 3), dtype=np.float32), mode='lines',
+                                             width=1.2, antialias=True)
+        self.trails_item.setVisible(False)
+        gl_widget.addItem(self.trails_item)
+        if self.last_snapshot is not None:
+            self.update(self.last_snapshot)
+
+    def update(self, snapshot):
+        """推送快照数据, 返回本次上传了数据的图元个数"""
+        self.last_snapshot = snapshot
+        if self.gl_widget is None:
+            return 0
+        uploaded = 0
+        if len(snapshot.positions):
+            self.particles_item.setData(pos=snapshot.positions, color=snapshot.colors, size=snapshot.sizes)
+            self.particles_item.setVisible(True)
+            uploaded += 1
+        else:
+            self.particles_item.setVisible(False)
+
+        if self.trajectories_visible:
+            uploaded += self._update_trajectories(snapshot)
+        return uploaded
+
+    def _update_trajectories(self, snapshot):
+        if len(snapshot.trail_vertices):
+            self.trails_item.setData(pos=snapshot.trail_vertices, color=snapshot.trail_colors)
+            self.trails_item.setVisible(True)
+            return 1
+        self.trails_item.setVisible(False)
+        return 0
+
+    def set_trajectories_visible(self, visible):
+        self.trajectories_visible = bool(visible)
+        if self.gl_widget is None:
+            return
+        if self.trajectories_visible and self.last_snapshot is not None:
+            self._update_trajectories(self.last_snapshot)
+        elif not self.trajectories_visible:
+            self.trails_item.setVisible(False)
+
+    def clear(self):
+        """隐藏全部图元 (重置模拟时), 图元本身保留复用"""
+        self.last_snapshot = None
+        if self.gl_widget is not None:
+            self.particles_item.setVisible(False)
+            self.trails_item.setVisible(False)
@@ -0,0 +1,165 @@
+import numpy as np
+
+from parallel import ordered_map
+
+
+# 引力作用窗口与软化参数
+GRAVITY_MIN_DISTANCE = 0.3
+GRAVITY_MAX_DISTANCE = 6.0
+GRAVITY_SOFTENING = 0.1
+MAX_FORCE_MAGNITUDE = 1e8
+
+# 单个分块中最多同时计算的粒子对数, 控制内存峰值
+MAX_BLOCK_PAIRS = 1 << 20
+
+
+def safe_normalize(vector):
+    norm = np.linalg.norm(vector)
+    if norm == 0 or not np.isfinite(norm) or norm > 1e6:
+        return np.array([0.0, 0.0, 0.0], dtype=np.float32)
+    return (vector / norm).astype(np.float32)
+
+
+def safe_distance(pos1, pos2):
+    try:
+        diff = pos1 - pos2
+        if not np.all(np.isfinite(diff)):
+            return float('inf')
+        distance = np.linalg.norm(diff)
+        return distance if np.isfinite(distance) else float('inf')
+    except:
+        return float('inf')
+
+
+def safe_normalize_rows(vectors):
+    """逐行归一化, 规则与 safe_normalize 相同"""
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1)
+    ok = (norms != 0) & np.isfinite(norms) & (norms <= 1e6)
+    result = np.zeros_like(vectors)
+    result[ok] = vectors[ok] / norms[ok, np.newaxis]
+    return result.astype(np.float32)
+
+
+def reference_gravity_forces(positions, masses, gravitational_constant):
+    """逐对累加引力的参考实现, 只在 0.3 < r < 6.0 的窗口内作用"""
+    forces = np.zeros((len(positions), 3), dtype=np.float32)
+    for i in range(len(positions)):
+        if masses[i] <= 0:
+            continue
+        for j in range(len(positions)):
+            if i == j or masses[j] <= 0:
+                continue
+            r_vec = positions[j] - positions[i]
+            r_mag = safe_distance(positions[i], positions[j])
+            if GRAVITY_MIN_DISTANCE < r_mag < GRAVITY_MAX_DISTANCE:
+                force_mag = gravitational_constant * masses[i] * masses[j] / (r_mag ** 2 + GRAVITY_SOFTENING)
+                if np.isfinite(force_mag) and force_mag < MAX_FORCE_MAGNITUDE:
+                    forces[i] += force_mag * safe_normalize(r_vec)
+    return forces
+
+
+def direct_gravity_forces(positions, masses, gravitational_constant, block_size=None, targets=None, threads=1):
+    """分块向量化的全对引力求和, 结果与 reference_gravity_forces 一致
+
+    每次处理 block_size 个受力粒子对全部粒子的位移, 内存占用为 O(block_size * N).
+    给出 targets 时只计算这些下标的粒子所受的力, 返回形状为 (len(targets), 3).
+    各块写入互不重叠的行, 在 threads 个线程中并行计算.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    masses = np.asarray(masses, dtype=np.float64)
+    target_rows = np.arange(len(positions)) if targets is None else np.asarray(targets, dtype=np.int64)
+    forces = np.zeros((len(target_rows), 3), dtype=np.float64)
+
+    # 质量为零或位置非有限的粒子既不受力也不施力
+    valid = (masses > 0) & np.all(np.isfinite(positions), axis=1)
+    pos = positions[valid]
+    mass = masses[valid]
+    receivers = np.flatnonzero(valid[target_rows])
+    if len(pos) < 2 or len(receivers) == 0:
+        return forces.astype(np.float32)
+
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_PAIRS // len(pos))
+
+    def block_forces(rows):
+        block = positions[target_rows[rows]]
+        block_mass = masses[target_rows[rows]]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            r_sq = np.zeros((len(rows), len(pos)))
+            for axis in range(3):
+                r_sq += (pos[np.newaxis, :, axis] - block[:, axis, np.newaxis]) ** 2
+            r_mag = np.sqrt(r_sq)
+            force_mag = gravitational_constant * block_mass[:, np.newaxis] * mass[np.newaxis, :] / (
+                    r_sq + GRAVITY_SOFTENING)
+            in_range = ((r_mag > GRAVITY_MIN_DISTANCE) & (r_mag < GRAVITY_MAX_DISTANCE) &
+                        np.isfinite(force_mag) & (force_mag < MAX_FORCE_MAGNITUDE))
+            coefficient = np.where(in_range, force_mag / r_mag, 0.0)
+            # sum_j c_ij (p_j - p_i) = (C @ P)_i - (sum_j c_ij) p_i
+            return coefficient @ pos - coefficient.sum(axis=1)[:, np.newaxis] * block
+
+    blocks = [receivers[start:start + block_size] for start in range(0, len(receivers), block_size)]
+    for rows, block in zip(blocks, ordered_map(block_forces, blocks, threads)):
+        forces[rows] = block
+
+    return forces.astype(np.float32)
+
+
+def cell_list_gravity_forces(positions, masses, gravitational_constant, index, threads=1, targets=None):
+    """从邻居索引读取 r < 6.0 的候选粒子对求引力, 结果与 direct_gravity_forces 一致
+
+    index 需提供 subset(mask), candidate_batches(radius), batch_pairs_compact(batch) 与 skin (见 CellList),
+    positions 可以是索引建立之后移动过的位置 (不超过 index.skin / 2);
+    每对只计算一次, 按牛顿第三定律同时累加到两端. 各批在 threads 个线程中并行计算,
+    按批的顺序合并, 因此结果与线程数无关. 给出 targets 时只处理至少一端在 targets 中的粒子对,
+    返回这些下标的粒子所受的力, 形状为 (len(targets), 3).
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    masses = np.asarray(masses, dtype=np.float64)
+    forces = np.zeros((len(positions), 3), dtype=np.float64)
+    index = index.subset(masses > 0)
+    active, cells = target_cells(index, targets, len(positions))
+
+    def batch_forces(batch):
+        i, j, rows, local_i, local_j = index.batch_pairs_compact(batch)
+        if active is not None:
+            touching = active[i] | active[j]
+            i, j, local_i, local_j = i[touching], j[touching], local_i[touching], local_j[touching]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            r_vec = positions[j] - positions[i]
+            r_sq = (r_vec ** 2).sum(axis=1)
+            r_mag = np.sqrt(r_sq)
+            force_mag = gravitational_constant * masses[i] * masses[j] / (r_sq + GRAVITY_SOFTENING)
+            in_range = ((r_mag > GRAVITY_MIN_DISTANCE) & (r_mag < GRAVITY_MAX_DISTANCE) &
+                        np.isfinite(force_mag) & (force_mag < MAX_FORCE_MAGNITUDE))
+            contribution = np.where(in_range, force_mag / r_mag, 0.0)[:, np.newaxis] * r_vec
+        partial = np.zeros((len(rows), 3), dtype=np.float64)
+        for axis in range(3):
+            partial[:, axis] += np.bincount(local_i, weights=contribution[:, axis], minlength=len(rows))
+            partial[:, axis] -= np.bincount(local_j, weights=contribution[:, axis], minlength=len(rows))
+        return len(i), rows, partial
+
+    # 每批只返回它涉及的行, 按批的顺序合并; 开销与粒子对数成正比, 与粒子总数无关
+    batches = index.candidate_batches(GRAVITY_MAX_DISTANCE + index.skin, cells=cells)
+    for tested, rows, partial in ordered_map(batch_forces, batches, threads):
+        index.stats['pairs_tested'] += tested
+        forces[rows] += partial
+
+    if targets is not None:
+        forces = forces[targets]
+    return forces.astype(np.float32)
+
+
+def target_cells(index, targets, count):
+    """受力粒子的掩码与所在网格的掩码; targets 为 None (全部粒子) 时返回 (None, None)"""
+    if targets is None:
+        return None, None
+    active = np.zeros(count, dtype=bool)
+    active[np.asarray(targets, dtype=np.int64)] = True
+    return active, index.cells_of(targets)
+
+
+def dark_energy_repulsion(positions, energies):
+    """暗能量粒子沿径向向外的斥力 (以力的形式返回, 需从引力中减去)"""
+    pos_norm = safe_normalize_rows(positions)
+    return (np.asarray(energies, dtype=np.float64)[:, np.newaxis] * 1e-18 * pos_norm).astype(np.float32)
@@ -0,0 +1,158 @@
+import math
+
+import numpy as np
+
+from gravity import GRAVITY_MIN_DISTANCE, GRAVITY_MAX_DISTANCE, GRAVITY_SOFTENING
+
+
+INTEGRATORS = ('euler', 'leapfrog')
+DEFAULT_INTEGRATOR = 'euler'
+# 时间步判据 dt_i = min(sqrt(2 * eta * eps / |a_i|), sqrt(2 * eta) * eps / |v_i|) 中的 eta;
+# eps 取引力软化长度
+DEFAULT_TIMESTEP_ACCURACY = 0.025
+SOFTENING_LENGTH = math.sqrt(GRAVITY_SOFTENING)
+# 第 k 级的步长为 dt / 2^k; 最细一级每个物理子步 2^MAX_RUNG 个小步
+MAX_RUNG = 12
+# 蛙跳积分器附加的粒子列; 新粒子的 has_force 为假, 在下一步开始时补算加速度
+LEAPFROG_COLUMNS = {
+    'acceleration': (np.float64, (3,)),
+    'rung': (np.int8, ()),
+    'has_force': (np.bool_, ()),
+}
+
+
+class IntegratorError(ValueError):
+    """未知的积分器"""
+
+
+def ensure_leapfrog_columns(store):
+    for name, (dtype, shape) in LEAPFROG_COLUMNS.items():
+        if name not in store.column_names:
+            store.define_column(name, dtype, shape)
+
+
+def accelerations(forces, masses):
+    """与显式积分相同的惯性约定: a = F / (m + 0.001), 无质量粒子不因受力加速"""
+    acceleration = np.zeros((len(masses), 3), dtype=np.float64)
+    massive = masses > 0
+    acceleration[massive] = forces[massive] / (masses[massive, np.newaxis] + 0.001)
+    return np.nan_to_num(acceleration, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def desired_rungs(acceleration, velocity, masses, dt, accuracy, time_unit):
+    """满足 dt / 2^k 不超过时间步判据的最小级别 k
+
+    加速度判据之外, 有质量的粒子每步移动的距离也不超过软化长度的一个比例:
+    引力在 r < 0.3 内为零, 只看加速度会让穿过中心的粒子一步跨过整个势阱.
+    无质量粒子只做匀速漂移, 总是留在第 0 级.
+    """
+    magnitude = np.linalg.norm(acceleration, axis=1)
+    speed = np.where(masses > 0, np.linalg.norm(velocity, axis=1) / time_unit, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        steps = np.minimum(np.sqrt(2 * accuracy * SOFTENING_LENGTH / magnitude),
+                           math.sqrt(2 * accuracy) * SOFTENING_LENGTH / speed)
+        rungs = np.ceil(np.log2(dt / steps))
+    return np.clip(np.nan_to_num(rungs, nan=0.0, neginf=0.0, posinf=MAX_RUNG), 0, MAX_RUNG).astype(np.int8)
+
+
+def _drift(positions, velocity, distance_scale, max_position):
+    """匀速漂移; 越过盒子边界的坐标分量按弹性壁反射"""
+    positions += velocity * distance_scale
+    outside = np.abs(positions) > max_position
+    if outside.any():
+        positions[outside] = np.sign(positions[outside]) * 2 * max_position - positions[outside]
+        velocity[outside] = -velocity[outside]
+        np.clip(positions, -max_position, max_position, out=positions)
+
+
+def leapfrog_step(state, dt, evaluate_forces, time_unit, evaluate_long_range=None):
+    """用分级步长的 kick-drift-kick 蛙跳推进 dt, 返回 (最后一次求力的邻居索引, 求力的粒子次数)
+
+    速度取 momentum / energy, 单位是 盒子长度 / time_unit; 每个粒子按自己的加速度落在
+    2 的幂次分级的步长上 (Quinn et al. 的分级时间步), 每个小步所有粒子一起漂移,
+    只有步长恰好结束的粒子重新求力并做两个半步 kick. 粒子只在与粗一级同步时才能升到更大的步长,
+    因此整个 dt 结束时全部粒子同步, 步末的加速度留到下一步开头的半步 kick 使用.
+    evaluate_forces(positions, targets) 返回 (targets 的受力, 邻居索引), targets 为 None 表示全部粒子.
+    给出 evaluate_long_range(positions) 时它返回全部粒子所受的长程力 (网格力): 长程力变化缓慢,
+    只在整个 dt 的首尾各做一次半步 kick, 分级步长只作用于 evaluate_forces 给出的近场力.
+    不使用速度与位移限制, 也不叠加膨胀速度: 坐标视为共动坐标, 膨胀只体现在 scale_factor 中.
+    """
+    store = state['particles']
+    ensure_leapfrog_columns(store)
+    count = len(store)
+    if count == 0:
+        return None, 0
+    masses = store.mass
+    energies = store.energy
+    accuracy = state['timestep_accuracy']
+    evaluations = 0
+
+    positions = store.position.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity = np.where(energies[:, np.newaxis] > 0, store.momentum / energies[:, np.newaxis], 0.0)
+    velocity = np.nan_to_num(velocity, nan=0.0)
+
+    def long_range_kick():
+        # 长程力的半步 kick, 返回求力的粒子次数
+        if evaluate_long_range is None:
+            return 0
+        velocity[:] += accelerations(evaluate_long_range(positions), masses) * (dt / 2 * time_unit)
+        return count
+
+    def new_rungs(rows):
+        return desired_rungs(acceleration[rows], velocity[rows], masses[rows], dt, accuracy, time_unit)
+
+    fresh = np.flatnonzero(~store.has_force)
+    if len(fresh):
+        forces, _ = evaluate_forces(positions, None if len(fresh) == count else fresh)
+        store.acceleration[fresh] = accelerations(forces, masses[fresh])
+        store.has_force[fresh] = True
+        evaluations += len(fresh)
+    acceleration = store.acceleration.copy()
+    rung = store.rung.astype(np.int64)
+    # 新粒子按自己的判据分级, 其余粒子沿用上一步末选定的级别
+    rung[fresh] = new_rungs(fresh)
+
+    total_ticks = 1 << MAX_RUNG
+    tick = dt / total_ticks
+
+    def kick(rows):
+        # 半步 kick: v += a * (dt / 2^k) / 2, 速度以 time_unit 为时间单位
+        half_step = (dt / 2.0 ** rung[rows]) / 2
+        velocity[rows] += acceleration[rows] * (half_step * time_unit)[:, np.newaxis]
+
+    evaluations += long_range_kick()
+    kick(np.arange(count))
+    now = 0
+    neighbor_index = None
+    while now < total_ticks:
+        ticks = 1 << (MAX_RUNG - int(rung.max()))
+        _drift(positions, velocity, ticks * tick / time_unit, state['max_position'])
+        now += ticks
+
+        ending = np.flatnonzero(now % (1 << (MAX_RUNG - rung)) == 0)
+        forces, neighbor_index = evaluate_forces(positions, None if len(ending) == count else ending)
+        acceleration[ending] = accelerations(forces, masses[ending])
+        evaluations += len(ending)
+        kick(ending)
+
+        # 只能升到 now 恰好是其步长整数倍的级别, 降级 (更小的步长) 不受限制
+        coarsest = MAX_RUNG - ((now & -now).bit_length() - 1) if now < total_ticks else 0
+        rung[ending] = np.maximum(new_rungs(ending), coarsest)
+        if now < total_ticks:
+            kick(ending)
+    evaluations += long_range_kick()
+
+    store.position = positions.astype(np.float32)
+    store.momentum = (velocity * energies[:, np.newaxis]).astype(np.float32)
+    store.acceleration = acceleration
+    store.rung = rung
+    return neighbor_index, evaluations
+
+
+def pair_potential(distances, mass_i, mass_j, gravitational_constant):
+    """与窗口引力 F = G m_i m_j / (r^2 + s) (0.3 < r < 6.0) 对应的连续势能; r >= 6 时为 0, r <= 0.3 时取最低值"""
+    root = math.sqrt(GRAVITY_SOFTENING)
+    clipped = np.clip(distances, GRAVITY_MIN_DISTANCE, GRAVITY_MAX_DISTANCE)
+    depth = (math.atan(GRAVITY_MAX_DISTANCE / root) - np.arctan(clipped / root)) / root
+    return -gravitational_constant * mass_i * mass_j * depth
@@ -0,0 +1,100 @@
+import numpy as np
+
+
+DEFAULT_POINT_BUDGET = 200000
+# 每级细节的网格边长是上一级的 2 倍; 最远的粒子最多粗化到第 MAX_LOD_LEVEL 级
+MAX_LOD_LEVEL = 12
+# 网格坐标每轴 19 位, 细节级别放在更高的位上, 合成一个 int64 键
+_AXIS_BITS = 19
+_AXIS_OFFSET = 1 << (_AXIS_BITS - 1)
+_AXIS_MAX = (1 << _AXIS_BITS) - 1
+MAX_IMPOSTOR_SIZE = 24.0
+MAX_FIT_ATTEMPTS = 6
+
+
+def point_sizes(masses):
+    """粒子的显示尺寸, 随质量对数增长"""
+    return np.clip(3 + np.log(masses + 1) * 1.2, 2, 12).astype(np.float32)
+
+
+class PointLOD:
+    """把超过点数预算的粒子聚合为带权重的替身点
+
+    粒子按到相机的距离分级: 距离每翻一倍, 聚合网格的边长翻一倍, 因此近处的粒子单独绘制,
+    远处和密集区域合并为一个替身点 (位置取均值, 颜色取均值并按粒子数加深不透明度,
+    尺寸随粒子数对数增长). 基础网格边长按预算自动调整, 并保留到下一帧作为初值,
+    相机拉近时近处的网格随之变细. 点数不超过预算时原样返回.
+    """
+
+    def __init__(self, budget=DEFAULT_POINT_BUDGET):
+        self.budget = int(budget)
+        self.cell_size = None
+
+    def reduce(self, positions, colors, sizes, eye):
+        """返回 (位置, 颜色, 尺寸, 单独绘制的行号, 替身点个数); 单独绘制的点排在前面"""
+        count = len(positions)
+        if self.budget <= 0 or count <= self.budget:
+            return positions, colors, sizes, np.arange(count), 0
+
+        # 最近的约 budget / 4 个粒子处于第 0 级, 其外距离每翻一倍升一级
+        distance = np.linalg.norm(positions - np.asarray(eye, dtype=np.float32), axis=1)
+        near_rank = self.budget // 4
+        near = max(float(np.partition(distance, near_rank)[near_rank]), 1e-3)
+        level = np.clip(np.floor(np.log2(np.maximum(distance / near, 1.0))), 0, MAX_LOD_LEVEL).astype(np.int64)
+
+        if self.cell_size is None:
+            extent = max(float(np.ptp(positions, axis=0).max()), 1e-3)
+            self.cell_size = extent / self.budget ** (1.0 / 3.0)
+        # 调整基础边长使格子数落在 [budget / 2, budget]; 格子数大致与边长的三次方成反比
+        fitted = None
+        for _ in range(MAX_FIT_ATTEMPTS):
+            keys = self._cell_keys(positions, level, self.cell_size)
+            grouped = np.unique(keys, return_inverse=True, return_counts=True)
+            groups = len(grouped[0])
+            if groups <= self.budget:
+                fitted = (self.cell_size, grouped)
+                if groups >= self.budget // 2:
+                    break
+                self.cell_size /= min(max((self.budget / max(groups, 1)) ** (1.0 / 3.0) * 0.9, 1.05), 4.0)
+            elif fitted is not None:
+                break
+            else:
+                self.cell_size *= max((groups / self.budget) ** (1.0 / 3.0) * 1.05, 1.05)
+        if fitted is None:
+            fitted = (self.cell_size, np.unique(self._cell_keys(positions, level, self.cell_size),
+                                                return_inverse=True, return_counts=True))
+        self.cell_size, (_, inverse, counts) = fitted
+
+        single = counts[inverse] == 1
+        rows = np.flatnonzero(single)
+        merged = ~single
+        # 只有含多个粒子的格子生成替身点, 把格子编号重排为替身点编号
+        shared = counts > 1
+        merged_inverse = (np.cumsum(shared) - 1)[inverse[merged]]
+        weights = counts[shared].astype(np.float64)
+        impostors = len(weights)
+
+        impostor_positions = np.empty((impostors, 3), dtype=np.float32)
+        for axis in range(3):
+            impostor_positions[:, axis] = np.bincount(merged_inverse, positions[merged, axis],
+                                                      minlength=impostors) / weights
+        impostor_colors = np.empty((impostors, 4), dtype=np.float32)
+        for channel in range(4):
+            impostor_colors[:, channel] = np.bincount(merged_inverse, colors[merged, channel],
+                                                      minlength=impostors) / weights
+        impostor_colors[:, 3] = np.minimum(impostor_colors[:, 3] * (1 + np.log2(weights) / 4), 1.0)
+        largest = np.zeros(impostors, dtype=np.float32)
+        np.maximum.at(largest, merged_inverse, sizes[merged])
+        impostor_sizes = np.minimum(largest + 2 * np.log2(weights), MAX_IMPOSTOR_SIZE).astype(np.float32)
+
+        return (np.concatenate([positions[rows], impostor_positions]),
+                np.concatenate([colors[rows], impostor_colors]),
+                np.concatenate([sizes[rows], impostor_sizes]),
+                rows, impostors)
+
+    @staticmethod
+    def _cell_keys(positions, level, cell_size):
+        cells = cell_size * np.exp2(level)
+        coords = np.floor(positions / cells[:, np.newaxis]).astype(np.int64) + _AXIS_OFFSET
+        np.clip(coords, 0, _AXIS_MAX, out=coords)
+        return (((level << _AXIS_BITS | coords[:, 0]) << _AXIS_BITS | coords[:, 1]) << _AXIS_BITS) | coords[:, 2]
@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+from numba import njit
+
+from gravity import GRAVITY_MIN_DISTANCE, GRAVITY_MAX_DISTANCE, GRAVITY_SOFTENING, MAX_FORCE_MAGNITUDE
+
+
+# 只应通过 backends.NumbaBackend 导入: 导入前需要先设置 NUMBA_CACHE_DIR.
+# cache=True 把编译结果写入磁盘, 之后启动时直接加载, 不再重新编译;
+# nogil=True 使各分块能在线程池中真正并行.
+
+
+@njit(cache=True, nogil=True)
+def pair_gravity_forces(positions, masses, gravitational_constant, rows, pair_a, pair_b, forces):
+    """把粒子对 (rows[pair_a], rows[pair_b]) 之间的引力按牛顿第三定律累加到 forces (len(rows), 3)
+
+    positions, masses 与 forces 都是一批粒子对涉及的行组成的紧凑数组, 第 k 行对应粒子 rows[k];
+    每对先按行号排成 rows[i] < rows[j] 再计算, 与 batch_pairs 给出的粒子对逐位相同.
+    """
+    for k in range(len(pair_a)):
+        # 用条件选择而不是分支交换两端: 行号的大小关系没有规律, 分支预测几乎总是失败
+        swap = rows[pair_a[k]] > rows[pair_b[k]]
+        i = pair_b[k] if swap else pair_a[k]
+        j = pair_a[k] if swap else pair_b[k]
+        dx = positions[j, 0] - positions[i, 0]
+        dy = positions[j, 1] - positions[i, 1]
+        dz = positions[j, 2] - positions[i, 2]
+        r_sq = dx * dx + dy * dy + dz * dz
+        r_mag = math.sqrt(r_sq)
+        force_mag = gravitational_constant * masses[i] * masses[j] / (r_sq + GRAVITY_SOFTENING)
+        if (GRAVITY_MIN_DISTANCE < r_mag < GRAVITY_MAX_DISTANCE and math.isfinite(force_mag)
+                and force_mag < MAX_FORCE_MAGNITUDE):
+            c = force_mag / r_mag
+            forces[i, 0] += c * dx
+            forces[i, 1] += c * dy
+            forces[i, 2] += c * dz
+            forces[j, 0] -= c * dx
+            forces[j, 1] -= c * dy
+            forces[j, 2] -= c * dz
+
+
+@njit(cache=True, nogil=True)
+def add_rows(forces, rows, partial):
+    """forces[rows] += partial; rows 互不相同, 逐行累加, 避免花式索引先取出再写回的复制"""
+    for k in range(len(rows)):
+        r = rows[k]
+        forces[r, 0] += partial[k, 0]
+        forces[r, 1] += partial[k, 1]
+        forces[r, 2] += partial[k, 2]
+
+
+@njit(cache=True, nogil=True)
+def direct_gravity_forces(positions, masses, gravitational_constant, valid, rows):
+    """rows 中各粒子受到的全对引力; valid 为假的粒子 (质量为零或位置非有限) 既不受力也不施力"""
+    n = len(positions)
+    forces = np.zeros((len(rows), 3))
+    for k in range(len(rows)):
+        i = rows[k]
+        if not valid[i]:
+            continue
+        for j in range(n):
+            if j == i or not valid[j]:
+                continue
+            dx = positions[j, 0] - positions[i, 0]
+            dy = positions[j, 1] - positions[i, 1]
+            dz = positions[j, 2] - positions[i, 2]
+            r_sq = dx * dx + dy * dy + dz * dz
+            r_mag = math.sqrt(r_sq)
+            force_mag = gravitational_constant * masses[i] * masses[j] / (r_sq + GRAVITY_SOFTENING)
+            if (GRAVITY_MIN_DISTANCE < r_mag < GRAVITY_MAX_DISTANCE and math.isfinite(force_mag)
+                    and force_mag < MAX_FORCE_MAGNITUDE):
+                c = force_mag / r_mag
+                forces[k, 0] += c * dx
+                forces[k, 1] += c * dy
+                forces[k, 2] += c * dz
+    return forces
+
+
+@njit(cache=True, nogil=True)
+def _finite_or_zero(value):
+    if math.isnan(value):
+        return 0.0
+    return value
+
+
+@njit(cache=True, nogil=True)
+def integrate_positions(positions, momenta, masses, energies, forces, expansion_rate, dt, max_position):
+    """逐粒子更新位置, 规则与 NumpyBackend.integrate 相同"""
+    n = len(positions)
+    new_positions = np.empty((n, 3), dtype=np.float32)
+    velocity = np.zeros(3, dtype=np.float32)
+    acceleration = np.zeros(3, dtype=np.float32)
+    for p in range(n):
+        for axis in range(3):
+            velocity[axis] = 0.0
+            if energies[p] > 0:
+                velocity[axis] = np.float32(_finite_or_zero(momenta[p, axis] / energies[p]))
+        if masses[p] > 0:
+            accelerated = True
+            for axis in range(3):
+                acceleration[axis] = np.float32(_finite_or_zero(forces[p, axis] / (masses[p] + 0.001)))
+                if not abs(acceleration[axis]) < 1e8:
+                    accelerated = False
+            if accelerated:
+                for axis in range(3):
+                    velocity[axis] += np.float32(acceleration[axis] * np.float32(dt))
+        for axis in range(3):
+            v = min(max(velocity[axis], np.float32(-0.1)), np.float32(0.1))
+            expansion = np.float32(_finite_or_zero(expansion_rate * positions[p, axis] * dt * 0.001))
+            change = min(max(np.float32((v + expansion) * np.float32(dt)), np.float32(-0.1)), np.float32(0.1))
+            new_positions[p, axis] = min(max(np.float32(positions[p, axis] + change), -max_position),
+                                         max_position)
+    return new_positions
+
+
+@njit(cache=True, nogil=True)
+def close_pairs(positions, pair_i, pair_j, radius):
+    """候选对中实际距离不超过 radius 的掩码"""
+    close = np.empty(len(pair_i), dtype=np.bool_)
+    for k in range(len(pair_i)):
+        i = pair_i[k]
+        j = pair_j[k]
+        dx = positions[j, 0] - positions[i, 0]
+        dy = positions[j, 1] - positions[i, 1]
+        dz = positions[j, 2] - positions[i, 2]
+        close[k] = math.sqrt(dx * dx + dy * dy + dz * dz) <= radius
+    return close
+
+
+@njit(cache=True, nogil=True)
+def greedy_match(pair_i, pair_j, candidates, count):
+    """按 candidates 的顺序贪心选出互不共用粒子的粒子对, 返回选中的候选下标"""
+    used = np.zeros(count, dtype=np.bool_)
+    selected = np.empty(len(candidates), dtype=np.int64)
+    n = 0
+    for k in candidates:
+        i = pair_i[k]
+        j = pair_j[k]
+        if used[i] or used[j]:
+            continue
+        used[i] = True
+        used[j] = True
+        selected[n] = k
+        n += 1
+    return selected[:n]
@@ -0,0 +1,50 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 0 表示使用全部核心; 环境变量 COSMOS_THREADS 可以在启动时改变默认值
+DEFAULT_THREADS = int(os.environ.get('COSMOS_THREADS', 0))
+# 每个线程同时最多有几个分块在计算或等待合并, 限制分块结果占用的内存
+TILES_IN_FLIGHT_PER_THREAD = 2
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def resolve_threads(threads):
+    """把 0 / None 换成核心数"""
+    if not threads:
+        return os.cpu_count() or 1
+    return max(1, int(threads))
+
+
+def _pool(threads):
+    with _pools_lock:
+        if threads not in _pools:
+            _pools[threads] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='cosmos-tile')
+        return _pools[threads]
+
+
+def ordered_map(function, tiles, threads=1):
+    """在线程池中对每个分块调用 function, 按分块的原始顺序逐个产出结果
+
+    分块的划分与线程数无关, 调用方按产出顺序合并结果, 因此无论用几个线程结果都逐位相同.
+    分块内部的计算应主要由释放 GIL 的 NumPy 运算或 nogil 的 numba 核函数组成.
+    """
+    threads = resolve_threads(threads)
+    if threads == 1:
+        for tile in tiles:
+            yield function(tile)
+        return
+
+    pool = _pool(threads)
+    pending = deque()
+    window = threads * TILES_IN_FLIGHT_PER_THREAD
+    for tile in tiles:
+        pending.append(pool.submit(function, tile))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
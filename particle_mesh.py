@@ -0,0 +1,177 @@
+import argparse
+import itertools
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from gravity import (GRAVITY_MIN_DISTANCE, GRAVITY_MAX_DISTANCE, GRAVITY_SOFTENING, MAX_BLOCK_PAIRS,
+                     direct_gravity_forces)
+
+
+# 'particle_mesh': 力全部来自网格; 'p3m': r < 6.0 窗口内逐对精确求和, 窗口外来自网格
+MESH_SOLVERS = ('particle_mesh', 'p3m')
+# 盒子每个方向的网格数; 节点数比网格数多 1, 落在格点上的两侧边界都包含在内
+DEFAULT_MESH_SIZE = 32
+
+
+def mesh_inner_distance(solver):
+    """网格核函数的内半径: 小于它的节点位移不产生网格力"""
+    return GRAVITY_MAX_DISTANCE if solver == 'p3m' else GRAVITY_MIN_DISTANCE
+
+
+@lru_cache(maxsize=8)
+def force_kernel_spectra(mesh_size, cell_width, inner_distance):
+    """三个力分量核函数的频谱, 按 (网格数, 网格宽度, 内半径) 缓存
+
+    核函数是软化泊松方程 Green 函数 -atan(sqrt(s) / r) / sqrt(s) 的负梯度, 即单位质量在位移 d 处
+    产生的力 -d / (|d| (|d|^2 + s)), 与窗口引力的形式相同但没有 6.0 的上限 (长程引力);
+    |d| < inner_distance 时取零. 各方向补零到 2 * (网格数 + 1) 个点, 循环卷积不会把盒子另一侧的质量
+    卷回来 (孤立边界, Hockney-Eastwood 方法).
+    """
+    padded = 2 * (mesh_size + 1)
+    offsets = np.fft.fftfreq(padded, 1.0 / padded) * cell_width
+    dx, dy, dz = np.meshgrid(offsets, offsets, offsets, indexing='ij')
+    r_sq = dx ** 2 + dy ** 2 + dz ** 2
+    r_mag = np.sqrt(r_sq)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coefficient = np.where((r_mag > 0) & (r_mag >= inner_distance),
+                               -1.0 / (r_mag * (r_sq + GRAVITY_SOFTENING)), 0.0)
+    spectra = tuple(np.fft.rfftn(coefficient * d) for d in (dx, dy, dz))
+    for spectrum in spectra:
+        spectrum.setflags(write=False)
+    return spectra
+
+
+def cic_stencil(positions, max_position, mesh_size):
+    """云中粒子 (CIC) 分配的 8 个节点的展平下标与权重, 形状均为 (8, N); 盒子外的粒子按边界处理"""
+    cell_width = 2 * max_position / mesh_size
+    nodes = mesh_size + 1
+    scaled = (np.asarray(positions, dtype=np.float64) + max_position) / cell_width
+    base = np.clip(np.floor(scaled).astype(np.int64), 0, mesh_size - 1)
+    fraction = np.clip(scaled - base, 0.0, 1.0)
+    flat, weights = [], []
+    for corner in itertools.product((0, 1), repeat=3):
+        corner = np.array(corner)
+        node = base + corner
+        flat.append((node[:, 0] * nodes + node[:, 1]) * nodes + node[:, 2])
+        weights.append(np.prod(np.where(corner == 1, fraction, 1.0 - fraction), axis=1))
+    return np.array(flat), np.array(weights)
+
+
+def mesh_gravity_forces(positions, masses, gravitational_constant, max_position, mesh_size=DEFAULT_MESH_SIZE,
+                        inner_distance=GRAVITY_MIN_DISTANCE, targets=None):
+    """粒子网格引力: CIC 分配质量, FFT 卷积求网格上的力场, 再用同样的 CIC 权重插值回粒子
+
+    网格覆盖 [-max_position, max_position]^3 的共动盒子, 耗时 O(N + G log G).
+    分配与插值使用同一组权重且核函数反对称, 因此没有自力, 粒子对之间满足牛顿第三定律.
+    质量为零或位置非有限的粒子既不受力也不施力. 给出 targets 时返回这些下标的粒子所受的力.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    masses = np.asarray(masses, dtype=np.float64)
+    target_rows = np.arange(len(positions)) if targets is None else np.asarray(targets, dtype=np.int64)
+    forces = np.zeros((len(target_rows), 3), dtype=np.float64)
+    valid = (masses > 0) & np.all(np.isfinite(positions), axis=1)
+    receivers = np.flatnonzero(valid[target_rows])
+    if valid.sum() < 2 or len(receivers) == 0:
+        return forces.astype(np.float32)
+
+    nodes = mesh_size + 1
+    padded = 2 * nodes
+    spectra = force_kernel_spectra(mesh_size, 2 * max_position / mesh_size, inner_distance)
+
+    flat, weights = cic_stencil(positions[valid], max_position, mesh_size)
+    density = np.bincount(flat.ravel(), weights=(weights * masses[valid]).ravel(), minlength=nodes ** 3)
+    grid = np.zeros((padded, padded, padded))
+    grid[:nodes, :nodes, :nodes] = density.reshape(nodes, nodes, nodes)
+    density_spectrum = np.fft.rfftn(grid)
+
+    rows = target_rows[receivers]
+    flat, weights = cic_stencil(positions[rows], max_position, mesh_size)
+    for axis, spectrum in enumerate(spectra):
+        field = np.fft.irfftn(density_spectrum * spectrum, s=grid.shape, axes=(0, 1, 2))
+        field = field[:nodes, :nodes, :nodes].ravel()
+        forces[receivers, axis] = (field[flat] * weights).sum(axis=0)
+    forces[receivers] *= gravitational_constant * masses[rows, np.newaxis]
+    return forces.astype(np.float32)
+
+
+def reference_long_range_forces(positions, masses, gravitational_constant, targets,
+                                inner_distance=GRAVITY_MIN_DISTANCE):
+    """逐对求和的长程引力 G m_i m_j / (r^2 + s) (r > inner_distance, 没有上限), 用作网格求解器的对照"""
+    positions = np.asarray(positions, dtype=np.float64)
+    masses = np.asarray(masses, dtype=np.float64)
+    targets = np.asarray(targets, dtype=np.int64)
+    forces = np.zeros((len(targets), 3), dtype=np.float64)
+    sources = np.flatnonzero(masses > 0)
+    block_size = max(1, MAX_BLOCK_PAIRS // max(len(sources), 1))
+    for start in range(0, len(targets), block_size):
+        rows = targets[start:start + block_size]
+        r_vec = positions[np.newaxis, sources] - positions[rows, np.newaxis]
+        r_sq = (r_vec ** 2).sum(axis=2)
+        r_mag = np.sqrt(r_sq)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coefficient = np.where(r_mag > inner_distance,
+                                   masses[sources] / (r_mag * (r_sq + GRAVITY_SOFTENING)), 0.0)
+        forces[start:start + len(rows)] = np.einsum('ij,ijk->ik', coefficient, r_vec)
+    return (forces * gravitational_constant * masses[targets, np.newaxis]).astype(np.float32)
+
+
+def compare_mesh_solvers(particle_counts, mesh_size=DEFAULT_MESH_SIZE, sample_size=256,
+                         gravitational_constant=1e-15, max_position=10.0, seed=0):
+    """比较网格求解器与逐对长程求和的耗时和力误差
+
+    P³M 的近场部分用直接求和计算; 对照只在随机抽取的 sample_size 个粒子上计算, 总耗时按比例外推.
+    误差为抽样粒子上 |F_mesh - F_pair| / |F_pair| 的中位数和最大值.
+    """
+    rng = np.random.default_rng(seed)
+    mass_table = np.array([1.0, 0.938, 3.727, 0.0, 1e-9])
+    results = []
+    for count in particle_counts:
+        positions = rng.uniform(-max_position, max_position, (count, 3)).astype(np.float32)
+        masses = rng.choice(mass_table, count)
+        sample = rng.choice(count, size=min(sample_size, count), replace=False)
+
+        started = time.perf_counter()
+        exact = reference_long_range_forces(positions, masses, gravitational_constant, sample)
+        pair_seconds = (time.perf_counter() - started) * count / len(sample)
+        exact_norm = np.linalg.norm(exact, axis=1)
+        nonzero = exact_norm > 0
+
+        for solver in MESH_SOLVERS:
+            started = time.perf_counter()
+            forces = mesh_gravity_forces(positions, masses, gravitational_constant, max_position, mesh_size,
+                                         mesh_inner_distance(solver))
+            mesh_seconds = time.perf_counter() - started
+            forces = forces[sample].astype(np.float64)
+            if solver == 'p3m':
+                forces += direct_gravity_forces(positions, masses, gravitational_constant, targets=sample)
+            relative = np.linalg.norm(forces - exact, axis=1)[nonzero] / exact_norm[nonzero]
+            results.append({
+                'particles': count,
+                'solver': solver,
+                'mesh_size': mesh_size,
+                'pair_seconds': pair_seconds,
+                'mesh_seconds': mesh_seconds,
+                'median_relative_error': float(np.median(relative)) if len(relative) else 0.0,
+                'max_relative_error': float(relative.max()) if len(relative) else 0.0,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较粒子网格引力与逐对长程求和")
+    parser.add_argument('counts', nargs='*', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--mesh-size', type=int, default=DEFAULT_MESH_SIZE, help="每个方向的网格数")
+    parser.add_argument('--sample', type=int, default=256, help="逐对求和的抽样粒子数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'N':>9} {'solver':>14} {'mesh':>5} {'pairs(s)':>10} {'mesh(s)':>9} {'median err':>11} {'max err':>9}")
+    for row in compare_mesh_solvers(args.counts, args.mesh_size, args.sample, seed=args.seed):
+        print(f"{row['particles']:>9} {row['solver']:>14} {row['mesh_size']:>5} {row['pair_seconds']:>10.3f} "
+              f"{row['mesh_seconds']:>9.3f} {row['median_relative_error']:>11.2e} {row['max_relative_error']:>9.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+# 列名 -> (数据类型, 每行形状)
+PARTICLE_COLUMNS = {
+    'position': (np.float32, (3,)),
+    'momentum': (np.float32, (3,)),
+    'mass': (np.float64, ()),
+    'charge': (np.float64, ()),
+    'energy': (np.float64, ()),
+    'type_code': (np.int16, ()),
+    'particle_id': (np.int64, ()),
+    'creation_time': (np.float64, ()),
+    'spin': (np.int8, ()),
+}
+
+
+class ParticleStore:
+    """按列存储的粒子容器
+
+    每个属性是一段连续的 NumPy 数组, 通过同名属性访问前 count 行的视图,
+    例如 store.position 是 (N, 3) 的 float32 数组. 追加按容量倍增摊还 O(1),
+    删除通过布尔掩码一次性压缩. extra_columns 可追加额外的列 (如轨迹环形缓冲),
+    格式与 PARTICLE_COLUMNS 相同.
+    """
+
+    def __init__(self, capacity=64, extra_columns=None):
+        capacity = max(int(capacity), 1)
+        self.__dict__['count'] = 0
+        self.__dict__['_columns'] = {}
+        for name, (dtype, shape) in dict(PARTICLE_COLUMNS, **(extra_columns or {})).items():
+            self._columns[name] = np.zeros((capacity,) + shape, dtype=dtype)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """直接采用给定的列数组 (例如内存映射的检查点数据), 不做拷贝; 行数取自各列长度
+
+        列数组会在下一次扩容时被复制到新分配的内存中.
+        """
+        lengths = {len(column) for column in columns.values()}
+        missing = set(PARTICLE_COLUMNS) - set(columns)
+        if len(lengths) != 1 or missing:
+            raise ValueError("列不完整或长度不一致")
+        store = cls.__new__(cls)
+        store.__dict__['_columns'] = dict(columns)
+        store.__dict__['count'] = lengths.pop()
+        return store
+
+    def __len__(self):
+        return self.count
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get('_columns')
+        if columns is not None and name in columns:
+            return columns[name][:self.count]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        # 对列赋值时写回底层数组, 避免用新数组遮蔽列视图
+        if name in self._columns:
+            self._columns[name][:self.count] = value
+        else:
+            self.__dict__[name] = value
+
+    @property
+    def column_names(self):
+        return list(self._columns)
+
+    def define_column(self, name, dtype, shape):
+        """新增或以新的形状重建一列, 内容清零; 返回旧列前 count 行的数据 (若存在)"""
+        old = self._columns.get(name)
+        self._columns[name] = np.zeros((self.capacity,) + tuple(shape), dtype=dtype)
+        return None if old is None else old[:self.count]
+
+    @property
+    def capacity(self):
+        return len(self._columns['mass'])
+
+    def materialize(self, names):
+        """把指定的列 (例如内存映射的检查点数据) 复制到新分配的内存中, 之后不再引用原数组"""
+        for name in names:
+            self._columns[name] = np.array(self._columns[name])
+
+    def reserve(self, capacity):
+        """确保至少能容纳 capacity 行"""
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(capacity, 2 * self.capacity)
+        for name, column in self._columns.items():
+            grown = np.zeros((new_capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            self._columns[name] = grown
+
+    def extend(self, **columns):
+        """批量追加粒子, 各列长度必须一致, 未给出的列填 0; 返回新行的起始下标"""
+        lengths = {np.shape(values)[0] for values in columns.values()}
+        if len(lengths) != 1:
+            raise ValueError("所有列的长度必须一致")
+        n = lengths.pop()
+        start = self.count
+        self.reserve(start + n)
+        for name, column in self._columns.items():
+            if name in columns:
+                column[start:start + n] = columns[name]
+            else:
+                column[start:start + n] = 0
+        self.__dict__['count'] = start + n
+        return start
+
+    def append(self, **values):
+        """追加单个粒子, 返回其行下标"""
+        return self.extend(**{
+            name: np.asarray(value)[np.newaxis] for name, value in values.items()
+        })
+
+    def compact(self, keep):
+        """只保留 keep 掩码为真的行, 保持原有顺序"""
+        keep = np.asarray(keep, dtype=bool)
+        if len(keep) != self.count:
+            raise ValueError("掩码长度与粒子数不一致")
+        kept = int(np.count_nonzero(keep))
+        if kept == self.count:
+            return
+        for column in self._columns.values():
+            column[:kept] = column[:self.count][keep]
+        self.__dict__['count'] = kept
+
+    def clear(self):
+        self.__dict__['count'] = 0
@@ -0,0 +1,198 @@
+import csv
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class PhaseProfiler:
+    """按步记录各阶段耗时和计数器的滚动时间序列
+
+    phase(name) 计时一个代码段, count(name, n) 累加计数器, end_step() 把本步的值写入
+    长度为 history 的环形缓冲. 可以在一个线程中写入, 在另一个线程中读取 summary / series.
+    trace_memory 为真且 tracemalloc 已启动时, 另记录各阶段的峰值内存 (计数器 <阶段>.peak_memory).
+    """
+
+    def __init__(self, history=1024, trace_memory=False):
+        self.history = int(history)
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self._columns = {}
+        self._phases = []
+        self._counters = []
+        self._timestamps = np.zeros(self.history, dtype=np.float64)
+        self._current = {}
+        self._rows = 0
+
+    @contextmanager
+    def phase(self, name):
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._current[name] = self._current.get(name, 0.0) + time.perf_counter() - started
+            if name not in self._columns:
+                self._add_column(name, self._phases)
+            if tracing:
+                self.set_max(f'{name}.peak_memory', tracemalloc.get_traced_memory()[1])
+
+    def count(self, name, n=1):
+        self._current[name] = self._current.get(name, 0) + n
+        if name not in self._columns:
+            self._add_column(name, self._counters)
+
+    def set_max(self, name, value):
+        """记录本步中计数器的最大值 (用于峰值类的量)"""
+        self._current[name] = max(self._current.get(name, value), value)
+        if name not in self._columns:
+            self._add_column(name, self._counters)
+
+    def _add_column(self, name, kind):
+        with self._lock:
+            self._columns[name] = np.zeros(self.history, dtype=np.float64)
+            kind.append(name)
+
+    def end_step(self):
+        """结束一步: 未出现的阶段和计数器记为 0"""
+        with self._lock:
+            slot = self._rows % self.history
+            for name, column in self._columns.items():
+                column[slot] = self._current.get(name, 0)
+            self._timestamps[slot] = time.perf_counter()
+            self._rows += 1
+        self._current = {}
+
+    def reset(self):
+        with self._lock:
+            for column in self._columns.values():
+                column[:] = 0
+            self._rows = 0
+        self._current = {}
+
+    def __len__(self):
+        return min(self._rows, self.history)
+
+    @property
+    def phases(self):
+        return list(self._phases)
+
+    @property
+    def counters(self):
+        return list(self._counters)
+
+    def series(self, window=None):
+        """按时间顺序返回最近 window 步的 {'timestamp': ..., 名称: 数组}; 阶段耗时单位为秒"""
+        with self._lock:
+            n = len(self) if window is None else min(int(window), len(self))
+            slots = (self._rows - n + np.arange(n)) % self.history
+            series = {'timestamp': self._timestamps[slots]}
+            for name, column in self._columns.items():
+                series[name] = column[slots]
+        return series
+
+    def histogram(self, name, bins=20, window=None):
+        """某一阶段最近 window 步耗时 (毫秒) 的直方图 (counts, edges)"""
+        return np.histogram(self.series(window)[name] * 1000.0, bins=bins)
+
+    def summary(self, window=120):
+        """最近 window 步的统计: 各阶段平均与 95 分位毫秒数, 计数器每步均值, 每秒步数"""
+        series = self.series(window)
+        timestamps = series['timestamp']
+        rate = 0.0
+        if len(timestamps) > 1 and timestamps[-1] > timestamps[0]:
+            rate = (len(timestamps) - 1) / (timestamps[-1] - timestamps[0])
+        return {
+            'steps': len(timestamps),
+            'rate': rate,
+            'phases': {name: {'mean_ms': float(series[name].mean() * 1000.0) if len(timestamps) else 0.0,
+                              'p95_ms': float(np.percentile(series[name], 95) * 1000.0) if len(timestamps) else 0.0}
+                       for name in self._phases},
+            'counters': {name: float(series[name].mean()) if len(timestamps) else 0.0
+                         for name in self._counters},
+        }
+
+
+class _NullProfiler:
+    """未开启性能分析时使用, 所有操作都是空操作"""
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def count(self, name, n=1):
+        pass
+
+    def end_step(self):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+class StartupTimer:
+    """程序启动过程的分阶段耗时
+
+    mark(name) 记录从上一个标记 (或 started) 到现在的耗时; 同时记下墙钟时间,
+    以便启动它的外部进程把解释器启动和解包的时间一并算入.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self.phases = {}
+        self.marks = {}
+        self.wall_clock = {}
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases[name] = now - self._last
+        self.marks[name] = now - self.started
+        self.wall_clock[name] = time.time()
+        self._last = now
+
+    def summary(self):
+        """{'phases': 各阶段秒数, 'marks': 各标记距 started 的秒数, 'wall_clock': 各标记的 time.time()}"""
+        return {'phases': dict(self.phases), 'marks': dict(self.marks), 'wall_clock': dict(self.wall_clock)}
+
+    def write(self, file_path):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+
+
+def profile_records(profilers):
+    """把 {序列名: PhaseProfiler} 展开为逐步记录的列表, 阶段耗时换算为毫秒"""
+    records = []
+    for series_name, profiler in profilers.items():
+        series = profiler.series()
+        for row in range(len(series['timestamp'])):
+            record = {'series': series_name, 'step': row, 'timestamp': float(series['timestamp'][row])}
+            for name in profiler.phases:
+                record[f'{name}_ms'] = float(series[name][row] * 1000.0)
+            for name in profiler.counters:
+                record[name] = float(series[name][row])
+            records.append(record)
+    return records
+
+
+def export_profiles(file_path, profilers):
+    """导出性能时间序列; 扩展名为 .json 时写 JSON, 否则写 CSV (各序列的列取并集)"""
+    records = profile_records(profilers)
+    if file_path.lower().endswith('.json'):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'summary': {name: profiler.summary(window=None) for name, profiler in profilers.items()},
+                'records': records,
+            }, f, indent=2, ensure_ascii=False)
+        return
+
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    with open(file_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns or ['series', 'step', 'timestamp'], restval='')
+        writer.writeheader()
+        writer.writerows(records)
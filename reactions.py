@@ -0,0 +1,116 @@
+from collections import namedtuple
+
+import numpy as np
+
+from event_log import EVENT_TYPE_CODES
+
+
+# 一条双粒子反应规则: inputs 为两个粒子类型名 (无序); outputs 为 (产物类型, 事件类型, 份额) 的元组,
+# 份额之和为 1, 按第二列随机数选择其中一个; probability 为接受概率在模拟状态中的键;
+# distance 为反应距离相对 interaction_distance 的倍数
+ReactionRule = namedtuple('ReactionRule', ['inputs', 'outputs', 'probability', 'distance'])
+
+REACTION_RULES = (
+    ReactionRule(('HYDROGEN', 'HYDROGEN'), (('HYDROGEN', 'nuclear_fusion', 1.0),), 'fusion_probability', 1.0),
+    ReactionRule(('HYDROGEN', 'HELIUM'), (('HELIUM', 'nuclear_fusion', 1.0),), 'fusion_probability', 1.0),
+    ReactionRule(('HELIUM', 'HELIUM'), (('HELIUM', 'nuclear_fusion', 1.0),), 'fusion_probability', 1.0),
+    # 结构形成: 气体落入暗物质晕形成恒星, 恒星聚集成星系, 致密的恒星对和星系并合形成黑洞
+    ReactionRule(('HELIUM', 'DARK_MATTER'), (('STAR', 'star_formation', 1.0),),
+                 'structure_formation_probability', 1.0),
+    ReactionRule(('STAR', 'DARK_MATTER'), (('GALAXY', 'galaxy_formation', 1.0),),
+                 'structure_formation_probability', 1.0),
+    ReactionRule(('STAR', 'STAR'),
+                 (('GALAXY', 'galaxy_formation', 0.95), ('BLACK_HOLE', 'black_hole_formation', 0.05)),
+                 'structure_formation_probability', 1.0),
+    ReactionRule(('GALAXY', 'GALAXY'), (('BLACK_HOLE', 'black_hole_formation', 1.0),),
+                 'structure_formation_probability', 0.5),
+)
+
+
+class ReactionError(ValueError):
+    """反应表中的规则无效"""
+
+
+class ReactionTable:
+    """把 ReactionRule 列表编译为按整数类型码索引的查找数组
+
+    rule_of[type_i, type_j] 为两类粒子之间的规则编号 (对称, 没有规则时为 -1), 候选对的
+    接受判定与产物选择都是对这些数组的整体索引, 规则数量不影响每个候选对的开销.
+    """
+
+    def __init__(self, rules, particle_types):
+        codes = {p_type: code for code, p_type in enumerate(particle_types)}
+        self.rules = tuple(rules)
+        self.rule_of = np.full((len(particle_types), len(particle_types)), -1, dtype=np.int64)
+        width = max((len(rule.outputs) for rule in self.rules), default=1)
+        self.product_types = np.zeros((len(self.rules), width), dtype=np.int16)
+        self.product_events = np.zeros((len(self.rules), width), dtype=np.int8)
+        # 累计份额, 最后一个产物 (及补位) 取 inf, 保证每个随机数都落在某个产物上
+        self.cumulative_shares = np.full((len(self.rules), width), np.inf)
+        self.distance_scale = np.ones(len(self.rules), dtype=np.float64)
+        self.probability_keys = tuple(rule.probability for rule in self.rules)
+        self.input_codes = np.zeros((len(self.rules), 2), dtype=np.int16)
+
+        for number, rule in enumerate(self.rules):
+            if len(rule.inputs) != 2:
+                raise ReactionError(f"反应规则只支持两个输入粒子: {rule.inputs}")
+            unknown = [name for name in rule.inputs + tuple(out[0] for out in rule.outputs) if name not in codes]
+            if unknown:
+                raise ReactionError(f"未知的粒子类型: {unknown}")
+            if not rule.outputs:
+                raise ReactionError(f"反应规则没有产物: {rule.inputs}")
+            events = [out[1] for out in rule.outputs if out[1] not in EVENT_TYPE_CODES]
+            if events:
+                raise ReactionError(f"未知的事件类型: {events}")
+            shares = np.array([out[2] for out in rule.outputs], dtype=np.float64)
+            if np.any(shares < 0) or not np.isclose(shares.sum(), 1.0):
+                raise ReactionError(f"产物份额之和必须为 1: {rule.inputs}")
+            if not rule.distance > 0:
+                raise ReactionError(f"反应距离倍数必须为正: {rule.inputs}")
+            a, b = codes[rule.inputs[0]], codes[rule.inputs[1]]
+            if self.rule_of[a, b] >= 0:
+                raise ReactionError(f"重复的反应规则: {rule.inputs}")
+            self.rule_of[a, b] = self.rule_of[b, a] = number
+            self.input_codes[number] = (a, b)
+
+            for slot in range(width):
+                product, event_type, _ = rule.outputs[min(slot, len(rule.outputs) - 1)]
+                self.product_types[number, slot] = codes[product]
+                self.product_events[number, slot] = EVENT_TYPE_CODES[event_type]
+            self.cumulative_shares[number, :len(rule.outputs) - 1] = np.cumsum(shares)[:-1]
+            self.distance_scale[number] = rule.distance
+
+        self.max_distance_scale = float(self.distance_scale.max(initial=1.0))
+
+    def reach(self, state):
+        """全部规则中最大的反应距离, 即候选对的搜索半径"""
+        return state['interaction_distance'] * self.max_distance_scale
+
+    def probabilities(self, state):
+        """各规则的接受概率, 末尾追加 0 对应没有规则的粒子对 (编号 -1)"""
+        return np.array([float(state[key]) for key in self.probability_keys] + [0.0], dtype=np.float64)
+
+    def active_types(self, state):
+        """按类型码给出当前接受概率大于 0 的规则涉及的粒子类型"""
+        active = np.zeros(len(self.rule_of), dtype=bool)
+        live = self.probabilities(state)[:-1] > 0
+        active[self.input_codes[live].ravel()] = True
+        return active
+
+    def accept(self, state, rules, rolls, pair_distances=None):
+        """候选对是否发生反应: 随机数小于规则的概率, 且距离不超过规则自身的反应距离
+
+        pair_distances(rows) 返回 rows 中候选对的距离; 只有反应距离小于搜索半径的规则
+        才需要再比较一次, 因此只对这些规则下已被接受的候选对求距离. 为 None 时不检查距离.
+        """
+        accepted = rolls < self.probabilities(state)[rules]
+        if pair_distances is not None and self.distance_scale.min(initial=1.0) < self.max_distance_scale:
+            limits = np.append(self.distance_scale * state['interaction_distance'], np.inf)[rules]
+            check = np.flatnonzero(accepted & (limits < self.reach(state)))
+            accepted[check] = pair_distances(check) <= limits[check]
+        return accepted
+
+    def products(self, rules, rolls):
+        """选中反应的产物类型码与事件类型码; rolls 在 [0, 1) 内, 按累计份额选择产物"""
+        choice = (rolls[:, np.newaxis] >= self.cumulative_shares[rules]).sum(axis=1)
+        return self.product_types[rules, choice], self.product_events[rules, choice]
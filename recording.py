@@ -0,0 +1,473 @@
+import bisect
+import json
+import queue
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from cosmic_engine import (COSMOS_SIMULATOR_TYPE, DEFAULT_TRAIL_LENGTH, PARTICLE_TYPES, TYPE_MASS,
+                           build_cosmos_config, cosmic_age_gyr)
+from event_log import EVENT_DTYPE, EVENT_TYPES, compatible_event_types
+from lod import PointLOD
+from simulation_worker import Snapshot, render_arrays
+
+
+RECORDING_MAGIC = b'COSMRCRD'
+RECORDING_VERSION = 1
+RECORDING_SUFFIX = '.cosmosrec'
+# 文件头与检查点相同: 魔数, 版本, JSON 索引的偏移和长度; 录制正常结束时才写入索引
+_PREFIX = struct.Struct('<8sIQQ')
+# 块头: 魔数, 首帧帧号, 帧数, 压缩数据长度; 没有索引时 (录制中断) 靠块头顺序扫描恢复
+_CHUNK_PREFIX = struct.Struct('<4sQIQ')
+CHUNK_MAGIC = b'CHNK'
+# 每个块的第一帧是关键帧; 粒子很多时按 MAX_CHUNK_BYTES 提前结束一个块, 解码一个块的内存占用有界
+DEFAULT_KEYFRAME_INTERVAL = 32
+MAX_CHUNK_BYTES = 16 << 20
+# 坐标按 ±2 * max_position 量化为 int16, 覆盖界面的显示范围 (|r| < 20)
+POSITION_LEVELS = 32767
+# 回放时缓存的已解码块数
+REPLAY_CACHE_CHUNKS = 4
+# 回放 1 倍速对应的每秒帧数 (与界面速度 1 时的物理子步频率相同)
+REPLAY_FRAMES_PER_SECOND = 20.0
+
+
+class RecordingError(ValueError):
+    """录像文件损坏或格式不符"""
+
+
+def _pack_arrays(arrays):
+    # 数值数组按字节重排 (同一字节位的字节相邻) 后再压缩, 缓慢变化的坐标和差分压缩率更高
+    meta = {}
+    parts = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype == EVENT_DTYPE:
+            dtype, raw = 'event', array.tobytes()
+        else:
+            dtype = array.dtype.str
+            raw = array.view(np.uint8).reshape(-1, array.itemsize).T.tobytes()
+        meta[name] = [dtype, list(array.shape), offset, len(raw)]
+        parts.append(raw)
+        offset += len(raw)
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    return zlib.compress(struct.pack('<I', len(meta_bytes)) + meta_bytes + b''.join(parts), 6)
+
+
+def _unpack_arrays(payload):
+    try:
+        data = zlib.decompress(payload)
+        (meta_length,) = struct.unpack_from('<I', data)
+        meta = json.loads(data[4:4 + meta_length].decode('utf-8'))
+    except (zlib.error, struct.error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise RecordingError(f"录像数据块损坏: {e}") from e
+    body = memoryview(data)[4 + meta_length:]
+    arrays = {}
+    for name, (dtype, shape, offset, length) in meta.items():
+        raw = body[offset:offset + length]
+        if dtype == 'event':
+            arrays[name] = np.frombuffer(raw, dtype=EVENT_DTYPE).reshape(shape)
+        else:
+            dtype = np.dtype(dtype)
+            shuffled = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1)
+            arrays[name] = np.ascontiguousarray(shuffled.T).view(dtype).reshape(shape)
+    return arrays
+
+
+def _matched_reference(previous_ids, previous_positions, ids):
+    # 按粒子编号取上一帧的量化坐标, 上一帧没有的粒子取 0 (即存绝对坐标)
+    reference = np.zeros((len(ids), 3), dtype=np.int16)
+    if len(previous_ids) and len(ids):
+        order = np.argsort(previous_ids, kind='stable')
+        slot = np.minimum(np.searchsorted(previous_ids, ids, sorter=order), len(previous_ids) - 1)
+        found = previous_ids[order[slot]] == ids
+        reference[found] = previous_positions[order[slot[found]]]
+    return reference
+
+
+def quantize_positions(positions, scale):
+    """把坐标量化为 int16; 误差不超过 scale / (2 * POSITION_LEVELS), 非有限值与范围外的坐标截断到边界"""
+    scaled = np.nan_to_num(np.asarray(positions, dtype=np.float64) / scale, nan=1.0, posinf=1.0, neginf=-1.0)
+    return np.rint(np.clip(scaled, -1.0, 1.0) * POSITION_LEVELS).astype(np.int16)
+
+
+def encode_chunk(frames, scale):
+    """把连续的若干帧编码为一个块: 第一帧完整存储, 之后每帧只存与上一帧同一粒子的坐标差
+
+    粒子集合 (编号与类型) 只在与上一帧不同时存储; 坐标差在 int16 上回绕相减, 解码时回绕相加还原.
+    """
+    changed = np.ones(len(frames), dtype=np.bool_)
+    id_parts, type_parts, position_parts, event_parts, event_frames = [], [], [], [], []
+    previous = None
+    for k, frame in enumerate(frames):
+        ids, positions = frame['ids'], frame['positions']
+        if previous is not None and np.array_equal(ids, previous['ids']):
+            changed[k] = False
+            positions = positions - previous['positions']
+        else:
+            id_parts.append(ids)
+            type_parts.append(frame['types'])
+            if previous is not None:
+                positions = positions - _matched_reference(previous['ids'], previous['positions'], ids)
+        position_parts.append(positions)
+        event_parts.append(frame['events'])
+        event_frames.append(np.full(len(frame['events']), k, dtype=np.int32))
+        previous = frame
+
+    return _pack_arrays({
+        'scale': np.array([scale], dtype=np.float64),
+        'time': np.array([frame['time'] for frame in frames], dtype=np.float64),
+        'cosmic_age': np.array([frame['cosmic_age'] for frame in frames], dtype=np.float64),
+        'scale_factor': np.array([frame['scale_factor'] for frame in frames], dtype=np.float64),
+        'event_total': np.array([frame['event_total'] for frame in frames], dtype=np.int64),
+        'counts': np.array([len(frame['ids']) for frame in frames], dtype=np.int64),
+        'changed': changed,
+        'ids': np.concatenate(id_parts),
+        'types': np.concatenate(type_parts),
+        'positions': np.concatenate(position_parts),
+        'events': np.concatenate(event_parts),
+        'event_frame': np.concatenate(event_frames),
+    })
+
+
+def decode_chunk(payload):
+    """encode_chunk 的逆过程, 返回 {'frames': [{ids, types, positions(int16)}...], 逐帧标量列, 事件}"""
+    arrays = _unpack_arrays(payload)
+    counts = arrays['counts']
+    frames = []
+    id_start = position_start = 0
+    previous = None
+    for count, changed in zip(counts.tolist(), arrays['changed'].tolist()):
+        positions = arrays['positions'][position_start:position_start + count]
+        position_start += count
+        if changed:
+            ids = arrays['ids'][id_start:id_start + count]
+            types = arrays['types'][id_start:id_start + count]
+            id_start += count
+            if previous is not None:
+                positions = positions + _matched_reference(previous['ids'], previous['positions'], ids)
+        else:
+            ids, types = previous['ids'], previous['types']
+            positions = positions + previous['positions']
+        previous = {'ids': ids, 'types': types, 'positions': positions}
+        frames.append(previous)
+    return {
+        'frames': frames,
+        'scale': float(arrays['scale'][0]),
+        'time': arrays['time'],
+        'cosmic_age': arrays['cosmic_age'],
+        'scale_factor': arrays['scale_factor'],
+        'event_total': arrays['event_total'],
+        'events': arrays['events'],
+        'event_frame': arrays['event_frame'],
+    }
+
+
+class RunRecorder:
+    """把每个物理子步的粒子坐标, 类型和新增事件流式写入分块压缩的录像文件
+
+    capture 在物理线程中每步调用一次, 只拷贝并量化坐标; 编码, 压缩和写盘在后台线程中进行,
+    待写的块超过 max_pending 个时 capture 等待写盘, 内存占用有界.
+    close 写入帧索引; 录制中断的文件没有索引, 读取时扫描块头恢复.
+    """
+
+    def __init__(self, file_path, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, max_chunk_bytes=MAX_CHUNK_BYTES,
+                 max_pending=4):
+        self.file_path = file_path
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+        self.max_chunk_bytes = max_chunk_bytes
+        self.frame_count = 0
+        self.error = None
+        self._frames = []
+        self._frame_bytes = 0
+        self._config = None
+        self._scale = None
+        self._event_total = 0
+        self._chunks = []
+        self._file = open(file_path, 'wb')
+        self._file.write(_PREFIX.pack(RECORDING_MAGIC, RECORDING_VERSION, 0, 0))
+        self._pending = queue.Queue(maxsize=max(int(max_pending), 1))
+        self._writer = threading.Thread(target=self._write_loop, name='recording-writer', daemon=True)
+        self._writer.start()
+        self._closed = False
+
+    def capture(self, state):
+        """记录 state 的当前帧"""
+        if self._closed:
+            return
+        events = state['interaction_events']
+        if self._config is None:
+            self._config = build_cosmos_config(state)
+            self._scale = 2.0 * float(state['max_position'])
+            self._event_total = len(events)
+        store = state['particles']
+        event_total = len(events)
+        # 重置或读回检查点后事件日志从头开始
+        new_events = event_total - self._event_total if event_total >= self._event_total else event_total
+        self._event_total = event_total
+
+        self._frames.append({
+            'ids': store.particle_id.copy(),
+            'types': store.type_code.copy(),
+            'positions': quantize_positions(store.position, self._scale),
+            'time': state['time'],
+            'cosmic_age': cosmic_age_gyr(state),
+            'scale_factor': state['scale_factor'],
+            'event_total': event_total,
+            'events': events.recent(new_events) if new_events else np.zeros(0, dtype=EVENT_DTYPE),
+        })
+        self.frame_count += 1
+        self._frame_bytes += len(store) * 16
+        if len(self._frames) >= self.keyframe_interval or self._frame_bytes >= self.max_chunk_bytes:
+            self._flush()
+
+    def _flush(self):
+        if self._frames:
+            self._pending.put((self.frame_count - len(self._frames), self._frames))
+            self._frames = []
+            self._frame_bytes = 0
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            first_frame, frames = item
+            try:
+                payload = encode_chunk(frames, self._scale)
+                offset = self._file.tell()
+                self._file.write(_CHUNK_PREFIX.pack(CHUNK_MAGIC, first_frame, len(frames), len(payload)))
+                self._file.write(payload)
+                self._chunks.append([offset, first_frame, len(frames)])
+            except OSError as e:
+                self.error = e
+
+    def close(self):
+        """写完剩余的帧和索引并关闭文件; 返回写盘时遇到的 OSError, 没有则为 None"""
+        if self._closed:
+            return self.error
+        self._closed = True
+        self._flush()
+        self._pending.put(None)
+        self._writer.join()
+        try:
+            if self.error is None:
+                header = {
+                    'simulator_type': COSMOS_SIMULATOR_TYPE,
+                    'particle_types': list(PARTICLE_TYPES),
+                    'event_types': list(EVENT_TYPES),
+                    'position_scale': self._scale,
+                    'frame_count': self.frame_count,
+                    'config': self._config,
+                    'chunks': self._chunks,
+                }
+                header_bytes = json.dumps(header).encode('utf-8')
+                header_offset = self._file.tell()
+                self._file.write(header_bytes)
+                self._file.seek(0)
+                self._file.write(_PREFIX.pack(RECORDING_MAGIC, RECORDING_VERSION, header_offset, len(header_bytes)))
+        except OSError as e:
+            self.error = e
+        finally:
+            self._file.close()
+        return self.error
+
+    def close_in_background(self, on_done=None):
+        """在后台线程中 close; 完成后调用 on_done(file_path, error)"""
+        def finish():
+            error = self.close()
+            if on_done is not None:
+                on_done(self.file_path, error)
+
+        thread = threading.Thread(target=finish, name='recording-closer', daemon=True)
+        thread.start()
+        return thread
+
+
+class RecordingReader:
+    """按帧随机访问录像文件; 只读取并解码所请求的帧所在的块, 最近用过的块缓存在内存中"""
+
+    def __init__(self, file_path, cache_chunks=REPLAY_CACHE_CHUNKS):
+        self.file_path = file_path
+        self.cache_chunks = max(int(cache_chunks), 1)
+        self.chunks_read = 0
+        self._cache = OrderedDict()
+        self._file = open(file_path, 'rb')
+        try:
+            self._read_index()
+        except Exception:
+            self._file.close()
+            raise
+        self._first_frames = [first for _, first, _ in self._chunks]
+
+    def _read_index(self):
+        prefix = self._file.read(_PREFIX.size)
+        if len(prefix) != _PREFIX.size:
+            raise RecordingError("录像文件不完整")
+        magic, version, header_offset, header_length = _PREFIX.unpack(prefix)
+        if magic != RECORDING_MAGIC:
+            raise RecordingError("这不是宇宙模拟器录像文件")
+        if version != RECORDING_VERSION:
+            raise RecordingError(f"不支持的录像版本: {version}")
+        if not header_offset:
+            self._scan_chunks()
+            return
+        self._file.seek(header_offset)
+        try:
+            header = json.loads(self._file.read(header_length).decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise RecordingError(f"录像文件索引损坏: {e}") from e
+        if (header.get('particle_types') != list(PARTICLE_TYPES) or
+                not compatible_event_types(header.get('event_types'))):
+            raise RecordingError("录像中的粒子或事件类型与当前版本不一致")
+        self.config = header['config'] or {}
+        self.frame_count = header['frame_count']
+        self._chunks = [tuple(entry) for entry in header['chunks']]
+
+    def _scan_chunks(self):
+        # 录制没有正常结束: 顺序读取块头, 截断在最后一个完整的块
+        self.config = {}
+        self._chunks = []
+        self.frame_count = 0
+        offset = _PREFIX.size
+        while True:
+            self._file.seek(offset)
+            prefix = self._file.read(_CHUNK_PREFIX.size)
+            if len(prefix) != _CHUNK_PREFIX.size:
+                break
+            magic, first_frame, count, length = _CHUNK_PREFIX.unpack(prefix)
+            if magic != CHUNK_MAGIC or first_frame != self.frame_count:
+                break
+            if len(self._file.read(length)) != length:
+                break
+            self._chunks.append((offset, first_frame, count))
+            self.frame_count += count
+            offset += _CHUNK_PREFIX.size + length
+
+    def __len__(self):
+        return self.frame_count
+
+    def _chunk(self, position):
+        if position in self._cache:
+            self._cache.move_to_end(position)
+            return self._cache[position]
+        offset, _, _ = self._chunks[position]
+        self._file.seek(offset)
+        _, _, _, length = _CHUNK_PREFIX.unpack(self._file.read(_CHUNK_PREFIX.size))
+        chunk = decode_chunk(self._file.read(length))
+        self.chunks_read += 1
+        self._cache[position] = chunk
+        while len(self._cache) > self.cache_chunks:
+            self._cache.popitem(last=False)
+        return chunk
+
+    def _locate(self, index):
+        if not 0 <= index < self.frame_count:
+            raise IndexError(f"帧号超出范围: {index}")
+        position = bisect.bisect_right(self._first_frames, index) - 1
+        return self._chunk(position), index - self._first_frames[position]
+
+    def frame(self, index):
+        """第 index 帧: 粒子编号, 类型码, 坐标 (float32) 以及时间, 宇宙年龄, 尺度因子和累计事件数"""
+        chunk, local = self._locate(index)
+        frame = chunk['frames'][local]
+        return {
+            'ids': frame['ids'],
+            'types': frame['types'],
+            'positions': frame['positions'].astype(np.float32) * np.float32(chunk['scale'] / POSITION_LEVELS),
+            'time': float(chunk['time'][local]),
+            'cosmic_age': float(chunk['cosmic_age'][local]),
+            'scale_factor': float(chunk['scale_factor'][local]),
+            'event_total': int(chunk['event_total'][local]),
+        }
+
+    def trails(self, index, ids, length):
+        """ids 在第 index 帧之前 (含) 最多 length 帧的轨迹, 格式同 ordered_trails: (M, length, 3) 与有效点数
+
+        有效点数是粒子从第 index 帧往前连续出现的帧数, 有效点位于每行末尾.
+        """
+        trails = np.zeros((len(ids), length, 3), dtype=np.float32)
+        counts = np.zeros(len(ids), dtype=np.int64)
+        alive = np.ones(len(ids), dtype=np.bool_)
+        for back in range(min(length, index + 1)):
+            chunk, local = self._locate(index - back)
+            frame = chunk['frames'][local]
+            order = np.argsort(frame['ids'], kind='stable')
+            slot = np.minimum(np.searchsorted(frame['ids'], ids, sorter=order), max(len(order) - 1, 0))
+            if len(order):
+                alive &= frame['ids'][order[slot]] == ids
+            else:
+                alive[:] = False
+            if not alive.any():
+                break
+            rows = order[slot[alive]]
+            trails[alive, length - 1 - back] = frame['positions'][rows] * np.float32(chunk['scale'] / POSITION_LEVELS)
+            counts += alive
+        return trails, counts
+
+    def events(self, start, stop):
+        """第 start 到 stop - 1 帧之间新增的事件 (EVENT_DTYPE)"""
+        parts = []
+        start, stop = max(start, 0), min(stop, self.frame_count)
+        for position in range(max(bisect.bisect_right(self._first_frames, start) - 1, 0), len(self._chunks)):
+            _, first, count = self._chunks[position]
+            if first >= stop:
+                break
+            chunk = self._chunk(position)
+            local = chunk['event_frame'] + first
+            parts.append(chunk['events'][(local >= start) & (local < stop)])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=EVENT_DTYPE)
+
+    def close(self):
+        self._cache.clear()
+        self._file.close()
+
+
+class ReplayPlayer:
+    """由录像的某一帧生成与实时模拟相同的渲染快照
+
+    开销只取决于该帧的粒子数和轨迹长度, 与原始模拟所用的引力求解器和积分器无关.
+    """
+
+    def __init__(self, reader, trail_length=None):
+        self.reader = reader
+        self.trail_length = trail_length or reader.config.get('trail_length', DEFAULT_TRAIL_LENGTH)
+        self.lod = PointLOD()
+        self.eye = (0.0, 0.0, 20.0)
+
+    def set_view(self, eye, point_budget):
+        self.eye = tuple(float(v) for v in eye)
+        self.lod.budget = int(point_budget)
+
+    def snapshot(self, index):
+        frame = self.reader.frame(index)
+        ids = frame['ids']
+
+        def trail_source(rows):
+            return self.reader.trails(index, ids[rows], self.trail_length)
+
+        positions, colors, sizes, trail_vertices, trail_colors, impostor_count = render_arrays(
+            frame['positions'], frame['types'], TYPE_MASS[frame['types']], trail_source, self.lod, self.eye)
+        return Snapshot(
+            frame=index,
+            positions=positions,
+            colors=colors,
+            sizes=sizes,
+            trail_vertices=trail_vertices,
+            trail_colors=trail_colors,
+            time=frame['time'],
+            cosmic_age=frame['cosmic_age'],
+            scale_factor=frame['scale_factor'],
+            particle_count=len(ids),
+            event_count=frame['event_total'],
+            impostor_count=impostor_count,
+            stats=None,
+        )
+
+    def close(self):
+        self.reader.close()
@@ -0,0 +1,302 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from checkpoint import save_checkpoint_in_background
+from cosmic_engine import (TYPE_COLOR, initialize_simulator_state, initialize_particles, physics_step,
+                           cosmic_age_gyr, ordered_trails, set_trail_length)
+from cosmic_stats import CosmicStats
+from lod import PointLOD, point_sizes
+from profiling import PhaseProfiler
+
+
+Snapshot = namedtuple('Snapshot', [
+    'frame',
+    'positions',
+    'colors',
+    'sizes',
+    'trail_vertices',
+    'trail_colors',
+    'time',
+    'cosmic_age',
+    'scale_factor',
+    'particle_count',
+    'event_count',
+    'impostor_count',
+    'stats',
+])
+
+
+def _frozen(array):
+    array.flags.writeable = False
+    return array
+
+
+def trail_segments(trails, counts, colors):
+    """把轨迹展开成 mode='lines' 的线段端点对 (2M, 3) 与逐顶点颜色 (2M, 4)
+
+    trails 为按时间顺序 (旧 -> 新) 的轨迹 (N, L, 3), 每行最后 counts 个点有效 (见 ordered_trails);
+    每条轨迹的 k 个有效点给出 k - 1 段, 所有粒子的轨迹合并为一个顶点数组;
+    含非有限值或超出显示范围的轨迹整条丢弃.
+    """
+    counts = counts.astype(np.intp)
+    trail_length = trails.shape[1]
+    if not len(trails) or trail_length < 2:
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 4), dtype=np.float32)
+
+    # 有效点是每行最后 count 个
+    valid = np.arange(trail_length) >= (trail_length - counts)[:, np.newaxis]
+    in_range = np.all(np.isfinite(trails) & (np.abs(trails) < 25.0), axis=2)
+    keep = (counts >= 2) & np.all(in_range | ~valid, axis=1)
+
+    segment_valid = valid[keep, :-1]
+    starts = trails[keep, :-1][segment_valid]
+    ends = trails[keep, 1:][segment_valid]
+    vertices = np.empty((2 * len(starts), 3), dtype=np.float32)
+    vertices[0::2] = starts
+    vertices[1::2] = ends
+
+    segment_colors = np.repeat(colors[keep], counts[keep] - 1, axis=0)
+    vertex_colors = np.repeat(segment_colors, 2, axis=0).astype(np.float32)
+    return vertices, vertex_colors
+
+
+def render_arrays(positions, type_codes, masses, trail_source, lod=None, eye=(0.0, 0.0, 20.0)):
+    """可见粒子的只读绘制数据 (positions, colors, sizes, trail_vertices, trail_colors, impostor_count)
+
+    trail_source(rows) 返回这些行按时间顺序的轨迹与有效点数. 给出 lod (PointLOD) 时按相机位置 eye
+    把超出点数预算的粒子聚合为替身点, 轨迹只为单独绘制的粒子生成.
+    """
+    visible = np.flatnonzero(np.all(np.isfinite(positions), axis=1) &
+                             (np.linalg.norm(positions, axis=1) < 20.0))
+    positions = positions[visible]
+    colors = TYPE_COLOR[type_codes[visible]]
+    sizes = point_sizes(masses[visible])
+    impostor_count = 0
+    trail_rows, trail_row_colors = visible, colors
+    if lod is not None:
+        positions, colors, sizes, single_rows, impostor_count = lod.reduce(positions, colors, sizes, eye)
+        if impostor_count:
+            trail_rows, trail_row_colors = visible[single_rows], colors[:len(single_rows)]
+
+    trail_vertices, trail_colors = trail_segments(*trail_source(trail_rows), trail_row_colors)
+    return (_frozen(np.ascontiguousarray(positions, dtype=np.float32)), _frozen(colors), _frozen(sizes),
+            _frozen(trail_vertices), _frozen(trail_colors), impostor_count)
+
+
+def take_snapshot(state, frame, lod=None, eye=(0.0, 0.0, 20.0)):
+    """从状态中拷贝出渲染所需的只读数据; 快照发布后不再被物理线程修改"""
+    store = state['particles']
+    positions, colors, sizes, trail_vertices, trail_colors, impostor_count = render_arrays(
+        store.position, store.type_code, store.mass, lambda rows: ordered_trails(state, rows), lod, eye)
+    stats = state.get('stats')
+
+    return Snapshot(
+        frame=frame,
+        positions=positions,
+        colors=colors,
+        sizes=sizes,
+        trail_vertices=trail_vertices,
+        trail_colors=trail_colors,
+        time=state['time'],
+        cosmic_age=cosmic_age_gyr(state),
+        scale_factor=state['scale_factor'],
+        particle_count=len(store),
+        event_count=len(state['interaction_events']),
+        impostor_count=impostor_count,
+        # 累计统计量 (CosmicStats.totals), 状态未挂接统计时为 None
+        stats=None if stats is None else stats.totals(),
+    )
+
+
+class SnapshotBuffer:
+    """双缓冲: 写端总是写入后台槽位再翻转, 读端总是拿到最近一次完整发布的快照"""
+
+    def __init__(self):
+        self._slots = [None, None]
+        self._front = 0
+        self._lock = threading.Lock()
+
+    def publish(self, snapshot):
+        back = 1 - self._front
+        self._slots[back] = snapshot
+        with self._lock:
+            self._front = back
+
+    def latest(self):
+        with self._lock:
+            return self._slots[self._front]
+
+
+class SimulationWorker(threading.Thread):
+    """在独立线程中推进物理并发布快照
+
+    state 只由该线程读写; 界面线程通过 resume / pause / reset / set_params /
+    set_speed / start_recording 等投递命令, 命令在两个物理子步之间按顺序执行.
+    """
+
+    def __init__(self, state, speed=5):
+        super().__init__(name='physics-worker', daemon=True)
+        self.state = state
+        # 物理线程的分阶段计时, 界面线程只读取其统计
+        self.profiler = PhaseProfiler()
+        state['profiler'] = self.profiler
+        # 累计统计与降采样历史, 界面线程通过 stats.series() 读取历史
+        self.stats = CosmicStats()
+        state['stats'] = self.stats
+        self.stats.rebuild(state)
+        self.snapshots = SnapshotBuffer()
+        self._commands = queue.Queue()
+        self._running = False
+        self._speed = speed
+        # 点数细节层次, 相机位置由界面线程通过 set_view 更新
+        self.lod = PointLOD()
+        self._eye = (0.0, 0.0, 20.0)
+        self._frame = 0
+        self._checkpoint_writer = None
+        # 录制时每个物理子步之后记录一帧 (recording.RunRecorder)
+        self._recorder = None
+        self._next_tick = time.perf_counter()
+        self._publish()
+
+    # ---- 界面线程调用的接口 ----
+
+    def resume(self):
+        self._commands.put(('resume', None))
+
+    def pause(self):
+        self._commands.put(('pause', None))
+
+    def reset(self, params):
+        """用 params 覆盖默认参数重新初始化宇宙, 并回到暂停状态"""
+        self._commands.put(('reset', dict(params)))
+
+    def set_params(self, **params):
+        self._commands.put(('params', params))
+
+    def set_speed(self, speed):
+        self._commands.put(('speed', speed))
+
+    def set_view(self, eye, point_budget):
+        """更新相机位置和绘制点数上限; 暂停时立即按新视角重新发布快照"""
+        self._commands.put(('view', (tuple(eye), int(point_budget))))
+
+    def save_checkpoint(self, file_path, on_done=None):
+        """在两个子步之间拷贝状态并在后台写盘, 完成后在写盘线程中调用 on_done(file_path, error)"""
+        self._commands.put(('checkpoint', (file_path, on_done)))
+
+    def start_recording(self, recorder):
+        """从当前帧起把每个物理子步交给 recorder.capture 记录; 已在录制时先结束之前的录像"""
+        self._commands.put(('record', recorder))
+
+    def stop_recording(self, on_done=None):
+        """结束录制, 在后台写完剩余数据后调用 on_done(file_path, error)"""
+        self._commands.put(('stop_record', on_done))
+
+    def load_state(self, state):
+        """用读回的检查点状态替换当前状态, 并回到暂停状态"""
+        self._commands.put(('load', state))
+
+    def stop(self):
+        self._commands.put(('stop', None))
+        if self.is_alive():
+            self.join()
+
+    def latest_snapshot(self):
+        return self.snapshots.latest()
+
+    # ---- 物理线程 ----
+
+    def _publish(self):
+        self._frame += 1
+        # 快照耗时计入下一个物理子步的记录
+        with self.profiler.phase('snapshot'):
+            self.snapshots.publish(take_snapshot(self.state, self._frame, self.lod, self._eye))
+
+    def _tick_interval(self):
+        # 与原先 QTimer 的 50 // speed 毫秒节拍一致
+        return (50 // self._speed) / 1000.0
+
+    def _wait_for_checkpoint(self):
+        # 替换或丢弃状态前等待写盘完成, 写盘线程可能仍在读取旧事件日志的落盘块
+        if self._checkpoint_writer is not None:
+            self._checkpoint_writer.join()
+            self._checkpoint_writer = None
+
+    def _replace_state(self, state):
+        self._running = False
+        self._wait_for_checkpoint()
+        self.state['interaction_events'].close()
+        state['profiler'] = self.profiler
+        state['stats'] = self.stats
+        self.stats.rebuild(state)
+        self.state = state
+        if self._recorder is not None:
+            self._recorder.capture(state)
+        self._publish()
+
+    def _handle(self, command, payload):
+        if command == 'resume':
+            self._running = True
+            self._next_tick = time.perf_counter()
+        elif command == 'pause':
+            self._running = False
+        elif command == 'speed':
+            self._speed = payload
+        elif command == 'params':
+            payload = dict(payload)
+            if 'trail_length' in payload:
+                set_trail_length(self.state, payload.pop('trail_length'))
+            self.state.update(payload)
+        elif command == 'reset':
+            state = initialize_simulator_state()
+            state.update(payload)
+            initialize_particles(state)
+            self._replace_state(state)
+        elif command == 'load':
+            self._replace_state(payload)
+        elif command == 'view':
+            self._eye, self.lod.budget = payload
+            if not self._running:
+                self._publish()
+        elif command == 'checkpoint':
+            file_path, on_done = payload
+            self._wait_for_checkpoint()
+            self._checkpoint_writer = save_checkpoint_in_background(file_path, self.state, on_done)
+        elif command == 'record':
+            if self._recorder is not None:
+                self._recorder.close_in_background()
+            self._recorder = payload
+            self._recorder.capture(self.state)
+        elif command == 'stop_record':
+            if self._recorder is not None:
+                self._recorder.close_in_background(payload)
+                self._recorder = None
+        elif command == 'stop':
+            self._wait_for_checkpoint()
+            if self._recorder is not None:
+                self._recorder.close()
+            return False
+        return True
+
+    def run(self):
+        while True:
+            timeout = max(0.0, self._next_tick - time.perf_counter()) if self._running else None
+            try:
+                command, payload = self._commands.get(timeout=timeout)
+            except queue.Empty:
+                command = None
+            if command is not None:
+                if not self._handle(command, payload):
+                    return
+                continue
+
+            for _ in range(min(self._speed, 2)):
+                physics_step(self.state)
+                if self._recorder is not None:
+                    self._recorder.capture(self.state)
+            self._publish()
+            self._next_tick = max(self._next_tick + self._tick_interval(), time.perf_counter())
@@ -0,0 +1,207 @@
+import math
+
+import numpy as np
+
+from parallel import ordered_map
+
+
+# 单批生成的候选粒子对上限, 控制内存峰值 (多线程时为每个线程的峰值)
+MAX_CANDIDATE_PAIRS = 1 << 20
+
+
+def expand_ranges(starts, counts):
+    """把若干 [start, start + count) 区间拼接成一个下标数组"""
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(np.asarray(starts, dtype=np.int64), counts) + (np.arange(total) - offsets)
+
+
+class CellList:
+    """覆盖 [-half_width, half_width]^3 的均匀网格邻居索引 (cell-linked list)
+
+    粒子按所在网格排序, 每个网格对应排序数组中的一段. 查询半径 R 内的粒子对时
+    只需检查网格距离小于 R 的网格对, 代价随局部密度而不是 N^2 增长.
+    盒子外的粒子归入边界网格, 不会漏掉.
+    skin 用于建立后仍在移动的粒子: 只要每个粒子离开建索引时的位置不超过 skin / 2,
+    按 radius + skin 查出的候选对就包含当前位置下距离小于 radius 的全部粒子对.
+    """
+
+    def __init__(self, positions, cell_size, half_width, skin=0.0):
+        positions = np.asarray(positions, dtype=np.float64)
+        self.positions = positions
+        self.cell_size = float(cell_size)
+        self.half_width = float(half_width)
+        self.skin = float(skin)
+        self.dims = max(1, int(math.ceil(2 * self.half_width / self.cell_size)))
+        # 统计计数, 由 subset 得到的视图共享同一个字典
+        self.stats = {'pairs_tested': 0}
+
+        valid = np.all(np.isfinite(positions), axis=1)
+        coords = np.zeros((len(positions), 3), dtype=np.int64)
+        coords[valid] = np.clip(np.floor((positions[valid] + self.half_width) / self.cell_size),
+                                0, self.dims - 1).astype(np.int64)
+        cell_id = (coords[:, 0] * self.dims + coords[:, 1]) * self.dims + coords[:, 2]
+
+        # 位置非有限的粒子不进入索引
+        indexed = np.flatnonzero(valid)
+        self.cell_id = cell_id
+        self._set_order(indexed[np.argsort(cell_id[indexed], kind='stable')])
+
+    def _set_order(self, order):
+        self.order = order
+        self.cell_count = np.bincount(self.cell_id[order], minlength=self.dims ** 3)
+        self.cell_start = np.cumsum(self.cell_count) - self.cell_count
+
+    def subset(self, mask):
+        """只包含 mask 为真的粒子的索引, 沿用已排好的顺序, 无需重新排序"""
+        view = object.__new__(CellList)
+        view.__dict__.update(self.__dict__)
+        view._set_order(self.order[np.asarray(mask, dtype=bool)[self.order]])
+        return view
+
+    def cells_of(self, rows):
+        """rows 中的粒子所在网格的掩码"""
+        cells = np.zeros(self.dims ** 3, dtype=bool)
+        cells[self.cell_id[np.asarray(rows, dtype=np.int64)]] = True
+        return cells
+
+    def _cell_pairs(self, radius, cells=None):
+        """返回距离可能小于 radius 的网格对 (a, b), 每个无序网格对只出现一次
+
+        给出网格掩码 cells 时只返回至少一端在掩码内的网格对, 代价与掩码内的网格数成正比.
+        """
+        reach = max(1, int(math.ceil(radius / self.cell_size)))
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+        # 字典序不小于 (0, 0, 0) 的一半偏移; 只保留网格间最近距离小于 radius 的偏移
+        positive = (offsets[:, 0] > 0) | ((offsets[:, 0] == 0) & (
+                (offsets[:, 1] > 0) | ((offsets[:, 1] == 0) & (offsets[:, 2] >= 0))))
+        gap = np.maximum(np.abs(offsets) - 1, 0) * self.cell_size
+        near = np.sqrt((gap ** 2).sum(axis=1)) < radius
+        if cells is None:
+            sources = np.flatnonzero(self.cell_count)
+            offsets, positive = offsets[positive & near], positive[positive & near]
+        else:
+            # 从掩码内的网格出发走全部偏移; 两端都在掩码内的网格对只从正向偏移一侧取
+            sources = np.flatnonzero(np.asarray(cells, dtype=bool) & (self.cell_count > 0))
+            offsets, positive = offsets[near], positive[near]
+
+        source_coords = np.stack(np.unravel_index(sources, (self.dims,) * 3), axis=-1)
+        first, second = [], []
+        # 一次处理一组偏移 (偏移在外层), 结果顺序与逐个偏移处理相同
+        group = max(1, MAX_CANDIDATE_PAIRS // max(len(sources), 1))
+        for start in range(0, len(offsets), group):
+            neighbor = source_coords[np.newaxis] + offsets[start:start + group, np.newaxis]
+            inside = ((neighbor >= 0) & (neighbor < self.dims)).all(axis=2)
+            neighbor_id = np.ravel_multi_index(tuple(neighbor[inside].T), (self.dims,) * 3)
+            filled = self.cell_count[neighbor_id] > 0
+            if cells is not None:
+                backward = ~np.broadcast_to(positive[start:start + group, np.newaxis], inside.shape)[inside]
+                filled &= ~(backward & cells[neighbor_id])
+            first.append(np.broadcast_to(sources, inside.shape)[inside][filled])
+            second.append(neighbor_id[filled])
+        if not first:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(first), np.concatenate(second)
+
+    def candidate_batches(self, radius, max_pairs=MAX_CANDIDATE_PAIRS, cells=None):
+        """把距离可能小于 radius 的网格对分批, 每批展开后约 max_pairs 个粒子对; 返回 [(a, b), ...]
+
+        分批只取决于索引, max_pairs 与 cells (见 _cell_pairs), 与之后用几个线程展开无关.
+        """
+        cell_a, cell_b = self._cell_pairs(radius, cells)
+        if len(cell_a) == 0:
+            return []
+        pair_counts = self.cell_count[cell_a] * self.cell_count[cell_b]
+        batch_id = np.cumsum(pair_counts) // max(int(max_pairs), 1)
+        boundaries = np.flatnonzero(np.diff(batch_id)) + 1
+        return [(cell_a[batch], cell_b[batch]) for batch in np.split(np.arange(len(cell_a)), boundaries)]
+
+    def batch_pairs(self, batch):
+        """把一批网格对展开为粒子对 (i, j), 满足 i < j; 不修改索引, 可在多个线程中同时调用"""
+        a, b = batch
+        first, second = self._expand(a, b, self.cell_start[a], self.cell_start[b])
+        i = self.order[first]
+        j = self.order[second]
+        return np.minimum(i, j), np.maximum(i, j)
+
+    def batch_pairs_compact(self, batch):
+        """与 batch_pairs 相同的粒子对, 另外返回这批涉及的行 rows 以及 i, j 在 rows 中的下标
+
+        rows 由这批网格的粒子段拼接而成, 调用方可以把每批的结果累加到长度为 len(rows) 的缓冲中,
+        代价只与这批的粒子对数有关. 返回 (i, j, rows, local_i, local_j).
+        这批涉及超过一半的行时 rows 取全部行, 局部下标就是行号, 省去换算.
+        """
+        rows, first, second = self.batch_local_pairs(batch)
+        i, j = rows[first], rows[second]
+        if rows is self.order:
+            i, j = np.minimum(i, j), np.maximum(i, j)
+            return i, j, np.arange(len(self.cell_id)), i, j
+        swap = i > j
+        return (np.where(swap, j, i), np.where(swap, i, j), rows,
+                np.where(swap, second, first), np.where(swap, first, second))
+
+    def batch_local_pairs(self, batch):
+        """与 batch_pairs 顺序相同的粒子对, 以 (rows, first, second) 给出: 两端为 rows[first], rows[second]
+
+        不交换两端, 不保证 rows[first] < rows[second]; rows 为这批涉及的行 (涉及超过一半的行时为全部已索引的行).
+        """
+        a, b = batch
+        cells, inverse = np.unique(np.concatenate((a, b)), return_inverse=True)
+        counts = self.cell_count[cells]
+        if 2 * counts.sum() > len(self.cell_id):
+            first, second = self._expand(a, b, self.cell_start[a], self.cell_start[b])
+            return self.order, first, second
+        local_start = np.cumsum(counts) - counts
+        rows = self.order[expand_ranges(self.cell_start[cells], counts)]
+        first, second = self._expand(a, b, local_start[inverse[:len(a)]], local_start[inverse[len(a):]])
+        return rows, first, second
+
+    def _expand(self, a, b, start_a, start_b):
+        # 网格对 (a, b) 展开后两端在粒子段中的位置, 段的起点分别为 start_a, start_b; 同一网格内只保留一半
+        na, nb = self.cell_count[a], self.cell_count[b]
+        owner = np.repeat(np.arange(len(a)), na)
+        first = expand_ranges(start_a, na)
+        second = expand_ranges(start_b[owner], nb[owner])
+        first = np.repeat(first, nb[owner])
+        same_cell = np.repeat(a == b, na * nb)
+        keep = ~same_cell | (first < second)
+        return first[keep], second[keep]
+
+    def candidate_pairs(self, radius, max_pairs=MAX_CANDIDATE_PAIRS):
+        """分批生成可能相距小于 radius 的粒子对 (i, j), 满足 i < j 且每对只出现一次
+
+        候选对只按网格筛选, 调用方仍需检查实际距离.
+        """
+        for batch in self.candidate_batches(radius, max_pairs):
+            i, j = self.batch_pairs(batch)
+            self.stats['pairs_tested'] += len(i)
+            yield i, j
+
+    def pairs_within(self, radius, positions=None, skin=0.0, threads=1, max_pairs=MAX_CANDIDATE_PAIRS):
+        """返回实际距离不超过 radius 的全部粒子对, 按 (i, j) 字典序排列
+
+        positions 可传入索引建立之后移动过的位置, 此时 skin 应不小于两粒子相对位移的上限,
+        候选对按 radius + skin 从索引中取出, 再按新位置精确筛选. 各批候选对在 threads 个线程中并行筛选.
+        """
+        positions = self.positions if positions is None else np.asarray(positions, dtype=np.float64)
+
+        def close_pairs(batch):
+            i, j = self.batch_pairs(batch)
+            distance = np.linalg.norm(positions[j] - positions[i], axis=1)
+            close = distance <= radius
+            return len(i), i[close], j[close]
+
+        found_i, found_j = [], []
+        for tested, i, j in ordered_map(close_pairs, self.candidate_batches(radius + skin, max_pairs), threads):
+            self.stats['pairs_tested'] += tested
+            found_i.append(i)
+            found_j.append(j)
+        if not found_i:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        i, j = np.concatenate(found_i), np.concatenate(found_j)
+        order = np.lexsort((j, i))
+        return i[order], j[order]
@@ -0,0 +1,96 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from checkpoint import (CHECKPOINT_MAGIC, CHECKPOINT_VERSION, CheckpointError, load_checkpoint, save_checkpoint,
+                        save_checkpoint_in_background)
+from cosmic_engine import Universe, physics_step
+from event_log import EventLog
+
+
+def running_universe(steps=3):
+    """有反应事件的小宇宙; 事件日志很快落盘, 检查点因此同时包含内存中的事件和落盘的事件"""
+    universe = Universe({'seed': 3, 'num_particles': 2000, 'interaction_distance': 1.0, 'fusion_probability': 0.5,
+                         'structure_formation_probability': 0.5, 'compute_backend': 'numpy', 'integrator': 'euler'})
+    universe.state['interaction_events'] = EventLog(chunk_size=8, memory_limit=16)
+    universe.step(steps)
+    assert universe.state['interaction_events'].spilled_count > 0
+    return universe.state
+
+
+def assert_same_state(state, expected):
+    store, expected_store = state['particles'], expected['particles']
+    assert store.column_names == expected_store.column_names
+    for name in store.column_names:
+        assert np.array_equal(getattr(store, name), getattr(expected_store, name)), name
+    events = np.concatenate(list(state['interaction_events'].iter_chunks()))
+    expected_events = np.concatenate(list(expected['interaction_events'].iter_chunks()))
+    assert np.array_equal(events, expected_events)
+    for key in ('time', 'scale_factor', 'event_counter', 'particle_counter'):
+        assert state[key] == expected[key]
+    assert state['rng'].bit_generator.state == expected['rng'].bit_generator.state
+
+
+def test_euler_resume_is_bit_exact(tmp_path):
+    """从检查点继续模拟, 与不中断地模拟逐位一致"""
+    path = str(tmp_path / 'run.cosmosckpt')
+    state = running_universe()
+    save_checkpoint(path, state)
+    resumed = load_checkpoint(path)
+    for _ in range(3):
+        physics_step(state)
+        physics_step(resumed)
+    assert_same_state(resumed, state)
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_save_over_loaded_checkpoint(tmp_path, background):
+    """读回的状态仍映射着原文件时, 可以把它 (继续模拟后) 保存回同一个文件"""
+    path = str(tmp_path / 'run.cosmosckpt')
+    save_checkpoint(path, running_universe())
+    loaded = load_checkpoint(path)
+    assert mapped_arrays(loaded, path)
+    physics_step(loaded)
+    if background:
+        errors = []
+        save_checkpoint_in_background(path, loaded, lambda file_path, error: errors.append(error)).join()
+        assert errors == [None]
+    else:
+        save_checkpoint(path, loaded)
+    # Windows 上无法替换仍被映射的文件, 因此保存后不应再有映射指向它
+    assert not mapped_arrays(loaded, path)
+    assert_same_state(load_checkpoint(path), loaded)
+
+
+def mapped_arrays(state, path):
+    """state 中仍映射着 path 的粒子列和落盘事件块"""
+    store = state['particles']
+    arrays = [getattr(store, name) for name in store.column_names]
+    arrays += [entry[0] for entry in state['interaction_events'].spilled_chunks()]
+    return [array for array in arrays if getattr(array, 'filename', None) and os.path.samefile(array.filename, path)]
+
+
+def rewrite_prefix(path, **fields):
+    with open(path, 'r+b') as f:
+        prefix = struct.Struct('<8sIQQ')
+        values = dict(zip(('magic', 'version', 'header_offset', 'header_length'), prefix.unpack(f.read(prefix.size))))
+        values.update(fields)
+        f.seek(0)
+        f.write(prefix.pack(values['magic'], values['version'], values['header_offset'], values['header_length']))
+
+
+@pytest.mark.parametrize('damage, message', [
+    (lambda path: rewrite_prefix(path, magic=b'NOTCKPT!'), "不是宇宙模拟器检查点"),
+    (lambda path: rewrite_prefix(path, version=CHECKPOINT_VERSION + 1), "不支持的检查点版本"),
+    (lambda path: open(path, 'r+b').truncate(len(CHECKPOINT_MAGIC) + 4), "不完整"),
+    (lambda path: rewrite_prefix(path, header_length=7), "文件头损坏"),
+])
+def test_damaged_checkpoint_raises(tmp_path, damage, message):
+    """魔数, 版本或文件头不对时抛出 CheckpointError, 而不是其它异常"""
+    path = str(tmp_path / 'run.cosmosckpt')
+    save_checkpoint(path, running_universe(steps=1))
+    damage(path)
+    with pytest.raises(CheckpointError, match=message):
+        load_checkpoint(path)
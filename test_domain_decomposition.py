@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import domain_decomposition
+from cosmic_engine import apply_cosmos_config, initialize_simulator_state
+from domain_decomposition import DomainDecomposedUniverse, DomainGrid, DomainWorker
+
+
+CONFIG = dict(num_particles=1500, seed=7, dark_matter_ratio=0.2, dark_energy_ratio=0.1, baryonic_ratio=0.7,
+              interaction_distance=0.6, fusion_probability=0.5, gravitational_constant=1e-3, compute_threads=1)
+SHAPES = [(2, 2, 2), (3, 1, 1)]
+
+
+class InProcessUniverse(DomainDecomposedUniverse):
+    """在本进程中依次调用各子域的 DomainWorker, 便于检查每个子域算出的受力"""
+
+    def __init__(self, config, shape):
+        self.state = apply_cosmos_config(initialize_simulator_state(), config)
+        self.state['particle_counter'] = self.state['num_particles']
+        self.grid = DomainGrid(shape, self.state['max_position'])
+        self.domain_particle_counts = np.zeros(self.grid.count, dtype=np.int64)
+        self.workers = [DomainWorker(config, self.grid, domain) for domain in range(self.grid.count)]
+
+    def _call(self, method, args_per_domain):
+        return [getattr(worker, method)(*args) for worker, args in zip(self.workers, args_per_domain)]
+
+
+def gathered(shape, steps=6):
+    with DomainDecomposedUniverse(CONFIG, shape) as universe:
+        universe.step(steps)
+        return universe.gather_particles(), universe.summary()['event_counts']
+
+
+def test_result_independent_of_decomposition():
+    """1 个, 2x2x2 和 3x1x1 个子域演化后汇总的粒子与事件计数逐位一致"""
+    particles, events = gathered(1)
+    assert events
+    for shape in SHAPES:
+        other_particles, other_events = gathered(shape)
+        assert other_events == events, shape
+        assert sorted(other_particles) == sorted(particles)
+        for name, column in particles.items():
+            assert np.array_equal(other_particles[name], column), (shape, name)
+
+
+def recorded_forces(shape, steps, monkeypatch):
+    """每步各粒子积分时的受力, 按粒子编号排序; 返回 [(编号, 受力), ...]"""
+    steps_seen = []
+    integrate = domain_decomposition.integrate_particles
+
+    def record(state, force, dt):
+        steps_seen[-1].append((state['particles'].particle_id.copy(), np.array(force)))
+        return integrate(state, force, dt)
+
+    monkeypatch.setattr(domain_decomposition, 'integrate_particles', record)
+    universe = InProcessUniverse(CONFIG, shape)
+    for _ in range(steps):
+        steps_seen.append([])
+        universe.step(1)
+    result = []
+    for parts in steps_seen:
+        ids = np.concatenate([part[0] for part in parts])
+        forces = np.concatenate([part[1] for part in parts])
+        order = np.argsort(ids)
+        result.append((ids[order], forces[order]))
+    return result
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_forces_independent_of_decomposition(shape, monkeypatch):
+    """每个粒子受到的引力与子域划分无关: 晕区 (含本步迁出的粒子) 提供了截断距离内的全部引力源
+
+    欧拉积分的位移上限会掩盖很小的受力差异, 因此直接比较每一步的受力.
+    """
+    expected = recorded_forces((1, 1, 1), 4, monkeypatch)
+    for step, ((ids, forces), (expected_ids, expected_forces)) in enumerate(
+            zip(recorded_forces(shape, 4, monkeypatch), expected)):
+        assert np.array_equal(ids, expected_ids), step
+        assert np.array_equal(forces, expected_forces), step
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from event_log import EVENT_DTYPE, EVENT_TYPES, EventLog
+
+
+def fill(log, count, seed=1):
+    """按时间非递减追加 count 个随机事件, 返回追加的事件 (用于对照); 时间戳有重复, 便于检查区间边界"""
+    rng = np.random.default_rng(seed)
+    events = np.zeros(count, dtype=EVENT_DTYPE)
+    events['event_id'] = np.arange(count)
+    events['event_type'] = rng.integers(0, len(EVENT_TYPES), count)
+    events['timestamp'] = np.sort(rng.integers(0, count // 3, count))
+    events['position'] = rng.random((count, 3))
+    events['particles_in'] = rng.integers(0, 1000, (count, 2))
+    # 分几次追加, 每次的长度与块大小不对齐
+    for start in range(0, count, 150):
+        part = events[start:start + 150]
+        log.extend(part['event_id'], part['event_type'], part['timestamp'], part['position'], part['energy'],
+                   part['particles_in'], part['particles_out'][:, 0])
+    return events
+
+
+def expected_matches(events, event_type, t_min, t_max):
+    keep = np.ones(len(events), dtype=bool)
+    if event_type is not None:
+        keep &= events['event_type'] == EVENT_TYPES.index(event_type)
+    if t_min is not None:
+        keep &= events['timestamp'] >= t_min
+    if t_max is not None:
+        keep &= events['timestamp'] <= t_max
+    return events[keep]
+
+
+def test_spill_keeps_every_event_in_order(tmp_path):
+    """超过内存上限的整块写入落盘文件, 读回的事件与追加顺序一致"""
+    log = EventLog(chunk_size=64, memory_limit=256, spill_path=str(tmp_path / 'events.npy'))
+    events = fill(log, 1000)
+    assert log.spilled_count > 0 and log.memory_count <= 256 + 64
+    assert len(log) == 1000
+    assert np.array_equal(np.concatenate(list(log.iter_chunks())), events)
+    assert log.type_counts() == {name: int(np.sum(events['event_type'] == code))
+                                 for code, name in enumerate(EVENT_TYPES) if np.any(events['event_type'] == code)}
+
+
+def test_attached_spilled_chunks_read_back(tmp_path):
+    """spilled_chunks 交给另一个日志的 attach_spilled 后, 按原样读回落盘的事件"""
+    log = EventLog(chunk_size=64, memory_limit=256, spill_path=str(tmp_path / 'events.npy'))
+    events = fill(log, 1000)
+    reloaded = EventLog()
+    reloaded.attach_spilled(log.spilled_chunks())
+    assert len(reloaded) == log.spilled_count
+    assert np.array_equal(np.concatenate(list(reloaded.iter_chunks())), events[:log.spilled_count])
+    with pytest.raises(ValueError):
+        reloaded.attach_spilled(log.spilled_chunks())
+
+
+@pytest.mark.parametrize('event_type', [None, 'star_formation'])
+@pytest.mark.parametrize('t_min, t_max', [(None, None), (10, None), (None, 200), (17, 18), (50.5, 250), (400, 10)])
+def test_count_and_select_over_chunk_boundaries(tmp_path, event_type, t_min, t_max):
+    """按类型和时间范围计数 / 筛选, 跨越落盘块与内存块边界的结果与逐条比较一致"""
+    log = EventLog(chunk_size=64, memory_limit=256, spill_path=str(tmp_path / 'events.npy'))
+    events = fill(log, 1000)
+    expected = expected_matches(events, event_type, t_min, t_max)
+    assert log.count(event_type, t_min, t_max) == len(expected)
+    assert np.array_equal(log.select(event_type, t_min, t_max), expected)
+
+
+def test_close_removes_temporary_spill_file():
+    """未指定 spill_path 时落盘到临时文件, close 时删除"""
+    log = EventLog(chunk_size=16, memory_limit=16)
+    fill(log, 100)
+    path = log.spill_path
+    log.close()
+    assert len(log) == 0
+    assert not os.path.exists(path)
@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+import pytest
+
+from backends import available_backends, get_backend
+from cosmic_engine import (STEP_DT, TYPE_CODES, TYPE_MASS, create_stable_particles, initialize_particles,
+                           initialize_simulator_state, physics_step, system_energy)
+from gravity import GRAVITY_MAX_DISTANCE, GRAVITY_SOFTENING
+from spatial_index import CellList
+
+
+GRAVITATIONAL_CONSTANT = 1e-3
+PARALLEL_BACKENDS = [name for name in available_backends() if name != 'reference']
+
+
+def random_particles(count, seed=1):
+    """密度与 cl_bench 相同的随机粒子, 每十个中有一个无质量粒子; 返回 (positions, masses, half_extent)"""
+    rng = np.random.default_rng(seed)
+    half = (count / 2000) ** (1 / 3) * 6
+    positions = rng.uniform(-half, half, (count, 3))
+    masses = rng.uniform(0.5, 2.0, count)
+    masses[::10] = 0.0
+    return positions, masses, half
+
+
+def gravity(backend, solver, positions, masses, half, threads=1):
+    if solver == 'direct':
+        return backend.direct_gravity(positions, masses, GRAVITATIONAL_CONSTANT, threads)
+    index = CellList(positions, GRAVITY_MAX_DISTANCE / 3, half)
+    return backend.cell_list_gravity(positions, masses, GRAVITATIONAL_CONSTANT, index, threads)
+
+
+@pytest.mark.parametrize('solver', ['direct', 'cell_list'])
+@pytest.mark.parametrize('name', PARALLEL_BACKENDS)
+def test_backend_matches_reference(name, solver):
+    """各后端的引力与参考实现在浮点误差范围内一致"""
+    positions, masses, half = random_particles(400)
+    expected = gravity(get_backend('reference'), solver, positions, masses, half)
+    forces = gravity(get_backend(name), solver, positions, masses, half)
+    np.testing.assert_allclose(forces, expected, rtol=1e-5, atol=1e-5 * np.abs(expected).max())
+
+
+@pytest.mark.parametrize('solver', ['direct', 'cell_list'])
+@pytest.mark.parametrize('name', PARALLEL_BACKENDS)
+def test_forces_independent_of_thread_count(name, solver):
+    """1 个线程与 4 个线程给出逐位相同的引力; 粒子数足以分成多批"""
+    positions, masses, half = random_particles(3000)
+    assert len(CellList(positions, GRAVITY_MAX_DISTANCE / 3, half).candidate_batches(GRAVITY_MAX_DISTANCE)) > 1
+    backend = get_backend(name)
+    single = gravity(backend, solver, positions, masses, half, threads=1)
+    parallel = gravity(backend, solver, positions, masses, half, threads=4)
+    assert np.array_equal(single, parallel)
+
+
+def test_leapfrog_energy_drift():
+    """偏心的两体轨道 (近心点仍在 r > 0.3 的窗口内) 用蛙跳积分 20 步, 能量相对误差保持在 2% 以内"""
+    state = initialize_simulator_state()
+    state.update(num_particles=0, fusion_probability=0.0, structure_formation_probability=0.0, expansion_rate=0.0,
+                 integrator='leapfrog', compute_backend='numpy', gravitational_constant=1e-16, seed=1)
+    initialize_particles(state)
+    mass = TYPE_MASS[TYPE_CODES['DARK_MATTER']]
+    # 相距 2 的圆轨道速度的 0.7 倍; 速度为 momentum / energy
+    acceleration = state['gravitational_constant'] * mass * mass / (4 + GRAVITY_SOFTENING) / (mass + 0.001)
+    speed = 0.7 * math.sqrt(acceleration * STEP_DT ** 2)
+    momentum = speed * mass / math.sqrt(1 - speed * speed)
+    create_stable_particles(state, [[-1, 0, 0], [1, 0, 0]], [[0, -momentum, 0], [0, momentum, 0]],
+                            [TYPE_CODES['DARK_MATTER']] * 2, [0, 1])
+
+    initial = system_energy(state)
+    drift = 0.0
+    for _ in range(20):
+        physics_step(state)
+        drift = max(drift, abs(system_energy(state) - initial) / abs(initial))
+    assert len(state['particles']) == 2
+    assert drift < 0.02
@@ -0,0 +1,71 @@
+import numpy as np
+
+import cosmic_engine
+from backends import get_backend
+from cosmic_engine import (TYPE_CODES, create_stable_particles, initialize_particles, initialize_simulator_state,
+                           physics_step)
+
+
+def lattice_universe():
+    """晶格上随机运动的暗物质粒子加一对靠得很近的粒子: 蛙跳积分时各粒子分散在不同的步长级别上"""
+    state = initialize_simulator_state()
+    state.update(num_particles=0, fusion_probability=0.0, structure_formation_probability=0.0, expansion_rate=0.0,
+                 integrator='leapfrog', compute_backend='numpy', gravitational_constant=1e-17, seed=1)
+    initialize_particles(state)
+    steps = np.arange(-4.5, 5, 1.5)
+    lattice = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+    lattice += np.random.default_rng(2).uniform(-0.3, 0.3, lattice.shape)
+    positions = np.concatenate([lattice, [[0.2, 0.0, 0.0], [0.2, 0.4, 0.0]]])
+    count = len(positions)
+    # 平均每步移动约 0.4, 邻居索引在两次重建之间确实过时
+    momenta = np.random.default_rng(3).normal(0.0, 0.3, (count, 3))
+    create_stable_particles(state, positions, momenta, [TYPE_CODES['DARK_MATTER']] * count, np.arange(count))
+    return state
+
+
+def recorded_evaluations(state, monkeypatch, steps=2):
+    """蛙跳积分 steps 步, 记录邻居索引的建立次数和每次求力的 (位置, 受力粒子, 受力, 检查的粒子对数)"""
+    builds, evaluations = [], []
+    build = cosmic_engine.build_neighbor_index
+    evaluate = cosmic_engine.gravity_forces
+
+    def counting_build(*args, **kwargs):
+        builds.append(1)
+        return build(*args, **kwargs)
+
+    def recording_evaluate(state, positions, masses, neighbor_index, targets=None):
+        before = neighbor_index.stats['pairs_tested']
+        forces = evaluate(state, positions, masses, neighbor_index, targets)
+        rows = np.arange(len(positions)) if targets is None else np.asarray(targets)
+        evaluations.append((positions.copy(), rows, forces, neighbor_index.stats['pairs_tested'] - before))
+        return forces
+
+    monkeypatch.setattr(cosmic_engine, 'build_neighbor_index', counting_build)
+    monkeypatch.setattr(cosmic_engine, 'gravity_forces', recording_evaluate)
+    for _ in range(steps):
+        physics_step(state)
+    return len(builds), evaluations
+
+
+def test_substep_cost_scales_with_active_particles(monkeypatch):
+    """邻居索引在小步间复用; 每个小步检查的粒子对数与该小步受力的粒子数成正比, 而不是总粒子数"""
+    state = lattice_universe()
+    count = len(state['particles'])
+    builds, evaluations = recorded_evaluations(state, monkeypatch)
+    assert builds < len(evaluations) / 2
+    full = max(tested for _, rows, _, tested in evaluations if len(rows) == count)
+    small = [(len(rows), tested) for _, rows, _, tested in evaluations if len(rows) <= count // 10]
+    assert small
+    for targets, tested in small:
+        assert tested <= 4 * targets * full / count, (targets, tested)
+
+
+def test_reused_index_gives_window_forces(monkeypatch):
+    """用建立后粒子已移动的邻居索引求出的受力, 与当时位置上的直接求和一致"""
+    state = lattice_universe()
+    masses = state['particles'].mass
+    _, evaluations = recorded_evaluations(state, monkeypatch)
+    backend = get_backend('numpy')
+    for positions, rows, forces, _ in evaluations:
+        expected = backend.direct_gravity(positions, masses, state['gravitational_constant'])[rows]
+        np.testing.assert_allclose(forces, expected, rtol=1e-5, atol=1e-5 * np.abs(expected).max())
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from cosmic_engine import PARTICLE_TYPES, REACTION_TABLE, TYPE_CODES, TYPE_MASS
+from event_log import EVENT_TYPE_CODES
+from reactions import REACTION_RULES, ReactionError, ReactionRule, ReactionTable
+
+
+ROLLS = np.linspace(0.0, 1.0, 40, endpoint=False)
+
+
+def baseline_fusion(type_i, type_j, accept_rolls, product_rolls, fusion_probability):
+    """反应表之前的聚变逻辑 (氢 / 氦粒子对按 fusion_probability 聚变, 产物按总质量决定); 返回 (接受, 产物, 事件)"""
+    fusible = np.isin([type_i, type_j], [TYPE_CODES["HYDROGEN"], TYPE_CODES["HELIUM"]]).all()
+    accepted = fusible & (accept_rolls < fusion_probability)
+    total_mass = TYPE_MASS[type_i] + TYPE_MASS[type_j]
+    star = (total_mass > 20.0) & (product_rolls < 0.05)
+    new_types = np.where(star, TYPE_CODES["STAR"],
+                         np.where(total_mass > 2.0, TYPE_CODES["HELIUM"], TYPE_CODES["HYDROGEN"]))
+    event_codes = np.where(star, EVENT_TYPE_CODES["star_formation"], EVENT_TYPE_CODES["nuclear_fusion"])
+    return accepted, new_types, event_codes
+
+
+def pair_grid():
+    """全部类型对与 ROLLS 的组合; 返回 (type_i, type_j, 接受随机数, 产物随机数), 产物随机数与接受随机数错开"""
+    count = len(PARTICLE_TYPES)
+    type_i, type_j, accept_rolls = np.meshgrid(np.arange(count), np.arange(count), ROLLS, indexing='ij')
+    accept_rolls = accept_rolls.ravel()
+    return type_i.ravel(), type_j.ravel(), accept_rolls, np.roll(accept_rolls, 7)
+
+
+@pytest.mark.parametrize('fusion_probability', [0.0, 0.1, 0.5, 1.0])
+def test_fusion_matches_baseline(fusion_probability):
+    """结构形成概率为 0 时, 每个类型对的接受判定, 产物与事件类型都与反应表之前的聚变逻辑一致"""
+    state = {'fusion_probability': fusion_probability, 'structure_formation_probability': 0.0,
+             'interaction_distance': 0.6}
+    type_i, type_j, accept_rolls, product_rolls = pair_grid()
+    rules = REACTION_TABLE.rule_of[type_i, type_j]
+    accepted = REACTION_TABLE.accept(state, rules, accept_rolls)
+    new_types, event_codes = REACTION_TABLE.products(rules[accepted], product_rolls[accepted])
+
+    expected = [baseline_fusion(a, b, accept_rolls[k:k + 1], product_rolls[k:k + 1], fusion_probability)
+                for k, (a, b) in enumerate(zip(type_i, type_j))]
+    expected_accepted = np.concatenate([entry[0] for entry in expected])
+    assert np.array_equal(accepted, expected_accepted)
+    assert np.array_equal(new_types, np.concatenate([entry[1] for entry in expected])[expected_accepted])
+    assert np.array_equal(event_codes, np.concatenate([entry[2] for entry in expected])[expected_accepted])
+
+
+def test_structure_channels():
+    """结构形成规则: 产物按累计份额选择, 星系并合只在一半的反应距离内发生"""
+    state = {'fusion_probability': 0.0, 'structure_formation_probability': 1.0, 'interaction_distance': 0.6}
+    star_pair = np.full(len(ROLLS), REACTION_TABLE.rule_of[TYPE_CODES['STAR'], TYPE_CODES['STAR']])
+    new_types, event_codes = REACTION_TABLE.products(star_pair, ROLLS)
+    black_hole = ROLLS >= 0.95
+    assert np.array_equal(new_types, np.where(black_hole, TYPE_CODES['BLACK_HOLE'], TYPE_CODES['GALAXY']))
+    assert np.array_equal(event_codes, np.where(black_hole, EVENT_TYPE_CODES['black_hole_formation'],
+                                                EVENT_TYPE_CODES['galaxy_formation']))
+
+    rules = REACTION_TABLE.rule_of[[TYPE_CODES['GALAXY'], TYPE_CODES['GALAXY'], TYPE_CODES['HELIUM']],
+                                   [TYPE_CODES['GALAXY'], TYPE_CODES['GALAXY'], TYPE_CODES['DARK_MATTER']]]
+    distances = np.array([0.29, 0.31, 0.59])
+    accepted = REACTION_TABLE.accept(state, rules, np.zeros(3), lambda rows: distances[rows])
+    assert accepted.tolist() == [True, False, True]
+    assert REACTION_TABLE.reach(state) == 0.6
+
+
+@pytest.mark.parametrize('rule, message', [
+    (ReactionRule(('HYDROGEN',), (('HELIUM', 'nuclear_fusion', 1.0),), 'fusion_probability', 1.0), "两个输入"),
+    (ReactionRule(('HYDROGEN', 'AXION'), (('HELIUM', 'nuclear_fusion', 1.0),), 'fusion_probability', 1.0), "未知的粒子"),
+    (ReactionRule(('HYDROGEN', 'HELIUM'), (('HELIUM', 'fission', 1.0),), 'fusion_probability', 1.0), "未知的事件"),
+    (ReactionRule(('HYDROGEN', 'HELIUM'), (('HELIUM', 'nuclear_fusion', 0.5),), 'fusion_probability', 1.0), "份额"),
+    (ReactionRule(('HYDROGEN', 'HELIUM'), (('HELIUM', 'nuclear_fusion', 1.0),), 'fusion_probability', 0.0), "距离"),
+    (ReactionRule(('HELIUM', 'HYDROGEN'), (('HELIUM', 'nuclear_fusion', 1.0),), 'fusion_probability', 1.0), "重复"),
+])
+def test_invalid_rules_raise(rule, message):
+    """无效或重复的规则在编译反应表时抛出 ReactionError"""
+    with pytest.raises(ReactionError, match=message):
+        ReactionTable(REACTION_RULES + (rule,), PARTICLE_TYPES)
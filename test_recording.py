@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from event_log import EVENT_DTYPE
+from recording import POSITION_LEVELS, _unpack_arrays, decode_chunk, encode_chunk, quantize_positions
+
+
+SCALE = 20.0
+
+
+def frame(ids, positions, time, events=0):
+    """录制时的一帧; 粒子类型由编号决定, 与反应产生新编号的粒子一致"""
+    ids = np.asarray(ids, dtype=np.int64)
+    recorded_events = np.zeros(events, dtype=EVENT_DTYPE)
+    recorded_events['event_id'] = np.arange(events) + 100 * time
+    return {
+        'ids': ids,
+        'types': (ids % 7).astype(np.int16),
+        'positions': np.asarray(positions, dtype=np.int16).reshape(-1, 3),
+        'time': float(time),
+        'cosmic_age': 0.5 * time,
+        'scale_factor': 1.0 + 0.01 * time,
+        'event_total': 10 * time,
+        'events': recorded_events,
+    }
+
+
+def changing_frames():
+    """粒子逐帧移动, 中间几帧有粒子消失, 新粒子出现, 顺序打乱, 全部消失后又出现"""
+    rng = np.random.default_rng(4)
+    ids = np.arange(50)
+    positions = rng.integers(-POSITION_LEVELS, POSITION_LEVELS, (50, 3))
+    frames = [frame(ids, positions, 0, events=2)]
+    for time in range(1, 12):
+        positions = positions + rng.integers(-300, 300, positions.shape)
+        if time in (3, 6):
+            # 两个粒子反应成一个新粒子; 第 6 帧的上一帧顺序已打乱
+            keep = ~np.isin(ids, [4, 17] if time == 3 else [9, 30])
+            ids, positions = np.append(ids[keep], 47 + time), np.vstack([positions[keep], [[0, 0, 0]]])
+        elif time == 5:
+            order = rng.permutation(len(ids))
+            ids, positions = ids[order], positions[order]
+        elif time == 7:
+            ids, positions = ids[:0], positions[:0]
+        elif time == 8:
+            ids, positions = np.arange(60, 90), rng.integers(-POSITION_LEVELS, POSITION_LEVELS, (30, 3))
+        # 量化坐标在边界处截断, 与录制时一致
+        positions = np.clip(positions, -POSITION_LEVELS, POSITION_LEVELS)
+        frames.append(frame(ids, positions, time, events=time % 3))
+    return frames
+
+
+@pytest.mark.parametrize('length', [1, 2, 12])
+def test_chunk_round_trip(length):
+    """编码再解码逐帧还原粒子编号, 类型, 量化坐标, 逐帧标量和事件; 包括粒子集合改变的帧"""
+    frames = changing_frames()[:length]
+    chunk = decode_chunk(encode_chunk(frames, SCALE))
+    assert chunk['scale'] == SCALE
+    assert len(chunk['frames']) == len(frames)
+    for k, (decoded, expected) in enumerate(zip(chunk['frames'], frames)):
+        for name in ('ids', 'types', 'positions'):
+            assert decoded[name].dtype == expected[name].dtype, (k, name)
+            assert np.array_equal(decoded[name], expected[name]), (k, name)
+    for name in ('time', 'cosmic_age', 'scale_factor', 'event_total'):
+        assert np.array_equal(chunk[name], [expected[name] for expected in frames]), name
+    assert np.array_equal(chunk['events'], np.concatenate([expected['events'] for expected in frames]))
+    assert np.array_equal(chunk['event_frame'],
+                          np.concatenate([np.full(len(expected['events']), k) for k, expected in enumerate(frames)]))
+
+
+def test_changed_frames_store_surviving_particles_as_differences():
+    """粒子集合改变 (有粒子反应, 顺序打乱) 的帧里, 仍在的粒子按编号与上一帧相减, 只有新粒子存绝对坐标"""
+    frames = changing_frames()[:7]
+    stored = _unpack_arrays(encode_chunk(frames, SCALE))
+    assert stored['changed'].tolist() == [True, False, False, True, False, True, True]
+    starts = np.cumsum(stored['counts']) - stored['counts']
+    for k in (3, 5, 6):
+        rows = stored['positions'][starts[k]:starts[k] + stored['counts'][k]]
+        surviving = np.isin(frames[k]['ids'], frames[k - 1]['ids'])
+        assert np.abs(rows[surviving].astype(np.int64)).max() < 600, k
+        assert np.array_equal(rows[~surviving], frames[k]['positions'][~surviving]), k
+
+
+def test_round_trip_across_int16_wraparound():
+    """坐标差超出 int16 范围时回绕相减, 解码后仍还原原坐标"""
+    ids = np.arange(3)
+    frames = [frame(ids, [[POSITION_LEVELS] * 3, [-POSITION_LEVELS] * 3, [0] * 3], 0),
+              frame(ids, [[-POSITION_LEVELS] * 3, [POSITION_LEVELS] * 3, [1] * 3], 1),
+              frame([2, 0, 5], [[-1] * 3, [POSITION_LEVELS] * 3, [-POSITION_LEVELS] * 3], 2)]
+    chunk = decode_chunk(encode_chunk(frames, SCALE))
+    for decoded, expected in zip(chunk['frames'], frames):
+        assert np.array_equal(decoded['ids'], expected['ids'])
+        assert np.array_equal(decoded['positions'], expected['positions'])
+
+
+def test_quantize_positions_error_bound():
+    """量化误差不超过 scale / (2 * POSITION_LEVELS), 范围外和非有限的坐标截断到边界"""
+    positions = np.random.default_rng(5).uniform(-SCALE, SCALE, (1000, 3))
+    restored = quantize_positions(positions, SCALE) * (SCALE / POSITION_LEVELS)
+    assert np.abs(restored - positions).max() <= SCALE / (2 * POSITION_LEVELS) + 1e-12
+    assert np.array_equal(quantize_positions([[2 * SCALE, -2 * SCALE, np.nan]], SCALE),
+                          [[POSITION_LEVELS, -POSITION_LEVELS, POSITION_LEVELS]])
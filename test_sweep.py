@@ -0,0 +1,17 @@
+import csv
+import io
+
+from cosmic_sweep import point_key, run_sweep
+
+
+def test_failed_point_does_not_stop_the_sweep(tmp_path):
+    """一个参数点出错时其它点照常写入结果表, 出错的点记入日志并在再次运行时重试"""
+    results = str(tmp_path / 'sweep.csv')
+    points = [{'integrator': 'euler'}, {'integrator': 'no_such_integrator'}, {'integrator': 'leapfrog'}]
+    log = io.StringIO()
+    assert run_sweep({'num_particles': 30}, points, 1, results, workers=2, log=log) == (2, 1)
+    assert point_key(points[1]) in log.getvalue()
+    with open(results, newline='', encoding='utf-8') as f:
+        assert sorted(row['point'] for row in csv.DictReader(f)) == sorted([point_key(points[0]),
+                                                                            point_key(points[2])])
+    assert run_sweep({'num_particles': 30}, points, 1, results, workers=2) == (0, 1)